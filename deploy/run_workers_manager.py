@@ -1,12 +1,46 @@
 #!/usr/bin/env python3
 """
-Simple manager que lanza y re-arranca todos los workers Python encontrados
-en `telegram-workers/workers/`. Diseñado para ejecutarse bajo systemd como
-un único servicio que supervisa los procesos hijos.
+Manager que lanza y supervisa los workers de `telegram-workers/workers/`
+declarados en `deploy/workers.json` (o WORKERS_MANIFEST). Diseñado para
+ejecutarse bajo systemd como un único servicio que supervisa los procesos hijos.
 
-Logs: escribe stdout/stderr en deploy/logs/<worker>.log
+Manifiesto: por worker `name`, `script` (relativo a workers/), `replicas`,
+`env` (admite `${VAR}` del entorno y `{replica}`) y, opcionalmente, los
+mismos tiempos que `defaults`:
+  - ready_timeout: segundos para el primer latido (readiness) tras arrancar
+  - liveness_timeout: antigüedad máxima del latido antes de reiniciar (0 = sin chequeo)
+  - drain_timeout: espera tras SIGTERM antes de SIGKILL
+  - backoff_initial / backoff_max: reinicios con backoff exponencial
+  - stable_after: una réplica que vivió este tiempo vuelve al backoff inicial
+
+Sesiones de Telegram: los workers corren con cwd en la raíz de la app y,
+por defecto, usan las mismas sesiones de siempre (TG_SESSION / TG_SESSIONS,
+sin sufijo); invitation_creator usa la suya en channel_manager/. Para dar a
+cada worker o réplica su propio archivo de sesión (sin 'database is locked'
+entre procesos):
+  1. crear y autorizar los archivos desde la raíz de la app:
+       TG_SESSION_SUFFIXES=_group,_remove1,_remove2 python telegram-workers/workers/authenticate.py
+     (los de invitation_creator, desde telegram-workers/workers/channel_manager/)
+  2. recién entonces agregar al `env` del worker el sufijo, p. ej.
+       "TG_SESSION_SUFFIX": "_remove{replica}"
+Una sesión no autorizada hace fallar el arranque y la réplica queda en backoff.
+`replicas` > 1 exige una sesión por réplica (`{replica}` en TG_SESSION o
+TG_SESSION_SUFFIX): sin eso todas abrirían el mismo SQLite y el manager
+lanza una sola réplica.
+
+El latido lo escribe cada worker con common/lifecycle.py en el archivo que
+indica WORKER_HEARTBEAT_FILE. Solo se lanza lo que está en el manifiesto
+(scripts de un solo uso como create_client.py o authenticate.py no).
+
+Un solo bucle no bloqueante: reaping con poll(), reinicios programados,
+chequeos de readiness/liveness y muestreo de CPU/RSS por réplica cada
+SAMPLE_INTERVAL s (log + logs/workers_status.json).
+
+Logs: escribe stdout/stderr en logs/<worker>-<réplica>.log
 """
 import os
+import sys
+import json
 import subprocess
 import time
 import signal
@@ -17,68 +51,258 @@ APP_DIR = BASE
 VENV_PY = APP_DIR / 'venv' / 'bin' / 'python'
 WORKERS_DIR = APP_DIR / 'telegram-workers' / 'workers'
 LOG_DIR = APP_DIR / 'logs'
+RUN_DIR = LOG_DIR / 'run'
+MANIFEST = Path(os.getenv('WORKERS_MANIFEST', str(BASE / 'deploy' / 'workers.json')))
+STATUS_FILE = LOG_DIR / 'workers_status.json'
+SAMPLE_INTERVAL = int(os.getenv('WORKERS_SAMPLE_INTERVAL', '30'))
+TICK = 0.5
+
+DEFAULTS = {
+    'replicas': 1,
+    'ready_timeout': 120,
+    'liveness_timeout': 90,
+    'drain_timeout': 30,
+    'backoff_initial': 1,
+    'backoff_max': 300,
+    'stable_after': 60,
+}
 
 os.makedirs(LOG_DIR, exist_ok=True)
+os.makedirs(RUN_DIR, exist_ok=True)
 
-PROCESS_MAP = {}
 SHUTDOWN = False
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def log(msg: str):
+    print(f"[manager] {msg}", flush=True)
+
+
+class Replica:
+    """Una réplica de un worker: proceso, estado y backoff."""
+
+    def __init__(self, spec: dict, index: int):
+        self.spec = spec
+        self.index = index
+        self.name = f"{spec['name']}#{index}"
+        self.script = WORKERS_DIR / spec['script']
+        self.logfile = LOG_DIR / f"{spec['name']}-{index}.log"
+        self.heartbeat = RUN_DIR / f"{spec['name']}-{index}.heartbeat"
+        self.proc = None
+        self.state = 'backoff'
+        self.started_at = 0.0
+        self.next_start = 0.0
+        self.kill_at = None
+        self.failures = 0
+        self.restarts = 0
+        self.cpu_percent = None
+        self.rss_mb = None
+        self._cpu_prev = None
 
-def start_worker(path: Path):
-    name = path.stem
-    logfile = LOG_DIR / f"{name}.log"
-    cmd = [str(VENV_PY), str(path)] if VENV_PY.exists() else ['python3', str(path)]
-    with open(logfile, 'ab') as f:
-        proc = subprocess.Popen(cmd, stdout=f, stderr=subprocess.STDOUT)
-    PROCESS_MAP[name] = (proc, path)
-    print(f"[manager] started {name} (pid={proc.pid})")
-
-def stop_all():
-    global SHUTDOWN
-    SHUTDOWN = True
-    for name, (proc, path) in PROCESS_MAP.items():
+    def env(self) -> dict:
+        env = dict(os.environ)
+        for key, value in self.spec.get('env', {}).items():
+            env[key] = os.path.expandvars(str(value)).replace('{replica}', str(self.index))
+        env['WORKER_HEARTBEAT_FILE'] = str(self.heartbeat)
+        env['WORKER_REPLICA'] = str(self.index)
+        env['PYTHONUNBUFFERED'] = '1'
+        return env
+
+    def start(self):
         try:
-            proc.terminate()
-        except Exception:
+            self.heartbeat.unlink()
+        except FileNotFoundError:
             pass
+        cmd = [str(VENV_PY), str(self.script)] if VENV_PY.exists() else [sys.executable, str(self.script)]
+        with open(self.logfile, 'ab') as f:
+            self.proc = subprocess.Popen(cmd, stdout=f, stderr=subprocess.STDOUT, env=self.env())
+        self.started_at = time.time()
+        self.state = 'starting'
+        self.kill_at = None
+        self._cpu_prev = None
+        log(f"started {self.name} (pid={self.proc.pid})")
 
-def reap_loop():
-    while not SHUTDOWN:
-        for name, (proc, path) in list(PROCESS_MAP.items()):
-            ret = proc.poll()
-            if ret is not None:
-                print(f"[manager] {name} exited with {ret}; restarting in 3s")
-                del PROCESS_MAP[name]
-                time.sleep(3)
-                if SHUTDOWN:
-                    break
-                start_worker(path)
-        time.sleep(1)
-
-def find_workers():
-    if not WORKERS_DIR.exists():
-        print(f"[manager] No existe {WORKERS_DIR}")
-        return []
-    scripts = []
-    for p in WORKERS_DIR.rglob('*.py'):
-        if p.name == '__init__.py':
+    def terminate(self, reason: str):
+        """SIGTERM (drain del worker) y SIGKILL si no sale en drain_timeout."""
+        if self.proc is None or self.kill_at is not None:
+            return
+        log(f"stopping {self.name} (pid={self.proc.pid}): {reason}")
+        try:
+            self.proc.terminate()
+        except ProcessLookupError:
+            pass
+        self.state = 'stopping'
+        self.kill_at = time.time() + self.spec['drain_timeout']
+
+    def heartbeat_age(self):
+        try:
+            return time.time() - self.heartbeat.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _reap(self, ret: int):
+        uptime = time.time() - self.started_at
+        if uptime >= self.spec['stable_after']:
+            self.failures = 0
+        self.failures += 1
+        delay = min(self.spec['backoff_max'], self.spec['backoff_initial'] * 2 ** (self.failures - 1))
+        log(f"{self.name} exited with {ret} after {uptime:.0f}s; restarting in {delay}s")
+        self.proc = None
+        self.state = 'backoff'
+        self.next_start = time.time() + delay
+        self.restarts += 1
+        self.cpu_percent = self.rss_mb = None
+
+    def tick(self):
+        now = time.time()
+        if self.proc is None:
+            if not SHUTDOWN and now >= self.next_start:
+                self.start()
+            return
+
+        ret = self.proc.poll()
+        if ret is not None:
+            self._reap(ret)
+            return
+
+        if self.kill_at is not None:
+            if now >= self.kill_at:
+                log(f"{self.name} no terminó en {self.spec['drain_timeout']}s; SIGKILL")
+                self.proc.kill()
+                self.kill_at = now + 5
+            return
+
+        age = self.heartbeat_age()
+        if self.state == 'starting':
+            if age is not None:
+                self.state = 'ready'
+                log(f"{self.name} ready in {now - self.started_at:.1f}s")
+            elif now - self.started_at > self.spec['ready_timeout']:
+                self.terminate(f"sin readiness en {self.spec['ready_timeout']}s")
+        elif self.state == 'ready':
+            timeout = self.spec['liveness_timeout']
+            if timeout and age is not None and age > timeout:
+                self.terminate(f"latido de hace {age:.0f}s (liveness {timeout}s)")
+
+    def sample(self):
+        """CPU (% de un núcleo desde la muestra anterior) y RSS desde /proc (solo Linux)."""
+        if self.proc is None:
+            return
+        pid = self.proc.pid
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            ticks = int(fields[11]) + int(fields[12])
+            with open(f"/proc/{pid}/status") as f:
+                rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        except (OSError, StopIteration, IndexError, ValueError):
+            return
+        now = time.monotonic()
+        if self._cpu_prev is not None:
+            prev_ticks, prev_at = self._cpu_prev
+            self.cpu_percent = round((ticks - prev_ticks) / CLK_TCK / max(now - prev_at, 1e-6) * 100, 1)
+        self._cpu_prev = (ticks, now)
+        self.rss_mb = round(rss_kb / 1024, 1)
+
+    def status(self) -> dict:
+        age = self.heartbeat_age()
+        return {
+            'pid': self.proc.pid if self.proc else None,
+            'state': self.state,
+            'restarts': self.restarts,
+            'uptime_s': round(time.time() - self.started_at) if self.proc else 0,
+            'heartbeat_age_s': round(age, 1) if age is not None else None,
+            'cpu_percent': self.cpu_percent,
+            'rss_mb': self.rss_mb,
+        }
+
+
+def per_replica_session(spec: dict) -> bool:
+    env = spec.get('env', {})
+    return any('{replica}' in str(env.get(key, '')) for key in ('TG_SESSION', 'TG_SESSION_SUFFIX'))
+
+
+def load_manifest(path: Path = None) -> list:
+    """Specs de workers con los defaults aplicados; ignora (con aviso) scripts inexistentes."""
+    with open(path or MANIFEST, encoding='utf-8') as f:
+        manifest = json.load(f)
+    defaults = {**DEFAULTS, **manifest.get('defaults', {})}
+    specs = []
+    for worker in manifest.get('workers', []):
+        spec = {**defaults, **worker}
+        if not (WORKERS_DIR / spec['script']).exists():
+            log(f"{spec['name']}: no existe {spec['script']}; se omite")
             continue
-        scripts.append(p)
-    return scripts
+        if spec['replicas'] > 1 and not per_replica_session(spec):
+            log(f"{spec['name']}: replicas={spec['replicas']} sin sesión por réplica "
+                f"({{replica}} en TG_SESSION_SUFFIX); se lanza 1 réplica")
+            spec['replicas'] = 1
+        specs.append(spec)
+    return specs
+
+
+def write_status(replicas):
+    status = {r.name: r.status() for r in replicas}
+    tmp = STATUS_FILE.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'at': time.time(), 'replicas': status}, f, indent=2)
+    os.replace(tmp, STATUS_FILE)
+    running = [r for r in replicas if r.rss_mb is not None]
+    total_rss = sum(r.rss_mb for r in running)
+    total_cpu = sum(r.cpu_percent or 0 for r in running)
+    log(f"{len(running)}/{len(replicas)} réplicas vivas, CPU {total_cpu:.1f}%, RSS {total_rss:.0f} MB | " +
+        ", ".join(f"{r.name}={r.state} {r.cpu_percent}% {r.rss_mb}MB" for r in replicas))
+
+
+def drain(replicas):
+    """SIGTERM a todas las réplicas y espera a que salgan (SIGKILL tras su drain_timeout)."""
+    for r in replicas:
+        r.terminate('apagado del manager')
+    while any(r.proc is not None for r in replicas):
+        for r in replicas:
+            if r.proc is None:
+                continue
+            ret = r.proc.poll()
+            if ret is not None:
+                log(f"{r.name} terminó con {ret}")
+                r.proc = None
+                r.state = 'stopped'
+                r.cpu_percent = r.rss_mb = None
+            elif time.time() >= r.kill_at:
+                log(f"{r.name} no terminó en {r.spec['drain_timeout']}s; SIGKILL")
+                r.proc.kill()
+                r.kill_at = time.time() + 5
+        time.sleep(0.2)
+
 
 def main():
-    scripts = find_workers()
-    if not scripts:
-        print('[manager] No se encontraron workers; saliendo')
+    specs = load_manifest()
+    if not specs:
+        log('No hay workers en el manifiesto; saliendo')
         return
-    for s in scripts:
-        start_worker(s)
+    replicas = [Replica(spec, i) for spec in specs for i in range(spec['replicas'])]
+    log(f"supervisando {len(replicas)} réplicas de {len(specs)} workers ({MANIFEST})")
+
+    next_sample = time.monotonic() + SAMPLE_INTERVAL
+    while not SHUTDOWN:
+        for r in replicas:
+            r.tick()
+        if time.monotonic() >= next_sample:
+            next_sample = time.monotonic() + SAMPLE_INTERVAL
+            for r in replicas:
+                r.sample()
+            write_status(replicas)
+        time.sleep(TICK)
 
-    reap_loop()
+    drain(replicas)
+    write_status(replicas)
+    log('todos los workers detenidos')
 
 if __name__ == '__main__':
     def _sig(sig, frame):
-        print('[manager] señal de parada recibida')
-        stop_all()
+        global SHUTDOWN
+        print('[manager] señal de parada recibida', flush=True)
+        SHUTDOWN = True
     signal.signal(signal.SIGTERM, _sig)
     signal.signal(signal.SIGINT, _sig)
     main()
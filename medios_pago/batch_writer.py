@@ -0,0 +1,121 @@
+"""
+Escritor por lotes de confirmaciones de pago hacia el backend (puerto 8000).
+
+Las confirmaciones se acumulan y se envían en UN request al endpoint masivo
+cuando el lote llega a `max_batch` o pasan `max_delay` segundos desde el
+primer elemento. Cada `submit()` recibe su propio resultado (True/False),
+así el llamador sabe qué ítems fallaron.
+
+Durabilidad: `submit()` se llama desde WebhookProcessor, que solo hace ACK
+del evento cuando el ítem quedó confirmado. Si el proceso muere con un lote
+en memoria, los eventos siguen pendientes en Redis y se reprocesan.
+
+Contrato del endpoint masivo: recibe una lista JSON y devuelve una lista del
+mismo largo con `{"ok": bool, "error": str | null}` por ítem. Si el backend
+todavía no lo tiene (404/405), se cae al endpoint individual.
+"""
+import os
+import time
+import asyncio
+import httpx
+
+import metrics
+
+BACKEND_URL = os.getenv("API_BACKEND_URL", "http://localhost:8000")
+
+
+class BatchWriter:
+
+    def __init__(self, bulk_path, single_path, max_batch=200, max_delay=0.02):
+        self.bulk_path = bulk_path
+        self.single_path = single_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._timer = None
+        self._client = None
+        self._tasks = set()
+        self.stats = {"batches": 0, "items": 0, "failed": 0}
+
+    @property
+    def client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=BACKEND_URL,
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20)
+            )
+        return self._client
+
+    async def submit(self, item):
+        """Encola un ítem y espera el resultado de su lote."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._spawn_flush)
+        return await future
+
+    def _spawn_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._spawn_flush)
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await self._send(items)
+        except Exception as e:
+            print(f"⚠️ Error enviando lote a {self.bulk_path}: {e}")
+            results = [False] * len(items)
+
+        self.stats["batches"] += 1
+        self.stats["items"] += len(items)
+        self.stats["failed"] += results.count(False)
+        for (_, future), ok in zip(batch, results):
+            if not future.done():
+                future.set_result(ok)
+
+    async def _send(self, items):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            results = await self._post(items)
+            outcome = "ok"
+            return results
+        finally:
+            metrics.labeled(metrics.BACKEND_SECONDS, self.bulk_path, outcome).observe(time.perf_counter() - started)
+
+    async def _post(self, items):
+        res = await self.client.post(self.bulk_path, json=items)
+        if res.status_code in (404, 405):
+            # Backend sin endpoint masivo: un request por ítem, en paralelo sobre el mismo pool
+            responses = await asyncio.gather(
+                *(self.client.post(self.single_path, json=item) for item in items), return_exceptions=True
+            )
+            return [not isinstance(r, Exception) and r.status_code == 200 for r in responses]
+        res.raise_for_status()
+        body = res.json()
+        if len(body) != len(items):
+            raise ValueError(f"el backend devolvió {len(body)} resultados para {len(items)} ítems")
+        return [bool(r.get("ok")) for r in body]
+
+    async def close(self):
+        """Envía todo lo pendiente (lote por lote) y recién después cierra el cliente."""
+        while self._pending or self._tasks:
+            while self._pending:
+                self._spawn_flush()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de creación de checkouts con un proveedor lento.
+
+Levanta la app en proceso (httpx.ASGITransport), reemplaza los proveedores
+por dobles locales con latencia configurable y lanza N checkouts
+concurrentes por proveedor. Con un proveedor ralentizado, la latencia de
+los otros dos no debería moverse.
+
+Uso: python bench/checkout_load.py [checkouts_por_proveedor] [proveedor_lento] [segundos]
+"""
+import os
+import sys
+import time
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import stripe
+import main
+import providers
+
+FAST = 0.05
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def install_fakes(slow: str, slow_seconds: float):
+    latency = {p: (slow_seconds if p == slow else FAST) for p in ("mercadopago", "stripe", "coinbase")}
+
+    async def upstream(request: httpx.Request):
+        if "mercadopago" in request.url.host:
+            await asyncio.sleep(latency["mercadopago"])
+            return httpx.Response(201, json={"init_point": "https://mp.example/checkout"})
+        await asyncio.sleep(latency["coinbase"])
+        return httpx.Response(201, json={"data": {"hosted_url": "https://cb.example/charge"}})
+
+    def stripe_create(**params):
+        # El SDK real es bloqueante: se simula con time.sleep
+        time.sleep(latency["stripe"])
+        return SimpleNamespace(url="https://stripe.example/session")
+
+    async def no_queue(queue, payload):
+        return None
+
+    providers._http = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    stripe.checkout.Session.create = stripe_create
+    main.enqueue_task_async = no_queue
+
+
+async def run(n: int, slow: str, slow_seconds: float):
+    install_fakes(slow, slow_seconds)
+    body = {"amount": 10.0, "description": "VIP", "metadata": {"user_id": "1", "canal_id": "2", "email": "a@b.c"}}
+    latencies = {"mercadopago": [], "stripe": [], "coinbase": []}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        async def checkout(provider):
+            started = time.perf_counter()
+            res = await client.post(f"/create-payment/{provider}", json=body)
+            res.raise_for_status()
+            latencies[provider].append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(checkout(p) for p in latencies for _ in range(n)))
+        elapsed = time.perf_counter() - started
+
+    print(f"{n} checkouts por proveedor, '{slow}' ralentizado a {slow_seconds}s, total {elapsed:.2f}s")
+    for provider, values in latencies.items():
+        print(f"  {provider:<12} p50={percentile(values, 50):8.1f} ms  p99={percentile(values, 99):8.1f} ms")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    slow_provider = sys.argv[2] if len(sys.argv) > 2 else "coinbase"
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+    asyncio.run(run(count, slow_provider, seconds))
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Simulador de carga de punta a punta: pago -> webhook -> suscripción -> invitación.
+
+Corre el pipeline real contra dobles locales, sin Telegram ni proveedores:
+  - `main.app` (medios_pago) en proceso con httpx.ASGITransport y su
+    WebhookProcessor
+  - proveedores falsos: crean el checkout con latencia configurable y luego
+    envían el webhook firmado como lo haría cada uno (Stripe `t=,v1=`,
+    Mercado Pago `x-signature` + consulta del pago, Coinbase HMAC)
+  - backend falso en `/suscripcion_con_pago/bulk` (BatchWriter)
+  - `invitation_creator` real en procesos aparte (`--worker`), con un cliente
+    Telethon falso: latencia RPC configurable e inyección de FloodWait. Cada
+    DM enviado se reporta al stream `sim:dms`
+  - Redis local (base aislada, por defecto /15, se vacía al empezar)
+
+Reproduce N compras a `--rate` por segundo y reporta percentiles y
+throughput por etapa:
+
+  checkout          POST /create-payment/<proveedor>
+  link DM           checkout -> DM con el link de pago
+  webhook ack       POST /webhook/<proveedor>
+  webhook->backend  webhook enviado -> llega a /suscripcion_con_pago/
+  backend->invite   /suscripcion_con_pago/ -> DM con la invitación
+  e2e               webhook enviado -> DM con la invitación
+
+Uso: python bench/e2e_simulator.py [--purchases 2000] [--rate 200] [--workers 2]
+         [--rpc-ms 40] [--flood-prob 0] [--flood-seconds 5] [--provider-ms 80] [--backend-ms 20]
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import random
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKERS = os.path.join(os.path.dirname(APP_DIR), 'telegram-workers', 'workers')
+SIM_REDIS_URL = os.getenv("SIM_REDIS_URL", "redis://localhost:6379/15")
+DM_STREAM = "sim:dms"
+WORKER_LOG = os.path.join(tempfile.gettempdir(), "e2e_workers.log")
+SECRETS = {"stripe": "whsec_sim", "coinbase": "cb_sim", "mercadopago": "mp_sim"}
+PROVIDERS = ("stripe", "mercadopago", "coinbase")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# --- Lado worker (proceso aparte) ---
+
+def worker_main():
+    """invitation_creator real con un TelegramClient falso."""
+    import redis.asyncio as aioredis
+    from telethon import types
+    from telethon.errors import FloodWaitError
+
+    sys.path.insert(0, os.path.join(WORKERS, 'channel_manager'))
+    import invitation_creator as ic
+    from common import lifecycle
+
+    rpc = float(os.getenv("SIM_RPC_MS", "40")) / 1000
+    flood_prob = float(os.getenv("SIM_FLOOD_PROB", "0"))
+    flood_seconds = int(os.getenv("SIM_FLOOD_SECONDS", "5"))
+
+    class FakeTelegram:
+        """Cada RPC tarda ~rpc (±50%); con probabilidad `flood_prob` responde FloodWait."""
+
+        def __init__(self, conn):
+            self.conn = conn
+            self.pending = []
+
+        async def _rpc(self, request):
+            await asyncio.sleep(rpc * random.uniform(0.5, 1.5))
+            if flood_prob and random.random() < flood_prob:
+                raise FloodWaitError(request=request, capture=flood_seconds)
+
+        async def get_input_entity(self, peer):
+            await self._rpc(peer)
+            return types.InputPeerChannel(abs(int(str(peer).removeprefix("-100"))), 1)
+
+        async def __call__(self, request):
+            await self._rpc(request)
+            return SimpleNamespace(link=f"https://t.me/+sim{uuid.uuid4().hex[:10]}")
+
+        async def send_message(self, entity, message, **kwargs):
+            await self._rpc(entity)
+            kind = "invite" if "Acceso único" in message else "link"
+            self.pending.append({"user": entity, "kind": kind, "at": time.time()})
+
+        async def flush(self):
+            batch, self.pending = self.pending, []
+            if batch:
+                async with self.conn.pipeline(transaction=False) as pipe:
+                    for dm in batch:
+                        pipe.xadd(DM_STREAM, dm)
+                    await pipe.execute()
+
+        async def flush_loop(self):
+            while True:
+                await asyncio.sleep(0.02)
+                await self.flush()
+
+    async def run():
+        lifecycle.install_signal_handlers()
+        conn = aioredis.from_url(SIM_REDIS_URL, decode_responses=True)
+        client = FakeTelegram(conn)
+        flusher = asyncio.create_task(client.flush_loop())
+        await ic.consume(client, conn)
+        flusher.cancel()
+        await client.flush()
+
+    asyncio.run(run())
+
+
+def spawn_workers(count: int, args):
+    env = {
+        **os.environ,
+        "REDIS_URL": SIM_REDIS_URL,
+        "SIM_RPC_MS": str(args.rpc_ms),
+        "SIM_FLOOD_PROB": str(args.flood_prob),
+        "SIM_FLOOD_SECONDS": str(args.flood_seconds),
+    }
+    log = open(WORKER_LOG, "ab")
+    return [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker"], env=env, stdout=log, stderr=log)
+            for _ in range(count)]
+
+
+# --- Lado medios_pago (este proceso) ---
+
+def sign_stripe(payload: bytes) -> str:
+    ts = int(time.time())
+    v1 = hmac.new(SECRETS["stripe"].encode(), f"{ts}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={ts},v1={v1}"
+
+
+def sign_mercadopago(data_id: str, request_id: str) -> str:
+    ts = int(time.time())
+    manifest = f"id:{data_id.lower()};request-id:{request_id};ts:{ts};"
+    return f"ts={ts},v1={hmac.new(SECRETS['mercadopago'].encode(), manifest.encode(), hashlib.sha256).hexdigest()}"
+
+
+class Simulation:
+
+    def __init__(self, args):
+        self.args = args
+        self.purchases = {}
+        self.backend_at = {}
+        self.dms = {"link": {}, "invite": {}}
+
+    def install(self):
+        """Importa la app con secretos de firma propios y la apunta a los dobles y a SIM_REDIS_URL."""
+        os.environ["WEBHOOK_SECRET"] = SECRETS["stripe"]
+        os.environ["COINBASE_WEBHOOK_SECRET"] = SECRETS["coinbase"]
+        os.environ["MP_WEBHOOK_SECRET"] = SECRETS["mercadopago"]
+        sys.path.insert(0, APP_DIR)
+
+        import httpx
+        import redis
+        import redis.asyncio as aioredis
+        import stripe
+        import main
+        import providers
+        import routes_methods
+
+        self.main = main
+        self.redis = aioredis.from_url(SIM_REDIS_URL, decode_responses=True)
+        routes_methods.redis_client = redis.Redis.from_url(SIM_REDIS_URL, decode_responses=True)
+        routes_methods.async_redis_client = main.async_redis_client = self.redis
+        main.STRIPE_WEBHOOK_SECRET = SECRETS["stripe"]
+
+        provider_s = self.args.provider_ms / 1000
+        backend_s = self.args.backend_ms / 1000
+
+        async def provider_api(request: httpx.Request):
+            await asyncio.sleep(provider_s)
+            if "mercadopago" in request.url.host:
+                return httpx.Response(201, json={"init_point": "https://mp.example/checkout"})
+            return httpx.Response(201, json={"data": {"hosted_url": "https://cb.example/charge"}})
+
+        def stripe_create(**params):
+            # El SDK real es bloqueante (corre en un thread)
+            time.sleep(provider_s)
+            return SimpleNamespace(url="https://stripe.example/session")
+
+        async def mp_payment(resource_id, newer_than=None):
+            # Consulta del pago que hace el procesador al recibir el webhook de MP
+            await asyncio.sleep(provider_s)
+            purchase = self.purchases.get(int(resource_id.removeprefix("mp-")))
+            if purchase is None:
+                return None
+            return {"status": "approved", "transaction_amount": purchase["amount"],
+                    "external_reference": f"{purchase['user']};{purchase['canal']}", "metadata": {}}
+
+        async def backend(request: httpx.Request):
+            await asyncio.sleep(backend_s)
+            items = json.loads(request.content)
+            items = items if isinstance(items, list) else [items]
+            now = time.time()
+            for item in items:
+                self.backend_at.setdefault(int(item.get("usuario") or item.get("user_id") or 0), now)
+            return httpx.Response(200, json=[{"ok": True, "error": None}] * len(items))
+
+        providers._http = httpx.AsyncClient(transport=httpx.MockTransport(provider_api))
+        stripe.checkout.Session.create = stripe_create
+        main.get_mp_payment = mp_payment
+        for writer in (main.subscription_writer, main.campaign_writer):
+            writer._client = httpx.AsyncClient(transport=httpx.MockTransport(backend), base_url="http://backend")
+        self.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test",
+                                      limits=httpx.Limits(max_connections=None), timeout=60)
+
+    async def reset_redis(self):
+        if self.redis.connection_pool.connection_kwargs.get("db", 0) == 0:
+            raise SystemExit("SIM_REDIS_URL apunta a la base 0: usá una base aislada (p. ej. /15)")
+        await self.redis.flushdb()
+
+    def webhook(self, p: dict) -> tuple:
+        """(ruta, body, headers) tal como los envía el proveedor."""
+        i, provider = p["i"], p["provider"]
+        meta = {"user_id": str(p["user"]), "canal_id": str(p["canal"])}
+        if provider == "stripe":
+            body = json.dumps({"id": f"evt_sim_{i}", "type": "checkout.session.completed", "data": {"object": {
+                "id": f"cs_sim_{i}", "metadata": meta, "amount_total": int(p["amount"] * 100)}}}).encode()
+            return "/webhook/stripe", body, {"stripe-signature": sign_stripe(body)}
+        if provider == "mercadopago":
+            data_id, request_id = f"mp-{i}", str(uuid.uuid4())
+            body = json.dumps({"id": f"mpevt-{i}", "type": "payment", "action": "payment.created",
+                               "data": {"id": data_id}}).encode()
+            return "/webhook/mercadopago", body, {
+                "x-request-id": request_id, "x-signature": sign_mercadopago(data_id, request_id),
+                "content-type": "application/json"}
+        body = json.dumps({"event": {"id": f"cb-evt-{i}", "type": "charge:confirmed", "data": {
+            "id": f"charge-sim-{i}", "metadata": meta, "pricing": {"local": {"amount": str(p["amount"])}}}}}).encode()
+        signature = hmac.new(SECRETS["coinbase"].encode(), body, hashlib.sha256).hexdigest()
+        return "/webhook/coinbase", body, {"x-cc-webhook-signature": signature}
+
+    async def purchase(self, i: int):
+        provider = PROVIDERS[i % len(PROVIDERS)]
+        p = self.purchases[i] = {
+            "i": i, "provider": provider, "user": 10_000_000 + i,
+            "canal": 1000 + i % self.args.channels, "amount": 10.0
+        }
+        checkout = {"amount": p["amount"], "description": "VIP",
+                    "metadata": {"user_id": str(p["user"]), "canal_id": str(p["canal"]), "email": "sim@example.com"}}
+        p["checkout_start"] = time.time()
+        res = await self.http.post(f"/create-payment/{provider}", json=checkout)
+        res.raise_for_status()
+        p["checkout_done"] = time.time()
+
+        await asyncio.sleep(self.args.pay_delay)
+        path, body, headers = self.webhook(p)
+        p["webhook_sent"] = time.time()
+        res = await self.http.post(path, content=body, headers=headers)
+        res.raise_for_status()
+        p["webhook_ack"] = time.time()
+
+    async def collect_dms(self, expected: int, idle_timeout: float):
+        """Lee `sim:dms` hasta recibir todas las invitaciones o `idle_timeout` s sin novedades."""
+        last_id, last_seen = "0", time.time()
+        while len(self.dms["invite"]) < expected and time.time() - last_seen < idle_timeout:
+            response = await self.redis.xread({DM_STREAM: last_id}, count=1000, block=500)
+            for _stream, messages in response or []:
+                for message_id, dm in messages:
+                    last_id, last_seen = message_id, time.time()
+                    self.dms[dm["kind"]].setdefault(int(dm["user"]), float(dm["at"]))
+
+    def report(self, elapsed: float):
+        stages = {
+            "checkout": [],
+            "link DM": [],
+            "webhook ack": [],
+            "webhook->backend": [],
+            "backend->invite": [],
+            "e2e": [],
+        }
+        spans = {name: [None, None] for name in stages}
+
+        def add(name, start, end):
+            if start is None or end is None:
+                return
+            stages[name].append((end - start) * 1000)
+            span = spans[name]
+            span[0] = start if span[0] is None else min(span[0], start)
+            span[1] = end if span[1] is None else max(span[1], end)
+
+        for p in self.purchases.values():
+            user = p["user"]
+            backend_at = self.backend_at.get(user)
+            invite_at = self.dms["invite"].get(user)
+            add("checkout", p.get("checkout_start"), p.get("checkout_done"))
+            add("link DM", p.get("checkout_done"), self.dms["link"].get(user))
+            add("webhook ack", p.get("webhook_sent"), p.get("webhook_ack"))
+            add("webhook->backend", p.get("webhook_sent"), backend_at)
+            add("backend->invite", backend_at, invite_at)
+            add("e2e", p.get("webhook_sent"), invite_at)
+
+        a = self.args
+        print(f"{a.purchases} compras a {a.rate or 'máx'}/s, {a.workers} workers, rpc={a.rpc_ms} ms, "
+              f"flood={a.flood_prob * 100:.1f}% x {a.flood_seconds}s, proveedor={a.provider_ms} ms, "
+              f"backend={a.backend_ms} ms -> {elapsed:.1f}s")
+        print(f"  {'etapa':<17} {'n':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'por s':>8}")
+        for name, values in stages.items():
+            if not values:
+                print(f"  {name:<17} {0:>6}")
+                continue
+            window = max(spans[name][1] - spans[name][0], 1e-6)
+            print(f"  {name:<17} {len(values):>6} {percentile(values, 50):>7.1f}ms {percentile(values, 90):>7.1f}ms "
+                  f"{percentile(values, 99):>7.1f}ms {max(values):>7.1f}ms {len(values) / window:>8.1f}")
+        missing = a.purchases - len(self.dms["invite"])
+        if missing:
+            print(f"  ⚠️ {missing} compras sin invitación (FloodWait pendiente de reclaim o error; ver {WORKER_LOG})")
+
+    async def run(self):
+        self.install()
+        await self.reset_redis()
+        import webhooks
+
+        workers = spawn_workers(self.args.workers, self.args)
+        processor = asyncio.create_task(webhooks.WebhookProcessor(self.redis, self.main.process_webhook).run())
+        # Tiempo para que los workers creen el consumer group
+        await asyncio.sleep(2)
+        try:
+            started = time.time()
+            tasks = []
+            for i in range(self.args.purchases):
+                tasks.append(asyncio.create_task(self.purchase(i)))
+                if self.args.rate:
+                    await asyncio.sleep(1 / self.args.rate)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            errors = [r for r in results if isinstance(r, Exception)]
+            if errors:
+                print(f"⚠️ {len(errors)} compras fallaron en medios_pago (p. ej. {errors[0]!r})")
+            await self.collect_dms(self.args.purchases - len(errors), self.args.idle_timeout)
+            self.report(time.time() - started)
+        finally:
+            processor.cancel()
+            for w in workers:
+                w.terminate()
+            for w in workers:
+                try:
+                    w.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    w.kill()
+            await self.main.subscription_writer.close()
+            await self.main.campaign_writer.close()
+            await self.http.aclose()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulador de punta a punta pago -> invitación")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--purchases", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200, help="compras/s (0 = todas a la vez)")
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=2, help="procesos invitation_creator")
+    parser.add_argument("--rpc-ms", type=float, default=40)
+    parser.add_argument("--flood-prob", type=float, default=0.0, help="probabilidad de FloodWait por RPC")
+    parser.add_argument("--flood-seconds", type=int, default=5)
+    parser.add_argument("--provider-ms", type=float, default=80)
+    parser.add_argument("--backend-ms", type=float, default=20)
+    parser.add_argument("--pay-delay", type=float, default=0.0, help="segundos entre checkout y webhook")
+    parser.add_argument("--idle-timeout", type=float, default=90, help="espera máxima sin DMs nuevos")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.worker:
+        worker_main()
+    else:
+        asyncio.run(Simulation(args).run())
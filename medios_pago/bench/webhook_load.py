@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark de respuesta de webhooks bajo entregas concurrentes.
+
+Envía N webhooks de Coinbase `charge:confirmed` a la vez (un % repetidos,
+como hacen los proveedores al reintentar) contra la app en proceso y un
+Redis local en una base aislada (BENCH_REDIS_URL, por defecto /15; se
+rechaza la base 0 para no dejar eventos sintéticos en el stream real
+`webhook_events`). Mide cuánto tarda la ruta en responder, que solo verifica y
+encola (el procesamiento queda para WebhookProcessor, que aquí no corre).
+
+Uso: python bench/webhook_load.py [entregas] [porcentaje_duplicadas]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import redis
+import redis.asyncio as aioredis
+import main
+import routes_methods
+
+BENCH_REDIS_URL = os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def delivery(event_id):
+    return json.dumps({"event": {"id": event_id, "type": "charge:confirmed", "data": {
+        "id": f"charge-{event_id}",
+        "metadata": {"user_id": str(random.randint(1, 1000)), "canal_id": "1"},
+        "pricing": {"local": {"amount": "10.00"}}
+    }}})
+
+
+def isolate_redis():
+    """Apunta la app a BENCH_REDIS_URL (igual que bench/e2e_simulator.py)."""
+    conn = aioredis.from_url(BENCH_REDIS_URL, decode_responses=True)
+    if conn.connection_pool.connection_kwargs.get("db", 0) == 0:
+        raise SystemExit("BENCH_REDIS_URL apunta a la base 0: usá una base aislada (p. ej. /15)")
+    routes_methods.redis_client = redis.Redis.from_url(BENCH_REDIS_URL, decode_responses=True)
+    routes_methods.async_redis_client = main.async_redis_client = conn
+
+
+async def run(n: int, dup_pct: float):
+    isolate_redis()
+    ids = [f"bench-{uuid.uuid4()}" for _ in range(n)]
+    dups = int(n * dup_pct / 100)
+    bodies = [delivery(i) for i in ids] + [delivery(i) for i in random.sample(ids, dups)]
+    random.shuffle(bodies)
+    latencies = []
+
+    limits = httpx.Limits(max_connections=None)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test", limits=limits) as client:
+        async def deliver(body):
+            started = time.perf_counter()
+            res = await client.post("/webhook/coinbase", content=body)
+            res.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(deliver(b) for b in bodies))
+        elapsed = time.perf_counter() - started
+
+    print(f"{len(bodies)} entregas concurrentes ({dups} duplicadas) en {elapsed:.2f}s")
+    print(f"  p50={percentile(latencies, 50):.1f} ms  p99={percentile(latencies, 99):.1f} ms  "
+          f"max={max(latencies):.1f} ms")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    dup = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(run(count, dup))
@@ -1,32 +1,54 @@
 import os
 import json
-import stripe
-import requests
-import mercadopago
-from fastapi import FastAPI, Request, HTTPException
+import time
+import asyncio
+from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware # IMPORTANTE: Esto faltaba
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # Importación sincronizada con routes_methods.py
 from routes_methods import (
-    handle_payment_created, 
-    handle_subscription_payment, 
     trigger_bot_invite, 
-    actualizar_pago_campania,
-    redis_client
+    enqueue_task_async,
+    get_mp_payment,
+    mp_payments,
+    build_subscription,
+    build_campaign_payment,
+    async_redis_client
 )
+import providers
+import webhooks
+import metrics
+import rollups
+from batch_writer import BatchWriter
 
 load_dotenv()
 
-# Configuración de APIs
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+# Configuración de APIs (el SDK de Stripe se carga al primer uso, ver providers.stripe_sdk)
 STRIPE_WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") 
-sdk = mercadopago.SDK(os.getenv("MP_ACCESS_TOKEN"))
-COINBASE_API_KEY = os.getenv("COINBASE_API_KEY")
 
 app = FastAPI()
 
+# Confirmaciones agrupadas hacia el backend (ver batch_writer.py)
+subscription_writer = BatchWriter("/suscripcion_con_pago/bulk", "/suscripcion_con_pago/")
+campaign_writer = BatchWriter("/confirmar-pago-publicidad/bulk", "/confirmar-pago-publicidad")
+
+@app.on_event("startup")
+async def start_webhook_processor():
+    app.state.webhook_processor = asyncio.create_task(
+        webhooks.WebhookProcessor(async_redis_client, process_webhook).run()
+    )
+    # El SDK de Stripe se carga en segundo plano: no retrasa el arranque ni el primer webhook
+    asyncio.create_task(asyncio.to_thread(providers.stripe_sdk))
+
+@app.on_event("shutdown")
+async def close_provider_clients():
+    app.state.webhook_processor.cancel()
+    await subscription_writer.close()
+    await campaign_writer.close()
+    await providers.close()
+
 # <<-- CONFIGURACIÓN DE CORS: Soluciona el error 405 OPTIONS -->>
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +57,8 @@ app.add_middleware(
     allow_methods=["*"], 
     allow_headers=["*"],
 )
+# Latencia por ruta y status para /metrics (ver metrics.py)
+app.add_middleware(metrics.MetricsMiddleware)
 
 class PaymentRequest(BaseModel):
     amount: float
@@ -44,7 +68,7 @@ class PaymentRequest(BaseModel):
 # --- RUTAS DE CREACIÓN DE PAGOS (Envían link vía Redis/Bot) ---
 
 @app.post("/create-payment/mercadopago")
-def create_mp_payment(data: PaymentRequest):
+async def create_mp_payment(data: PaymentRequest):
     # 1. Extraer datos con seguridad (.get evita el KeyError)
     user_email = data.metadata.get("email")
     uid = data.metadata.get('user_id', '0')
@@ -67,11 +91,9 @@ def create_mp_payment(data: PaymentRequest):
     }
     
     try:
-        mp_res = sdk.preference().create(pref)
-        res = mp_res["response"]
+        url = await providers.create_mp_preference(pref)
         
-        if res.get("init_point"):
-            url = res["init_point"]
+        if url:
             
             # 3. Notificar vía Redis (convertir a int de forma segura)
             try:
@@ -84,7 +106,7 @@ def create_mp_payment(data: PaymentRequest):
                 "user_id": user_id_int, 
                 "payment_link": url
             }
-            redis_client.publish('invitation_queue', json.dumps(payload_redis))
+            await enqueue_task_async('invitation_queue', payload_redis)
             
             # Retornamos 'init_point' para que el Front lo reconozca fácil
             return {"init_point": url}
@@ -100,8 +122,8 @@ def create_mp_payment(data: PaymentRequest):
 async def create_stripe_payment(data: PaymentRequest):
     """Genera el link de pago para Stripe y lo envía vía Redis"""
     try:
-        # Creamos la sesión de Checkout en Stripe
-        session = stripe.checkout.Session.create(
+        # Creamos la sesión de Checkout en Stripe (SDK síncrono en un thread)
+        url = await providers.create_stripe_session(
             payment_method_types=['card'],
             line_items=[{
                 'price_data': {
@@ -118,7 +140,6 @@ async def create_stripe_payment(data: PaymentRequest):
             cancel_url="https://tu-sitio.com/cancel",
         )
 
-        url = session.url
         uid = data.metadata.get('user_id', 0)
 
         # Notificamos a Redis para que el Bot envíe el link al usuario
@@ -127,7 +148,7 @@ async def create_stripe_payment(data: PaymentRequest):
             "user_id": int(uid), 
             "payment_link": url
         }
-        redis_client.publish('invitation_queue', json.dumps(payload_redis))
+        await enqueue_task_async('invitation_queue', payload_redis)
 
         return {"url": url} # El Front busca 'url' para Stripe
     except Exception as e:
@@ -137,65 +158,53 @@ async def create_stripe_payment(data: PaymentRequest):
 # --- WEBHOOK ÚNICO DE STRIPE  ---
 @app.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
+    """Verifica la firma, guarda el evento (idempotente por event.id) y responde al instante."""
     payload = await request.body()
     sig = request.headers.get("stripe-signature")
     try:
-        event = stripe.Webhook.construct_event(payload, sig, STRIPE_WEBHOOK_SECRET)
-        if event["type"] == "checkout.session.completed":
-            session = event["data"]["object"]
-            meta = session.get("metadata", {})
-            monto = session["amount_total"] / 100
-            user_id = meta.get("user_id")
-
-            if meta.get("tipo") == "publicidad_directa":
-                # Lógica de Publicidad
-                actualizar_pago_campania(meta.get("alias"), monto, user_id)
-            else:
-                # Lógica de Suscripción
-                handle_subscription_payment(user_id, meta.get("canal_id", "0"), monto)
-                trigger_bot_invite(user_id, meta.get("canal_id", "0"))
-        return {"status": "success"}
+        event = providers.stripe_sdk().Webhook.construct_event(payload, sig, STRIPE_WEBHOOK_SECRET)
     except Exception as e:
         print(f"❌ Error Stripe: {e}")
-        return {"error": str(e)}, 400
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if event["type"] != "checkout.session.completed":
+        return {"status": "ignored"}
+    data = json.loads(payload)
+    user_id = data["data"]["object"].get("metadata", {}).get("user_id")
+    stored = await webhooks.store_event(async_redis_client, "stripe", event["id"], user_id, data)
+    return {"status": "success" if stored else "duplicate"}
     
 @app.post("/create-payment/coinbase")
 async def create_coinbase_payment(payment: PaymentRequest):
-    headers = {"X-CC-Api-Key": COINBASE_API_KEY.strip(), "X-CC-Version": "2018-03-22", "Content-Type": "application/json"}
     payload = {"name": payment.description, "pricing_type": "fixed_price", "local_price": {"amount": str(payment.amount), "currency": "USD"}, "metadata": payment.metadata}
-    res = requests.post("https://api.commerce.coinbase.com/charges", json=payload, headers=headers)
-    if res.status_code == 201:
-        url = res.json()['data']['hosted_url']
-        # Publicar en Redis para que el Bot envíe el mensaje
-        payload_redis = {"action": "send_payment_link", "user_id": int(payment.metadata['user_id']), "payment_link": url}
-        redis_client.publish('invitation_queue', json.dumps(payload_redis))
-        return {"checkout_url": url}
-    raise HTTPException(status_code=400, detail="Error Coinbase")
+    try:
+        url = await providers.create_coinbase_charge(payload)
+    except providers.ProviderError as e:
+        print(f"❌ Error Coinbase: {e}")
+        raise HTTPException(status_code=400, detail="Error Coinbase")
+    # Publicar en Redis para que el Bot envíe el mensaje
+    payload_redis = {"action": "send_payment_link", "user_id": int(payment.metadata['user_id']), "payment_link": url}
+    await enqueue_task_async('invitation_queue', payload_redis)
+    return {"checkout_url": url}
 
 # --- WEBHOOKS (Confirmación de pago) ---
 
 @app.post("/webhook/mercadopago")
 async def mp_webhook(request: Request):
     body = await request.json()
-    # Mercado Pago requiere una consulta adicional para obtener la metadata
+    # Mercado Pago requiere una consulta adicional para obtener la metadata (la hace el procesador)
     resource_id = body.get("data", {}).get("id") or body.get("id")
-    if body.get("type") == "payment":
-        try:
-            res = requests.get(f"https://api.mercadopago.com/v1/payments/{resource_id}", 
-                               headers={"Authorization": f"Bearer {MP_ACCESS_TOKEN}"})
-            if res.status_code == 200:
-                data = res.json()
-                meta = data.get("metadata", {})
-                monto = data.get("transaction_amount")
-                user_id = meta.get("user_id")
-
-                if meta.get("tipo") == "publicidad_directa":
-                    actualizar_pago_campania(meta.get("alias"), monto, user_id)
-                else:
-                    handle_subscription_payment(user_id, meta.get("canal_id"), monto)
-                    trigger_bot_invite(user_id, meta.get("canal_id"))
-        except Exception as e:
-            print(f"❌ Error MP: {e}")
+    if body.get("type") != "payment" or not resource_id:
+        return {"status": "ok"}
+    try:
+        webhooks.verify_mercadopago(request.headers, resource_id)
+    except webhooks.InvalidSignature as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    event_id = body.get("id") or f"{resource_id}:{body.get('action')}"
+    # received_at: un estado intermedio consultado después de este momento sirve desde la caché
+    await webhooks.store_event(async_redis_client, "mercadopago", str(event_id), str(resource_id),
+                               {**body, "received_at": time.time()})
     return {"status": "ok"}
 
 
@@ -203,16 +212,107 @@ async def mp_webhook(request: Request):
 @app.post("/webhook/coinbase")
 async def coinbase_webhook(request: Request):
     body = await request.body()
+    try:
+        webhooks.verify_coinbase(body, request.headers.get("x-cc-webhook-signature"))
+    except webhooks.InvalidSignature as e:
+        raise HTTPException(status_code=400, detail=str(e))
     data = json.loads(body)
     if data['event']['type'] == 'charge:confirmed':
-        charge = data['event']['data']
-        meta = charge.get('metadata', {})
-        monto = charge['pricing']['local']['amount']
-        user_id = meta.get('user_id')
+        user_id = data['event']['data'].get('metadata', {}).get('user_id')
+        await webhooks.store_event(async_redis_client, "coinbase", data['event']['id'], user_id, data)
+    return {"status": "ok"}
+
+@app.get("/cache/mercadopago")
+def mp_cache_stats():
+    """Contadores de la caché de pagos de Mercado Pago."""
+    return {**mp_payments.stats, "hit_ratio": round(mp_payments.hit_ratio(), 3)}
+
+@app.get("/batch-writers")
+def batch_writer_stats():
+    """Lotes enviados al backend por el escritor de suscripciones y el de campañas."""
+    return {"suscripciones": subscription_writer.stats, "campanias": campaign_writer.stats}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Métricas Prometheus: HTTP, webhooks y backend."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
+# --- PROCESAMIENTO EN SEGUNDO PLANO (ver webhooks.WebhookProcessor) ---
+
+async def run_step(marker, step, action):
+    """Corre un paso del pago una sola vez: si una entrega anterior ya lo completó, se salta."""
+    done = f"{marker}:{step}"
+    if await async_redis_client.exists(done):
+        return
+    await action()
+    await async_redis_client.set(done, 1, ex=webhooks.IDEMPOTENCY_TTL)
+
+async def apply_payment(provider, payment_id, meta, monto):
+    """Aplica un pago confirmado una sola vez (suscripción + invitación, o campaña)."""
+    marker = f"webhook:applied:{provider}:{payment_id}"
+    # Si otra entrega lo está aplicando, PaymentInProgress: queda sin ACK y se reintenta
+    token = await webhooks.claim_payment(async_redis_client, marker)
+    if token is None:
+        print(f"↩️ Pago {provider}:{payment_id} ya aplicado; se ignora.")
+        return
+
+    user_id = meta.get("user_id")
+    canal_id = meta.get("canal_id", "0")
+
+    async def confirm_campaign():
+        if not await campaign_writer.submit(build_campaign_payment(meta.get("alias"), monto, user_id)):
+            raise RuntimeError("No se pudo confirmar el pago de la campaña")
+
+    async def register_subscription():
+        if not await subscription_writer.submit(build_subscription(user_id, canal_id, monto)):
+            raise RuntimeError("No se pudo registrar la suscripción")
+
+    async def send_invite():
+        await asyncio.to_thread(trigger_bot_invite, user_id, canal_id)
+
+    try:
         if meta.get("tipo") == "publicidad_directa":
-            actualizar_pago_campania(meta.get("alias"), monto, user_id)
+            # Lógica de Publicidad
+            await run_step(marker, "campaign", confirm_campaign)
         else:
-            handle_subscription_payment(user_id, meta.get("canal_id"), monto)
-            trigger_bot_invite(user_id, meta.get("canal_id"))
-    return {"status": "ok"}
\ No newline at end of file
+            # Lógica de Suscripción: un reintento no vuelve a registrar ni a invitar
+            await run_step(marker, "subscription", register_subscription)
+            await run_step(marker, "invite", send_invite)
+            try:
+                # Ingresos del día por canal y dueño para los gráficos (ver rollups.py; ya es idempotente)
+                await rollups.record_revenue(async_redis_client, provider, payment_id, canal_id, monto)
+            except Exception as e:
+                print(f"⚠️ No se pudo actualizar los rollups de ingresos: {e}")
+    except BaseException:
+        await webhooks.release_claim(async_redis_client, marker, token)
+        raise
+    await async_redis_client.set(marker, 1, ex=webhooks.IDEMPOTENCY_TTL)
+
+async def process_webhook(provider, data):
+    if provider == "stripe":
+        session = data["data"]["object"]
+        await apply_payment(provider, session["id"], session.get("metadata", {}), session["amount_total"] / 100)
+
+    elif provider == "mercadopago":
+        resource_id = data.get("data", {}).get("id") or data.get("id")
+        # Un "pending" consultado antes de la notificación no debe tapar la aprobación (se ACKearía
+        # sin aplicar el pago); uno consultado después sí sirve (ver payment_cache.py)
+        newer_than = data.get("received_at", time.time())
+        payment = await get_mp_payment(resource_id, newer_than)
+        if not payment or payment.get("status") != "approved":
+            return
+        meta = payment.get("metadata") or {}
+        if not meta.get("user_id") and payment.get("external_reference"):
+            # El external_reference de create_mp_payment es "user_id;canal_id"
+            parts = str(payment["external_reference"]).split(";")
+            if len(parts) != 2 or not parts[0].strip().isdigit() or not parts[1].strip():
+                # Reintentar no lo arregla: se registra y se ACKea
+                print(f"⚠️ Pago MP {resource_id} con external_reference inválido: {payment['external_reference']!r}")
+                return
+            meta = {"user_id": parts[0].strip(), "canal_id": parts[1].strip()}
+        await apply_payment(provider, resource_id, meta, payment.get("transaction_amount"))
+
+    elif provider == "coinbase":
+        charge = data['event']['data']
+        await apply_payment(provider, charge['id'], charge.get('metadata', {}), charge['pricing']['local']['amount'])
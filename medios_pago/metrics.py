@@ -0,0 +1,79 @@
+"""
+Métricas Prometheus del servicio de pagos (prometheus_client), expuestas en
+GET /metrics.
+
+- `MetricsMiddleware`: latencia y status de cada request HTTP por ruta
+  (plantilla de FastAPI, p. ej. `/webhook/stripe`). Middleware ASGI puro: no
+  envuelve el body como BaseHTTPMiddleware.
+- Webhooks: eventos guardados/duplicados/dead-letter, lag del stream y
+  duración del procesamiento en WebhookProcessor.
+- Backend: latencia de los envíos de BatchWriter.
+
+Los hijos por combinación de labels se cachean con `labeled()` para no pagar
+el lookup con lock de `.labels()` en cada request.
+"""
+import time
+
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300)
+
+HTTP_SECONDS = Histogram(
+    "http_request_seconds", "Latencia de requests HTTP", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+WEBHOOK_EVENTS = Counter("webhook_events_total", "Webhooks recibidos por resultado", ["provider", "outcome"])
+WEBHOOK_LAG_SECONDS = Histogram(
+    "webhook_queue_lag_seconds", "Tiempo entre el XADD del webhook y su procesamiento", ["provider"],
+    buckets=LAG_BUCKETS
+)
+WEBHOOK_PROCESS_SECONDS = Histogram(
+    "webhook_process_seconds", "Duración del procesamiento de un webhook", ["provider", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+BACKEND_SECONDS = Histogram(
+    "backend_request_seconds", "Latencia de llamadas al backend", ["endpoint", "outcome"], buckets=LATENCY_BUCKETS
+)
+
+_children = {}
+
+
+def labeled(metric, *values):
+    """`metric.labels(*values)` cacheado (el hijo no cambia durante la vida del proceso)."""
+    key = (metric, values)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*values)
+    return child
+
+
+def render():
+    """(body, content_type) con todas las métricas del proceso."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # FastAPI deja la ruta resuelta en el scope; sin ruta se agrupa para no explotar labels
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            labeled(HTTP_SECONDS, scope["method"], path, str(status)).observe(time.perf_counter() - started)
@@ -0,0 +1,115 @@
+"""
+Caché del estado de pagos de Mercado Pago.
+
+MP manda varias notificaciones por pago (created, updated, approved...) y
+cada una obligaba a un GET /v1/payments/{id}. Esta caché guarda el último
+estado conocido de cada pago en dos niveles:
+
+- LRU en proceso (acotada a `max_items`)
+- Redis (`mp:payment:<id>`, compartido entre workers de uvicorn)
+
+Un estado final (approved, rejected...) se conserva `ttl` segundos: las
+notificaciones siguientes del mismo pago no vuelven a llamar a MP. Un
+estado intermedio (pending, in_process) dura solo `pending_ttl` segundos,
+lo justo para absorber notificaciones repetidas.
+
+Regla de frescura: el procesador de webhooks pasa `newer_than` = momento en
+que llegó la notificación. Un estado final de la caché siempre sirve (ya no
+cambia); uno intermedio sirve solo si se consultó a MP después de ese
+momento, porque entonces ya refleja el cambio que MP estaba avisando. Así
+created/updated repetidos de un pending se responden desde la caché y una
+aprobación nunca queda tapada por un pending consultado antes de avisarse.
+
+Es asíncrona (cliente Redis asíncrono y `fetch` corrutina): la consulta a
+MP no ocupa un thread y la LRU solo se toca desde el event loop.
+"""
+import json
+import time
+from collections import OrderedDict
+
+FINAL_STATUSES = {"approved", "rejected", "cancelled", "refunded", "charged_back"}
+# Campos que se guardan del pago (el JSON completo de MP es mucho más grande)
+KEPT_FIELDS = ("id", "status", "transaction_amount", "metadata", "external_reference")
+
+
+class PaymentStatusCache:
+
+    def __init__(self, redis_conn, fetch, max_items=2048, ttl=86400, pending_ttl=5):
+        self.redis = redis_conn
+        self.fetch = fetch
+        self.max_items = max_items
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self._local = OrderedDict()
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def _ttl_for(self, payment):
+        return self.ttl if payment.get("status") in FINAL_STATUSES else self.pending_ttl
+
+    @staticmethod
+    def _usable(payment, newer_than):
+        """Estado final, o intermedio consultado después de `newer_than` (epoch, ver docstring del módulo)."""
+        return (newer_than is None or payment.get("status") in FINAL_STATUSES
+                or payment.get("fetched_at", 0) >= newer_than)
+
+    def _get_local(self, payment_id):
+        item = self._local.get(payment_id)
+        if item is None:
+            return None
+        expires, payment = item
+        if expires < time.monotonic():
+            del self._local[payment_id]
+            return None
+        self._local.move_to_end(payment_id)
+        return payment
+
+    def _put_local(self, payment_id, payment, ttl):
+        self._local[payment_id] = (time.monotonic() + ttl, payment)
+        self._local.move_to_end(payment_id)
+        while len(self._local) > self.max_items:
+            self._local.popitem(last=False)
+
+    async def get(self, payment_id, newer_than=None):
+        """Último estado conocido del pago; solo consulta a MP si no está en caché.
+
+        Con `newer_than` un estado intermedio de la caché sirve solo si se
+        consultó a MP después de ese momento; si no, se vuelve a consultar.
+        """
+        payment_id = str(payment_id)
+        payment = self._get_local(payment_id)
+        if payment is not None and self._usable(payment, newer_than):
+            self.stats["local_hits"] += 1
+            return payment
+
+        key = f"mp:payment:{payment_id}"
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            raw, ttl = await pipe.get(key).ttl(key).execute()
+        except Exception:
+            # Redis caído: se sigue sin caché compartida
+            raw, ttl = None, None
+        if raw:
+            payment = json.loads(raw)
+            if self._usable(payment, newer_than):
+                self.stats["redis_hits"] += 1
+                self._put_local(payment_id, payment, ttl if ttl and ttl > 0 else self.pending_ttl)
+                return payment
+
+        self.stats["misses"] += 1
+        full = await self.fetch(payment_id)
+        if full is None:
+            return None
+        payment = {k: full.get(k) for k in KEPT_FIELDS}
+        payment["fetched_at"] = time.time()
+        ttl = self._ttl_for(payment)
+        try:
+            await self.redis.set(key, json.dumps(payment), ex=ttl)
+        except Exception:
+            pass
+        self._put_local(payment_id, payment, ttl)
+        return payment
+
+    def hit_ratio(self):
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
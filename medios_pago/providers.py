@@ -0,0 +1,87 @@
+"""
+Adaptadores asíncronos de los proveedores de pago.
+
+- Mercado Pago y Coinbase: API REST directa con un httpx.AsyncClient compartido
+  (keep-alive + pool de conexiones), sin bloquear el event loop.
+- Stripe: el SDK es síncrono, así que la llamada se descarga a un thread.
+  Se importa y configura recién al usarlo (`stripe_sdk()`): el import cuesta
+  cientos de ms y alargaba cada arranque/reinicio del servicio.
+"""
+import os
+import asyncio
+import threading
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MP_API_BASE = os.getenv("MP_API_BASE", "https://api.mercadopago.com")
+COINBASE_API_BASE = os.getenv("COINBASE_API_BASE", "https://api.commerce.coinbase.com")
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", "15"))
+
+_http = None
+_stripe = None
+_stripe_lock = threading.Lock()
+
+
+def stripe_sdk():
+    """Módulo `stripe` con la API key configurada (import diferido, una vez por proceso)."""
+    global _stripe
+    if _stripe is None:
+        with _stripe_lock:
+            if _stripe is None:
+                import stripe
+                stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+                _stripe = stripe
+    return _stripe
+
+
+def http_client():
+    """Cliente HTTP compartido por todas las llamadas a proveedores."""
+    global _http
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(PROVIDER_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+    return _http
+
+
+async def close():
+    if _http is not None:
+        await _http.aclose()
+
+
+class ProviderError(Exception):
+    """El proveedor respondió con un error o sin el link de pago."""
+
+
+async def create_mp_preference(preference):
+    """Crea una preferencia de Checkout Pro y devuelve el `init_point`."""
+    res = await http_client().post(
+        f"{MP_API_BASE}/checkout/preferences",
+        json=preference,
+        headers={"Authorization": f"Bearer {os.getenv('MP_ACCESS_TOKEN')}"}
+    )
+    if res.status_code not in (200, 201):
+        raise ProviderError(f"Mercado Pago {res.status_code}: {res.text}")
+    return res.json().get("init_point")
+
+
+async def create_stripe_session(**params):
+    """Crea una sesión de Checkout (SDK síncrono: se ejecuta en un thread)."""
+    session = await asyncio.to_thread(lambda: stripe_sdk().checkout.Session.create(**params))
+    return session.url
+
+
+async def create_coinbase_charge(payload):
+    """Crea un cargo en Coinbase Commerce y devuelve el `hosted_url`."""
+    headers = {
+        "X-CC-Api-Key": (os.getenv("COINBASE_API_KEY") or "").strip(),
+        "X-CC-Version": "2018-03-22",
+        "Content-Type": "application/json"
+    }
+    res = await http_client().post(f"{COINBASE_API_BASE}/charges", json=payload, headers=headers)
+    if res.status_code != 201:
+        raise ProviderError(f"Coinbase {res.status_code}: {res.text}")
+    return res.json()['data']['hosted_url']
@@ -0,0 +1,47 @@
+"""
+Ingresos en los rollups de gráficos del dashboard.
+
+Mismas claves que telegram-workers/workers/common/rollups.py (todo en UTC):
+
+  rollup:day:<canal>          campo '<YYYY-MM-DD>|ingresos'
+  rollup:owner:<owner>:day    campo '<YYYY-MM-DD>|ingresos' (dueño según rollup:channel:owner)
+
+Cada pago se suma una sola vez aunque el webhook se reprocese: la marca
+`rollup:paid:<proveedor>:<pago>` y los HINCRBYFLOAT van en el mismo script.
+"""
+from datetime import datetime, timezone
+
+OWNERS_KEY = "rollup:channel:owner"
+PAID_TTL = 30 * 24 * 3600
+
+# KEYS: marca del pago, diario del canal. ARGV: campo, monto, ttl, hash de dueños, canal
+REVENUE_SCRIPT = """
+if not redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[3]) then
+    return 0
+end
+redis.call('HINCRBYFLOAT', KEYS[2], ARGV[1], ARGV[2])
+local owner = redis.call('HGET', ARGV[4], ARGV[5])
+if owner then
+    redis.call('HINCRBYFLOAT', 'rollup:owner:' .. owner .. ':day', ARGV[1], ARGV[2])
+end
+return 1
+"""
+
+
+def bare_channel_id(canal_id) -> str:
+    """-1001234 / '1234' -> '1234' (igual que el worker)."""
+    cid = str(canal_id)
+    if cid.startswith('-100'):
+        cid = cid[4:]
+    return str(abs(int(cid)))
+
+
+async def record_revenue(redis, provider, payment_id, canal_id, monto):
+    """Suma `monto` a los ingresos de hoy del canal y de su dueño. False si el pago ya estaba contado."""
+    cid = bare_channel_id(canal_id)
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    counted = await redis.eval(
+        REVENUE_SCRIPT, 2, f"rollup:paid:{provider}:{payment_id}", f"rollup:day:{cid}",
+        f"{day}|ingresos", float(monto or 0), PAID_TTL, OWNERS_KEY, cid
+    )
+    return bool(counted)
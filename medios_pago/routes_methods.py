@@ -1,78 +1,77 @@
-import requests
 import datetime
 import os
 import json
 import redis
+import redis.asyncio as aioredis
 from dotenv import load_dotenv
+from payment_cache import PaymentStatusCache
+import providers
 
 load_dotenv()
 
 # Cliente Redis para comunicarse con los Workers
 redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
+# Cliente asíncrono (pool de conexiones) para las rutas async de FastAPI
+async_redis_client = aioredis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
 MP_ACCESS_TOKEN = os.getenv("MP_ACCESS_TOKEN")
+# Longitud aproximada máxima de cada stream de tareas
+QUEUE_MAXLEN = int(os.getenv("QUEUE_MAXLEN", "100000"))
 
-def handle_subscription_payment(usuario_id, canal_id, monto_pagado):
-    """Registra 30 días de suscripción y el pago en la API (Puerto 8000)"""
+def enqueue_task(queue, payload):
+    """Encola una tarea para los workers en un Redis Stream (entrega durable, campo `data`)."""
+    return redis_client.xadd(queue, {"data": json.dumps(payload)}, maxlen=QUEUE_MAXLEN, approximate=True)
+
+def build_subscription(usuario_id, canal_id, monto_pagado):
+    """Datos de una suscripción de 30 días tal como los espera `/suscripcion_con_pago/`."""
     fecha_inicio = datetime.datetime.now().date().isoformat()
     fecha_fin = (datetime.datetime.now() + datetime.timedelta(days=30)).date().isoformat()
     
     # IMPORTANTE: Estos nombres deben coincidir con tu models.py (usuario y canal)
-    datos = {
+    return {
         "usuario": int(usuario_id),
         "canal": int(canal_id),
         "fecha_inicio": fecha_inicio,
         "fecha_fin": fecha_fin,
         "monto_total": float(monto_pagado)
     }
-    
-    try:
-        # Petición al puerto 8000 donde corre tu lógica de base de datos
-        res = requests.post("http://localhost:8000/suscripcion_con_pago/", json=datos, timeout=5)
-        if res.status_code == 200:
-            print(f"✅ Guardado en DB exitoso (Monto: {monto_pagado})")
-        else:
-            print(f"❌ Error {res.status_code} en DB: {res.text}")
-    except Exception as e:
-        print(f"⚠️ Error de conexión con la API en el puerto 8000: {e}")
+
+def build_campaign_payment(alias, monto, user_id):
+    """Datos de un pago de campaña tal como los espera `/confirmar-pago-publicidad`."""
+    return {
+        "alias": alias,
+        "monto": float(monto),
+        "user_id": user_id 
+    }
+
+async def enqueue_task_async(queue, payload):
+    """Versión no bloqueante de `enqueue_task` para usar dentro del event loop."""
+    return await async_redis_client.xadd(queue, {"data": json.dumps(payload)}, maxlen=QUEUE_MAXLEN, approximate=True)
 
 def trigger_bot_invite(user_id, canal_id):
     """Orden para que el Bot genere el link de invitación vía Redis"""
     payload = {"action": "create_invite", "user_id": int(user_id), "channel_alias": str(canal_id)}
-    redis_client.publish('invitation_queue', json.dumps(payload))
+    enqueue_task('invitation_queue', payload)
     print(f"🚀 Invitación solicitada en Redis para {user_id}")
 
-def handle_payment_created(body):
-    """Procesa los Webhooks de Mercado Pago"""
-    resource_id = body.get("data", {}).get("id") or body.get("id")
-    if body.get("type") == "payment":
-        try:
-            url = f"https://api.mercadopago.com/v1/payments/{resource_id}"
-            res = requests.get(url, headers={"Authorization": f"Bearer {MP_ACCESS_TOKEN}"})
-            if res.status_code == 200:
-                data = res.json()
-                monto = data.get("transaction_amount")
-                ext_ref = data.get("external_reference") 
-                if data.get("status") == "approved" and ext_ref:
-                    # El external_reference debe ser "user_id;canal_id"
-                    uid, cid = ext_ref.split(";")
-                    handle_subscription_payment(uid, cid, monto)
-                    trigger_bot_invite(uid, cid)
-                    return True
-        except Exception as e:
-            print(f"❌ Error procesando pago de Mercado Pago: {e}")
-    return False
+async def fetch_mp_payment(resource_id):
+    """Consulta un pago de Mercado Pago (cliente HTTP compartido). Devuelve el JSON o None si no existe."""
+    res = await providers.http_client().get(
+        f"{providers.MP_API_BASE}/v1/payments/{resource_id}",
+        headers={"Authorization": f"Bearer {MP_ACCESS_TOKEN}"}
+    )
+    if res.status_code == 200:
+        return res.json()
+    if res.status_code == 404:
+        return None
+    res.raise_for_status()
 
-def actualizar_pago_campania(alias, monto, user_id): # <-- Agrégalo aquí
-    """Envía los datos al puerto 8000, incluyendo el ID del usuario"""
-    datos = {
-        "alias": alias,
-        "monto": float(monto),
-        "user_id": user_id 
-    }
-    
-    try:
-        res = requests.post("http://localhost:8000/confirmar-pago-publicidad", json=datos, timeout=5)
-        if res.status_code == 200:
-            print(f"✅ Notificación enviada al puerto 8000 para: {alias}")
-    except Exception as e:
-        print(f"⚠️ Error de conexión: {e}")
\ No newline at end of file
+mp_payments = PaymentStatusCache(
+    async_redis_client,
+    fetch_mp_payment,
+    max_items=int(os.getenv("MP_CACHE_SIZE", "2048")),
+    ttl=int(os.getenv("MP_CACHE_TTL", "86400"))
+)
+
+async def get_mp_payment(resource_id, newer_than=None):
+    """Única vía para consultar pagos de MP: pasa por la caché (`newer_than`: ver payment_cache.py)."""
+    return await mp_payments.get(resource_id, newer_than=newer_than)
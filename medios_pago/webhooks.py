@@ -0,0 +1,224 @@
+"""
+Ingesta de webhooks de pago: se verifica, se guarda y se responde al instante.
+
+1. La ruta verifica la firma (si hay secreto configurado), extrae el ID de
+   evento del proveedor y ejecuta `STORE_SCRIPT`: `SET NX` de la clave de
+   idempotencia + `XADD` al stream `webhook_events`, atómico en Redis.
+   Una entrega repetida del mismo evento no vuelve a encolarse.
+2. `WebhookProcessor` (tarea de fondo en cada worker de uvicorn) consume el
+   stream con un consumer group: procesa en orden por `order_key` (usuario o
+   pago), reintenta lo que falla (sin ACK + reclaim) y manda a
+   `webhook_events:dead` lo que agota los intentos.
+3. Antes de aplicar un pago se toma la marca `webhook:applied:...` con
+   `SET NX` ("processing:<token>" mientras se aplica, "1" al terminar): dos
+   entregas del mismo pago no lo aplican a la vez, y cada paso (suscripción,
+   invitación) deja su propia marca para que un reintento haga solo lo que
+   faltó. Así un mismo pago no genera dos suscripciones ni dos invitaciones.
+"""
+import os
+import hmac
+import json
+import socket
+import asyncio
+import time
+import hashlib
+import uuid
+
+from redis.exceptions import ResponseError
+
+import metrics
+
+WEBHOOK_STREAM = "webhook_events"
+WEBHOOK_GROUP = "webhook_processor"
+DEAD_STREAM = f"{WEBHOOK_STREAM}:dead"
+IDEMPOTENCY_TTL = int(os.getenv("WEBHOOK_IDEMPOTENCY_TTL", str(7 * 24 * 3600)))
+STREAM_MAXLEN = int(os.getenv("QUEUE_MAXLEN", "100000"))
+RECLAIM_IDLE_MS = int(os.getenv("WEBHOOK_RECLAIM_IDLE_MS", "30000"))
+MAX_DELIVERIES = int(os.getenv("WEBHOOK_MAX_DELIVERIES", "5"))
+PROCESSOR_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "100"))
+# Vence antes del próximo reclaim: si el worker que aplicaba el pago murió, el reintento lo retoma
+APPLY_CLAIM_TTL = max(1, RECLAIM_IDLE_MS // 1000)
+
+# KEYS: clave de idempotencia, stream. ARGV: ttl, maxlen, provider, event_id, order_key, data
+STORE_SCRIPT = """
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[1]) then
+    return redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*',
+        'provider', ARGV[3], 'event_id', ARGV[4], 'order_key', ARGV[5], 'data', ARGV[6])
+end
+return false
+"""
+
+
+# KEYS: marca del pago. ARGV: token. Borra la marca solo si sigue siendo de quien la tomó.
+RELEASE_CLAIM_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class PaymentInProgress(Exception):
+    """Otra entrega del mismo pago lo está aplicando; se reintenta (sin ACK) en el próximo reclaim."""
+
+
+async def claim_payment(redis_conn, marker: str):
+    """Toma el pago para aplicarlo. Devuelve el token, o None si ya estaba aplicado."""
+    token = f"processing:{uuid.uuid4().hex}"
+    if await redis_conn.set(marker, token, nx=True, ex=APPLY_CLAIM_TTL):
+        return token
+    state = await redis_conn.get(marker)
+    if state is None or state.startswith("processing:"):
+        raise PaymentInProgress(marker)
+    return None
+
+
+async def release_claim(redis_conn, marker: str, token: str):
+    await redis_conn.eval(RELEASE_CLAIM_SCRIPT, 1, marker, token)
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+# --- Verificación de firmas ---
+
+def verify_coinbase(body: bytes, signature: str):
+    secret = os.getenv("COINBASE_WEBHOOK_SECRET")
+    if not secret:
+        return
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    if not signature or not hmac.compare_digest(expected, signature):
+        raise InvalidSignature("Firma de Coinbase inválida")
+
+
+def verify_mercadopago(headers, data_id: str):
+    """Valida `x-signature` (ts + HMAC-SHA256 del manifest) si MP_WEBHOOK_SECRET está definido."""
+    secret = os.getenv("MP_WEBHOOK_SECRET")
+    if not secret:
+        return
+    parts = dict(p.strip().split("=", 1) for p in (headers.get("x-signature") or "").split(",") if "=" in p)
+    manifest = f"id:{str(data_id).lower()};request-id:{headers.get('x-request-id', '')};ts:{parts.get('ts', '')};"
+    expected = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, parts.get("v1", "")):
+        raise InvalidSignature("Firma de Mercado Pago inválida")
+
+
+# --- Almacenamiento idempotente ---
+
+async def store_event(redis_conn, provider: str, event_id: str, order_key: str, data: dict) -> bool:
+    """Guarda el evento si es nuevo. Devuelve False si ya se había recibido."""
+    stored = await redis_conn.eval(
+        STORE_SCRIPT, 2,
+        f"webhook:seen:{provider}:{event_id}", WEBHOOK_STREAM,
+        IDEMPOTENCY_TTL, STREAM_MAXLEN, provider, event_id, order_key or "", json.dumps(data)
+    )
+    metrics.labeled(metrics.WEBHOOK_EVENTS, provider, "stored" if stored else "duplicate").inc()
+    return bool(stored)
+
+
+# --- Procesamiento en segundo plano ---
+
+class WebhookProcessor:
+    """Consume `webhook_events`: orden por order_key, reintentos y dead-letter."""
+
+    def __init__(self, redis_conn, handler, concurrency: int = PROCESSOR_CONCURRENCY):
+        self.redis = redis_conn
+        self.handler = handler
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.slots = asyncio.Semaphore(concurrency)
+        self._locks = {}
+        self._active = set()
+        self._tasks = set()
+
+    async def _ensure_group(self):
+        try:
+            await self.redis.xgroup_create(WEBHOOK_STREAM, WEBHOOK_GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def _dead_letter(self, message_id, fields, reason):
+        await self.redis.xadd(DEAD_STREAM, {**fields, "source_id": message_id, "reason": reason[:500]},
+                              maxlen=STREAM_MAXLEN, approximate=True)
+        await self.redis.xack(WEBHOOK_STREAM, WEBHOOK_GROUP, message_id)
+        metrics.labeled(metrics.WEBHOOK_EVENTS, fields.get("provider", "desconocido"), "dead").inc()
+        print(f"☠️ Webhook {message_id} a dead-letter: {reason}")
+
+    async def _reclaim(self):
+        pending = await self.redis.xpending_range(
+            WEBHOOK_STREAM, WEBHOOK_GROUP, min='-', max='+', count=100, idle=RECLAIM_IDLE_MS
+        )
+        pending = [p for p in pending if p['message_id'] not in self._active]
+        if not pending:
+            return []
+        deliveries = {p['message_id']: p['times_delivered'] for p in pending}
+        claimed = await self.redis.xclaim(
+            WEBHOOK_STREAM, WEBHOOK_GROUP, self.consumer, min_idle_time=RECLAIM_IDLE_MS,
+            message_ids=list(deliveries)
+        )
+        entries = []
+        for message_id, fields in claimed:
+            if fields is None:
+                await self.redis.xack(WEBHOOK_STREAM, WEBHOOK_GROUP, message_id)
+            elif deliveries.get(message_id, 0) >= MAX_DELIVERIES:
+                await self._dead_letter(message_id, fields, f"{deliveries[message_id]} intentos fallidos")
+            else:
+                entries.append((message_id, fields))
+        return entries
+
+    async def _process(self, message_id, fields, key):
+        entry = self._locks[key]
+        provider = fields.get("provider", "desconocido")
+        outcome = "error"
+        started = time.time()
+        # El ID del stream es el timestamp (ms) del XADD
+        metrics.labeled(metrics.WEBHOOK_LAG_SECONDS, provider).observe(
+            max(0.0, started - int(message_id.split("-", 1)[0]) / 1000)
+        )
+        try:
+            # El lock por order_key mantiene el orden de llegada para un mismo usuario/pago
+            async with entry[0]:
+                await self.handler(fields["provider"], json.loads(fields["data"]))
+            await self.redis.xack(WEBHOOK_STREAM, WEBHOOK_GROUP, message_id)
+            outcome = "ok"
+        except Exception as e:
+            print(f"❌ Error procesando webhook {message_id} ({fields.get('provider')}): {e}")
+        finally:
+            metrics.labeled(metrics.WEBHOOK_PROCESS_SECONDS, provider, outcome).observe(time.time() - started)
+            self._active.discard(message_id)
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+            self.slots.release()
+
+    async def run(self):
+        await self._ensure_group()
+        loop = asyncio.get_running_loop()
+        next_reclaim = 0.0
+        while True:
+            try:
+                entries = []
+                if loop.time() >= next_reclaim:
+                    entries = await self._reclaim()
+                    next_reclaim = loop.time() + RECLAIM_IDLE_MS / 2000
+                if not entries:
+                    response = await self.redis.xreadgroup(
+                        WEBHOOK_GROUP, self.consumer, {WEBHOOK_STREAM: '>'}, count=50, block=5000
+                    )
+                    entries = [e for _stream, messages in response or [] for e in messages]
+
+                for message_id, fields in entries:
+                    await self.slots.acquire()
+                    self._active.add(message_id)
+                    key = fields.get("order_key") or message_id
+                    # [lock, tareas que lo usan]: se borra cuando ya nadie lo espera
+                    self._locks.setdefault(key, [asyncio.Lock(), 0])[1] += 1
+                    task = asyncio.create_task(self._process(message_id, fields, key))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Error en el procesador de webhooks: {e}")
+                await asyncio.sleep(5)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de throughput del consumidor de `invitation_creator`.
+
+Usa un cliente Telegram falso (latencia RPC configurable) y un Redis real,
+en una base aislada (BENCH_REDIS_URL, por defecto /15; se rechaza la base 0)
+y con un stream propio: nunca toca `invitation_queue` de producción.
+Mide:
+  - reposo: CPU consumida por el consumidor sin mensajes (debe ser ~0)
+  - ráfaga: mensajes/segundo procesando N `create_invite` encolados
+
+Uso: BENCH_REDIS_URL=redis://localhost:6379/15 python bench/invitation_throughput.py [N] [rpc_ms]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+WORKERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'workers')
+sys.path.insert(0, os.path.join(WORKERS, 'channel_manager'))
+
+BENCH_REDIS_URL = os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15")
+BENCH_QUEUE = "bench:invitation_queue"
+# Antes de importar el worker: su cliente Redis (y el del pool de links) sale de REDIS_URL
+os.environ["REDIS_URL"] = BENCH_REDIS_URL
+
+import logging
+import invitation_creator as ic
+
+ic.INVITATION_QUEUE = BENCH_QUEUE
+
+logging.getLogger("InvitationCreator").setLevel(logging.WARNING)
+
+
+class FakeClient:
+    """Simula Telethon: cada RPC tarda `rpc_ms` milisegundos."""
+
+    def __init__(self, rpc_ms: float):
+        self.delay = rpc_ms / 1000
+        self.sent = 0
+        self.done = asyncio.Event()
+        self.target = None
+
+    async def get_entity(self, entity_id):
+        await asyncio.sleep(self.delay)
+        return entity_id
+
+    async def __call__(self, request):
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(link="https://t.me/+bench")
+
+    async def send_message(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        self.sent += 1
+        if self.target and self.sent >= self.target:
+            self.done.set()
+
+
+async def run(total: int, rpc_ms: float):
+    conn = ic.redis_conn
+    if conn.connection_pool.connection_kwargs.get("db", 0) == 0:
+        raise SystemExit("BENCH_REDIS_URL apunta a la base 0: usá una base aislada (p. ej. /15)")
+    # Stream limpio para que no se procese backlog de corridas anteriores
+    await conn.delete(BENCH_QUEUE)
+    client = FakeClient(rpc_ms)
+    consumer = asyncio.create_task(ic.consume(client, conn))
+    await asyncio.sleep(0.5)
+
+    # 1. Reposo: 3 s sin mensajes
+    cpu0 = time.process_time()
+    await asyncio.sleep(3)
+    idle_cpu = time.process_time() - cpu0
+    print(f"reposo : CPU {idle_cpu * 1000:.1f} ms en 3 s ({idle_cpu / 3 * 100:.2f}% de un core)")
+
+    # 2. Ráfaga: N invitaciones encoladas de golpe
+    client.target = total
+    payload = json.dumps({"action": "create_invite", "user_id": 1, "channel_alias": "123"})
+    started = time.perf_counter()
+    async with conn.pipeline(transaction=False) as pipe:
+        for _ in range(total):
+            pipe.xadd(BENCH_QUEUE, {"data": payload})
+        await pipe.execute()
+    await client.done.wait()
+    elapsed = time.perf_counter() - started
+    print(f"ráfaga : {total} mensajes en {elapsed:.2f} s -> {total / elapsed:.0f} msg/s "
+          f"(concurrencia={ic.MAX_CONCURRENCY}, rpc={rpc_ms} ms)")
+
+    consumer.cancel()
+    await asyncio.gather(consumer, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rpc = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(run(n, rpc))
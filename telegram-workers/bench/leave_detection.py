@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark de detección de bajas del metrics_tracker.
+
+Compara el método anterior (`db_id not in lista`, O(N·M)) contra
+`common.member_snapshot.departures` (set, O(N + M)) y el diff por snapshot.
+
+Uso: python bench/leave_detection.py [miembros] [porcentaje_bajas]
+"""
+import os
+import sys
+import time
+import random
+
+WORKERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'workers')
+sys.path.insert(0, WORKERS)
+
+from common.member_snapshot import MemberSnapshot, departures
+
+# La versión con lista es cuadrática: por encima de este tamaño se extrapola
+LIST_LIMIT = 3000
+
+
+def legacy_departures(db_ids, telegram_user_ids):
+    return [db_id for db_id in db_ids if db_id not in telegram_user_ids]
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main(members: int, leave_pct: float):
+    rng = random.Random(42)
+    db_ids = rng.sample(range(10**6, 10**10), members)
+    leaving = set(rng.sample(db_ids, int(members * leave_pct / 100)))
+    current = [uid for uid in db_ids if uid not in leaving]
+    rng.shuffle(current)
+
+    result, t_set = timed(departures, db_ids, current)
+    assert len(result) == len(leaving)
+    print(f"set          : {members:>7} miembros, {len(result)} bajas en {t_set * 1000:8.1f} ms")
+
+    snapshot = MemberSnapshot(1, db_ids)
+    (joined, left), t_snap = timed(snapshot.diff, current)
+    assert len(left) == len(leaving) and not joined
+    print(f"snapshot diff: {members:>7} miembros, {len(left)} bajas en {t_snap * 1000:8.1f} ms")
+
+    n = min(members, LIST_LIMIT)
+    sample_db, sample_current = db_ids[:n], [uid for uid in current if uid in set(db_ids[:n])]
+    _, t_list = timed(legacy_departures, sample_db, sample_current)
+    if n < members:
+        t_list *= (members / n) ** 2
+        label = "estimado"
+    else:
+        label = "medido"
+    print(f"lista        : {members:>7} miembros en {t_list * 1000:8.1f} ms ({label}) "
+          f"-> {t_list / max(t_set, 1e-9):.0f}x más lento")
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    pct = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    main(size, pct)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark del costo de las métricas Prometheus en los hot paths.
+
+Compara, por observación:
+  - `.labels(...).observe()` (lookup con lock en cada llamada)
+  - `common.metrics.labeled(...).observe()` (hijo cacheado)
+  - el envoltorio de un RPC instrumentado (perf_counter + try/finally +
+    histograma) sobre una corrutina vacía, contra la corrutina sola
+
+Uso: python bench/metrics_overhead.py [iteraciones]
+"""
+import os
+import sys
+import time
+import asyncio
+
+WORKERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'workers')
+sys.path.insert(0, WORKERS)
+
+from common import metrics
+
+
+def per_call_ns(fn, n):
+    started = time.perf_counter()
+    fn(n)
+    return (time.perf_counter() - started) / n * 1e9
+
+
+def with_labels(n):
+    for _ in range(n):
+        metrics.TG_RPC_SECONDS.labels("GetParticipantsRequest").observe(0.05)
+
+
+def with_labeled(n):
+    for _ in range(n):
+        metrics.labeled(metrics.TG_RPC_SECONDS, "GetParticipantsRequest").observe(0.05)
+
+
+def counter_labeled(n):
+    for _ in range(n):
+        metrics.labeled(metrics.QUEUE_MESSAGES, "invitation_queue", "ok").inc()
+
+
+async def rpc():
+    return None
+
+
+async def instrumented(method):
+    """Mismo envoltorio que rpc_stats.CountingTelegramClient._instrumented_call."""
+    started = time.perf_counter()
+    try:
+        return await rpc()
+    finally:
+        metrics.labeled(metrics.TG_RPC_SECONDS, method).observe(time.perf_counter() - started)
+
+
+async def bare_rpcs(n):
+    for _ in range(n):
+        await rpc()
+
+
+async def instrumented_rpcs(n):
+    for _ in range(n):
+        await instrumented("SendMessageRequest")
+
+
+def run_async(coro_fn):
+    return lambda n: asyncio.run(coro_fn(n))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with_labeled(1000)  # calienta el caché
+
+    labels_ns = per_call_ns(with_labels, n)
+    labeled_ns = per_call_ns(with_labeled, n)
+    counter_ns = per_call_ns(counter_labeled, n)
+    bare_ns = per_call_ns(run_async(bare_rpcs), n)
+    wrapped_ns = per_call_ns(run_async(instrumented_rpcs), n)
+
+    print(f"Observaciones: {n}")
+    print(f"  histograma .labels().observe()   {labels_ns:8.0f} ns")
+    print(f"  histograma labeled().observe()   {labeled_ns:8.0f} ns  ({labels_ns / labeled_ns:.1f}x)")
+    print(f"  contador labeled().inc()         {counter_ns:8.0f} ns")
+    print(f"  RPC vacío sin instrumentar       {bare_ns:8.0f} ns")
+    print(f"  RPC vacío instrumentado          {wrapped_ns:8.0f} ns  (+{wrapped_ns - bare_ns:.0f} ns por RPC)")
+    # Un RPC real a Telegram tarda decenas de ms: el costo relativo es despreciable
+    print(f"  sobre un RPC de 50 ms:           {(wrapped_ns - bare_ns) / 50e6 * 100:.4f}%")
+
+
+if __name__ == '__main__':
+    main()
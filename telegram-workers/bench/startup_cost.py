@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Costo de arranque de cada punto de entrada: cuánto tarda un reinicio del
+manager (o una réplica nueva) antes de poder trabajar.
+
+Por cada worker del manifiesto (deploy/workers.json) y medios_pago/main.py
+lanza un intérprete limpio que solo importa el módulo (sin ejecutar main) y
+mide:
+  - import: tiempo de ejecutar el módulo (imports + objetos de nivel módulo)
+  - total: proceso completo, incluido el arranque del intérprete
+  - RSS al terminar de importar y cantidad de módulos cargados
+  - los paquetes más pesados según `python -X importtime`
+
+Uso: python bench/startup_cost.py [repeticiones]
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKERS = os.path.join(ROOT, 'telegram-workers', 'workers')
+MANIFEST = os.getenv('WORKERS_MANIFEST', os.path.join(ROOT, 'deploy', 'workers.json'))
+
+PROBE = r'''
+import os, sys, json, time, importlib.util
+started = time.perf_counter()
+path = sys.argv[1]
+sys.path.insert(0, os.path.dirname(path))
+os.chdir(os.path.dirname(path))
+spec = importlib.util.spec_from_file_location("entry_point", path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - started
+with open("/proc/self/status") as f:
+    rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+print(json.dumps({"import_s": elapsed, "rss_kb": rss_kb, "modules": len(sys.modules)}))
+'''
+
+
+def entry_points() -> list:
+    with open(MANIFEST, encoding='utf-8') as f:
+        workers = json.load(f).get('workers', [])
+    points = [(w['name'], os.path.join(WORKERS, w['script'])) for w in workers]
+    points.append(('medios_pago', os.path.join(ROOT, 'medios_pago', 'main.py')))
+    return points
+
+
+def heaviest(importtime: str, top: int = 3) -> list:
+    """Paquetes raíz con más tiempo acumulado de import (líneas de primer nivel de -X importtime)."""
+    totals = {}
+    for line in importtime.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        if name.startswith('  ') or not cumulative.strip().isdigit():
+            continue  # import anidado: ya está incluido en el acumulado de su padre
+        root = name.strip().split('.')[0]
+        totals[root] = totals.get(root, 0) + int(cumulative)
+    return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:top]
+
+
+def probe(path: str) -> dict:
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE, path],
+                          capture_output=True, text=True, env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'})
+    total = time.perf_counter() - started
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+        return {'error': error}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['total_s'] = total
+    result['heaviest'] = heaviest(proc.stderr)
+    return result
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    baseline = median(probe_interpreter() for _ in range(runs))
+    print(f"Intérprete vacío: {baseline * 1000:.0f} ms ({runs} repeticiones, mediana)")
+    print(f"  {'entrada':<20} {'import':>8} {'total':>8} {'RSS':>8} {'módulos':>8}  más pesados")
+    for name, path in entry_points():
+        samples = [probe(path) for _ in range(runs)]
+        ok = [s for s in samples if 'error' not in s]
+        if not ok:
+            print(f"  {name:<20} error: {samples[0]['error']}")
+            continue
+        heavy = ", ".join(f"{pkg} {us / 1000:.0f}ms" for pkg, us in ok[0]['heaviest'])
+        print(f"  {name:<20} {median(s['import_s'] for s in ok) * 1000:>6.0f}ms "
+              f"{median(s['total_s'] for s in ok) * 1000:>6.0f}ms "
+              f"{median(s['rss_kb'] for s in ok) / 1024:>6.1f}MB {ok[0]['modules']:>8}  {heavy}")
+
+
+def probe_interpreter() -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    main()
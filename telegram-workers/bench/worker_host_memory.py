@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memoria de un proceso por rol (deploy/workers.json) contra worker_host.py
+con los mismos roles en un solo proceso.
+
+Por cada rol lanza un intérprete limpio que importa el módulo del rol (sus
+objetos de nivel módulo, cliente Redis incluido) y crea un Telegram client
+sin conectar, como al arrancar un worker. Después, un intérprete con todos
+los roles y un solo cliente, como el host. Mide al final:
+  - RSS (VmRSS), lo que ve el límite del contenedor y el manager
+  - USS (Private_Clean + Private_Dirty): lo que se libera al matar el proceso,
+    sin las páginas de librerías compartidas con otros procesos
+
+Es un piso: en producción cada proceso suma además su conexión MTProto,
+buffers, cachés de entidades y el pool de conexiones Redis, que en el host
+también se comparten. No necesita Telegram ni Redis.
+
+Uso: python bench/worker_host_memory.py [repeticiones] [rol ...]
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from statistics import median
+
+WORKERS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'workers')
+sys.path.insert(0, WORKERS)
+from worker_host import ROLES  # noqa: E402
+
+PROBE = r'''
+import os, sys, gc, json, importlib
+sys.path.insert(0, sys.argv[1])
+modules = sys.argv[2:]
+for name in modules:
+    importlib.import_module(name)
+from telethon.sessions import StringSession
+from common.rpc_stats import CountingTelegramClient
+client = CountingTelegramClient(StringSession(), 1, "0" * 32)
+gc.collect()
+
+def field(path, *names):
+    with open(path) as f:
+        return sum(int(line.split()[1]) for line in f if line.split(":")[0] in names)
+
+print(json.dumps({
+    "rss_kb": field("/proc/self/status", "VmRSS"),
+    "uss_kb": field("/proc/self/smaps_rollup", "Private_Clean", "Private_Dirty"),
+    "modules": len(sys.modules),
+}))
+'''
+
+
+def probe(modules: list, runs: int) -> dict:
+    samples = []
+    with tempfile.TemporaryDirectory() as cwd:
+        # cwd temporal: los roles crean sus directorios de reportes/snapshots al importar
+        for _ in range(runs):
+            proc = subprocess.run([sys.executable, '-c', PROBE, WORKERS, *modules], cwd=cwd,
+                                  capture_output=True, text=True,
+                                  env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'})
+            if proc.returncode != 0:
+                error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+                return {'error': error}
+            samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return {key: median(s[key] for s in samples) for key in samples[0]}
+
+
+def mb(kb: float) -> str:
+    return f"{kb / 1024:>7.1f}MB"
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    roles = sys.argv[2:] or list(ROLES)
+    print(f"Roles: {', '.join(roles)} ({runs} repeticiones, mediana)")
+    print(f"  {'proceso':<28} {'RSS':>9} {'USS':>9} {'módulos':>8}")
+
+    separate = {}
+    for role in roles:
+        result = probe([ROLES[role][0]], runs)
+        if 'error' in result:
+            print(f"  {role:<28} error: {result['error']}")
+            continue
+        separate[role] = result
+        print(f"  {role:<28} {mb(result['rss_kb'])} {mb(result['uss_kb'])} {result['modules']:>8}")
+    if not separate:
+        return
+
+    total_rss = sum(r['rss_kb'] for r in separate.values())
+    total_uss = sum(r['uss_kb'] for r in separate.values())
+    host = probe([ROLES[role][0] for role in separate], runs)
+    if 'error' in host:
+        print(f"  host: error: {host['error']}")
+        return
+    print(f"  {f'un proceso por rol ({len(separate)})':<28} {mb(total_rss)} {mb(total_uss)}")
+    print(f"  {'worker_host.py':<28} {mb(host['rss_kb'])} {mb(host['uss_kb'])} {host['modules']:>8}")
+    print(f"Ahorro: RSS {mb(total_rss - host['rss_kb']).strip()} ({1 - host['rss_kb'] / total_rss:.0%}), "
+          f"USS {mb(total_uss - host['uss_kb']).strip()} ({1 - host['uss_kb'] / total_uss:.0%})")
+
+
+if __name__ == '__main__':
+    main()
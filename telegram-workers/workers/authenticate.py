@@ -1,4 +1,5 @@
 import os
+import sys
 import asyncio
 from telethon import TelegramClient
 from dotenv import load_dotenv 
@@ -9,18 +10,35 @@ load_dotenv()
 SESSION_NAME = os.getenv("TG_SESSION", "plataforma_session")
 API_ID = int(os.getenv("TG_API_ID", os.getenv("TG_API_ID_ADMIN", "0")))
 API_HASH = os.getenv("TG_API_HASH", os.getenv("TG_API_HASH_ADMIN", ""))
+# Varias cuentas admin: TG_SESSIONS=cuenta_a,cuenta_b (o como argumentos).
+# TG_SESSION_SUFFIXES=_group,_remove crea un archivo por worker para cada cuenta.
+# Sesiones de docker-compose.yml (cada contenedor la suya), desde workers/:
+#   TG_SESSION_SUFFIXES=_group,_remove,_sweep,_metrics python authenticate.py plataforma_session
+#   cd channel_manager && TG_SESSION=plataforma_session_invite python ../authenticate.py
+SESSION_SUFFIXES = [s.strip() for s in os.getenv("TG_SESSION_SUFFIXES", "").split(",")]
 
-async def main():
-    print(f"Iniciando autenticación para la sesión: {SESSION_NAME}")
+def session_names():
+    accounts = sys.argv[1:] or [a.strip() for a in os.getenv("TG_SESSIONS", "").split(",") if a.strip()]
+    accounts = accounts or [SESSION_NAME]
+    return [f"{account}{suffix}" for account in accounts for suffix in SESSION_SUFFIXES]
+
+async def authenticate(session_name):
+    print(f"Iniciando autenticación para la sesión: {session_name}")
     # Telethon requiere API_ID y API_HASH válidos. Asegúrate de que .env esté cargado.
-    client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+    client = TelegramClient(session_name, API_ID, API_HASH)
     
     # Este paso intentará conectarse y, si es la primera vez, pedirá tu teléfono, código, etc.
     await client.start() 
+    me = await client.get_me()
     
-    print(f"✅ ¡Autenticación de '{SESSION_NAME}' completada!")
+    print(f"✅ ¡Autenticación de '{session_name}' completada! (@{me.username or me.id})")
     await client.disconnect()
 
+async def main():
+    # Una sesión a la vez: cada una puede pedir teléfono y código por consola
+    for session_name in session_names():
+        await authenticate(session_name)
+
 if __name__ == '__main__':
     # Debes usar la misma terminal donde cargaste .env
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
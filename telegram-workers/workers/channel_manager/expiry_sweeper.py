@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Barrido periódico de suscripciones vencidas.
+
+En lugar de un mensaje `remove_user` por suscriptor, cada SWEEP_INTERVAL:
+  1. pide al backend todas las suscripciones vencidas (una sola consulta)
+  2. las agrupa por canal y expulsa con el cliente del pool, a ritmo
+     KICK_RATE/s para no disparar FloodWait
+  3. devuelve los resultados en UNA llamada masiva (borrado de suscripción +
+     evento LEAVE_CHANNEL) y suma las bajas a los rollups de los gráficos
+  4. registra el throughput (expulsiones/min) en el log y en `sweeper:stats`
+
+Lo que falla siempre igual (la cuenta no es admin, canal no resoluble, o
+SWEEP_MAX_ATTEMPTS errores seguidos) se aparta SWEEP_SKIP_TTL s en
+`sweeper:skip`: el backend lo sigue devolviendo como vencido, pero se pide
+un lote más grande y se descarta, así no ocupa SWEEP_BATCH en cada barrido.
+FloodWait y falta de cuenta disponible no cuentan: se reintentan siempre.
+
+Un solo barrido a la vez entre réplicas: `sweeper:lock` guarda un token
+propio con TTL SWEEP_LOCK_TTL que se renueva mientras dura el barrido (que
+puede superar SWEEP_INTERVAL). Renovar y liberar comparan el token, así una
+réplica nunca borra el lock de otra; si se pierde, el barrido se corta.
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+import logging
+from itertools import groupby
+from datetime import timedelta, datetime
+from dotenv import load_dotenv
+from telethon import functions
+from telethon.tl import types
+from telethon.errors import ChatAdminRequiredError, FloodWaitError, UserNotParticipantError
+
+# Permite importar el paquete compartido `common` desde workers/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.client_pool import get_pool
+from common.backend_client import get_backend
+from common.rate_governor import TokenBucket
+from common.session_router import SessionRouter, NoSessionAvailable
+from common.rollups import Rollups
+from common.redis_pool import get_redis
+from common import lifecycle
+
+load_dotenv()
+
+# --- Configuración ---
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+SWEEP_INTERVAL = int(os.getenv("SWEEP_INTERVAL", "900"))
+SWEEP_BATCH = int(os.getenv("SWEEP_BATCH", "5000"))
+KICK_RATE = float(os.getenv("KICK_RATE", "3"))
+LOCK_KEY = "sweeper:lock"
+SWEEP_LOCK_TTL = int(os.getenv("SWEEP_LOCK_TTL", "120"))
+STATS_KEY = "sweeper:stats"
+SKIP_KEY = "sweeper:skip"
+ATTEMPTS_KEY = "sweeper:attempts"
+SWEEP_MAX_ATTEMPTS = int(os.getenv("SWEEP_MAX_ATTEMPTS", "3"))
+SWEEP_SKIP_TTL = int(os.getenv("SWEEP_SKIP_TTL", str(24 * 3600)))
+# Errores que reintentar en el próximo barrido no arregla / que sí
+PERMANENT_ERRORS = {"admin_required", "channel_unresolvable"}
+TRANSIENT_ERRORS = {"flood_wait", "no_session"}
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("ExpirySweeper")
+
+redis_client = get_redis(REDIS_URL)
+# Cuentas admin (TG_SESSIONS o solo TG_SESSION); ventanas de FloodWait compartidas con user_remover
+router = SessionRouter(redis_client)
+rollups = Rollups(redis_client)
+kick_governors = {}
+
+# KEYS: lock. ARGV: token, ttl. Solo el dueño del lock lo renueva / libera.
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+renew_lock = redis_client.register_script(RENEW_SCRIPT)
+release_lock = redis_client.register_script(RELEASE_SCRIPT)
+
+KICKED_RIGHTS = types.ChatBannedRights(
+    until_date=timedelta(minutes=1),
+    view_messages=True
+)
+
+def skip_member(item) -> str:
+    return f"{item['canal']}:{item['usuario']}"
+
+async def fetch_expired():
+    """Suscripciones con fecha_fin vencida: [{"usuario": id, "canal": id}, ...], sin las apartadas."""
+    await redis_client.zremrangebyscore(SKIP_KEY, "-inf", time.time())
+    skipped = set(await redis_client.zrange(SKIP_KEY, 0, -1))
+    # Las apartadas siguen vencidas en el backend: se piden de más para completar el lote
+    res = await get_backend().get("/suscripciones/vencidas", params={
+        "hasta": datetime.now().date().isoformat(),
+        "limit": SWEEP_BATCH + len(skipped)
+    })
+    res.raise_for_status()
+    return [s for s in res.json() if skip_member(s) not in skipped][:SWEEP_BATCH]
+
+async def record_failures(results):
+    """Aparta lo que falla de forma permanente (ver docstring del módulo)."""
+    failed = [r for r in results if not r["ok"] and r["error"] not in TRANSIENT_ERRORS]
+    pipe = redis_client.pipeline(transaction=False)
+    for r in results:
+        if r["ok"]:
+            pipe.hdel(ATTEMPTS_KEY, skip_member(r))
+    for r in failed:
+        pipe.hincrby(ATTEMPTS_KEY, skip_member(r), 1)
+    pipe.expire(ATTEMPTS_KEY, SWEEP_SKIP_TTL)
+    attempts = (await pipe.execute())[-len(failed) - 1:-1] if failed else []
+
+    until = time.time() + SWEEP_SKIP_TTL
+    skip = {skip_member(r): until for r, n in zip(failed, attempts)
+            if r["error"] in PERMANENT_ERRORS or n >= SWEEP_MAX_ATTEMPTS}
+    if skip:
+        await redis_client.zadd(SKIP_KEY, skip)
+        await redis_client.hdel(ATTEMPTS_KEY, *skip)
+        logger.warning(f"⏭️ {len(skip)} suscripciones con fallas permanentes apartadas por {SWEEP_SKIP_TTL}s.")
+
+def kick_governor(account):
+    """Un token bucket por cuenta: cada una tiene su propio presupuesto de flood."""
+    if account not in kick_governors:
+        kick_governors[account] = TokenBucket(KICK_RATE, max(1, int(KICK_RATE)))
+    return kick_governors[account]
+
+async def kick_channel(client, account, canal_id, usuarios):
+    """Expulsa a los usuarios de un canal. Devuelve un resultado por usuario."""
+    results = []
+    cache = router.entity_cache(account)
+    try:
+        channel = await cache.input_channel(client, canal_id)
+    except Exception as e:
+        logger.error(f"❌ Canal {canal_id} no resoluble: {e}")
+        return [{"usuario": u, "canal": canal_id, "ok": False, "error": "channel_unresolvable"} for u in usuarios]
+
+    for i, usuario in enumerate(usuarios):
+        if await router.flood.blocked_until(account, 'EditBannedRequest'):
+            # Sin dormir dentro del barrido: siguen vencidas y entran en el próximo
+            return results + [{"usuario": u, "canal": canal_id, "ok": False, "error": "flood_wait"}
+                              for u in usuarios[i:]]
+        await kick_governor(account).acquire()
+        try:
+            participant = await cache.input_user(client, usuario)
+            await client(functions.channels.EditBannedRequest(
+                channel=channel,
+                participant=participant,
+                banned_rights=KICKED_RIGHTS
+            ))
+            results.append({"usuario": usuario, "canal": canal_id, "ok": True, "error": None})
+        except UserNotParticipantError:
+            # Ya no estaba en el canal: igual hay que cerrar la suscripción
+            results.append({"usuario": usuario, "canal": canal_id, "ok": True, "error": None})
+        except FloodWaitError as e:
+            await router.flood.record(account, 'EditBannedRequest', e.seconds)
+            results.append({"usuario": usuario, "canal": canal_id, "ok": False, "error": "flood_wait"})
+        except ChatAdminRequiredError:
+            logger.error(f"❌ PERMISOS: La cuenta '{account}' no es admin en {canal_id}.")
+            return results + [{"usuario": u, "canal": canal_id, "ok": False, "error": "admin_required"}
+                              for u in usuarios[len(results):]]
+        except Exception as e:
+            results.append({"usuario": usuario, "canal": canal_id, "ok": False, "error": str(e)})
+    return results
+
+async def record_rollups(results):
+    """Bajas por canal para los gráficos (ver common/rollups.py)."""
+    kicked = {}
+    for r in results:
+        if r["ok"]:
+            kicked.setdefault(r["canal"], []).append(r["usuario"])
+    for canal_id, usuarios in kicked.items():
+        try:
+            await rollups.record_leaves(canal_id, usuarios)
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar los rollups de {canal_id}: {e}")
+
+async def write_back(results):
+    """Cierra en la DB todas las suscripciones expulsadas con una sola llamada."""
+    done = [{"usuario": r["usuario"], "canal": r["canal"], "timestamp": datetime.now().isoformat()}
+            for r in results if r["ok"]]
+    if not done:
+        return
+    backend = get_backend()
+    res = await backend.post("/suscripciones/expulsiones", json=done, timeout=60)
+    if res.status_code not in (404, 405):
+        res.raise_for_status()
+        return
+
+    # Backend sin endpoint masivo: mismo par de llamadas que user_remover
+    for item in done:
+        res_db = await backend.delete("/suscripcion/delete", params={
+            "usuario_id": item["usuario"],
+            "canal_id": item["canal"]
+        })
+        if res_db.status_code == 200:
+            await backend.post("/evento/", json={
+                "tipo_evento": "LEAVE_CHANNEL",
+                "timestamp": item["timestamp"],
+                "usuario": item["usuario"],
+                "canal": item["canal"]
+            })
+
+async def sweep_once():
+    expired = await fetch_expired()
+    if not expired:
+        logger.info("Sin suscripciones vencidas.")
+        return
+
+    started = time.perf_counter()
+    results = []
+    expired.sort(key=lambda s: s["canal"])
+    # Cada canal va a su cuenta dueña; las cuentas expulsan en paralelo
+    by_account = {}
+    for canal_id, subs in groupby(expired, key=lambda s: s["canal"]):
+        usuarios = [s["usuario"] for s in subs]
+        try:
+            account = await router.route(canal_id, 'EditBannedRequest', channel_id=canal_id)
+        except NoSessionAvailable as e:
+            error = "flood_wait" if e.deferrable else "no_session"
+            results.extend({"usuario": u, "canal": canal_id, "ok": False, "error": error} for u in usuarios)
+            continue
+        by_account.setdefault(account, []).append((canal_id, usuarios))
+
+    async def sweep_account(account, channels):
+        out = []
+        async with get_pool().acquire(router.session_file(account)) as client:
+            for canal_id, usuarios in channels:
+                out.extend(await kick_channel(client, account, canal_id, usuarios))
+        return out
+
+    for chunk in await asyncio.gather(*(sweep_account(a, c) for a, c in by_account.items())):
+        results.extend(chunk)
+    await record_rollups(results)
+    await write_back(results)
+    try:
+        await record_failures(results)
+    except Exception as e:
+        logger.warning(f"No se pudo registrar las fallas del barrido: {e}")
+
+    elapsed = time.perf_counter() - started
+    kicked = sum(1 for r in results if r["ok"])
+    per_minute = round(kicked / elapsed * 60, 1) if elapsed else 0.0
+    await redis_client.hset(STATS_KEY, mapping={
+        "last_run": datetime.now().isoformat(),
+        "kicked": kicked,
+        "failed": len(results) - kicked,
+        "seconds": round(elapsed, 1),
+        "kicks_per_min": per_minute
+    })
+    logger.info(f"🧹 Barrido: {kicked} expulsados, {len(results) - kicked} fallidos en {elapsed:.1f}s "
+                f"({per_minute} expulsiones/min).")
+
+async def locked_sweep():
+    """Barre si consigue el lock; lo renueva cada SWEEP_LOCK_TTL/3 s hasta terminar."""
+    token = uuid.uuid4().hex
+    if not await redis_client.set(LOCK_KEY, token, nx=True, ex=SWEEP_LOCK_TTL):
+        return
+    sweep = asyncio.create_task(sweep_once())
+    try:
+        while not sweep.done():
+            done, _ = await asyncio.wait({sweep}, timeout=SWEEP_LOCK_TTL / 3)
+            if done:
+                break
+            try:
+                renewed = await renew_lock(keys=[LOCK_KEY], args=[token, SWEEP_LOCK_TTL])
+            except Exception as e:
+                # Error pasajero de Redis: se reintenta en la próxima vuelta, antes de que venza
+                logger.warning(f"⚠️ No se pudo renovar el lock del barrido: {e}")
+                continue
+            if not renewed:
+                logger.error("❌ Lock del barrido perdido (venció o lo tomó otra réplica): se corta el barrido.")
+                sweep.cancel()
+                await asyncio.gather(sweep, return_exceptions=True)
+                return
+        await sweep
+    finally:
+        if not sweep.done():
+            sweep.cancel()
+        await release_lock(keys=[LOCK_KEY], args=[token])
+
+async def main():
+    await router.start(get_pool(), monitor=not get_pool().shared)
+    if not router.multi:
+        await router.entity_cache(router.accounts[0]).warm_from_backend(get_backend())
+    lifecycle.mark_ready()
+    while not lifecycle.stopping().is_set():
+        # Un solo barrido a la vez aunque haya varias réplicas
+        try:
+            await locked_sweep()
+        except Exception as e:
+            logger.error(f"❌ Error en el barrido: {e}")
+        await lifecycle.wait_stop(SWEEP_INTERVAL)
+    await get_pool().close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
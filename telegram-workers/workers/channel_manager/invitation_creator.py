@@ -1,86 +1,145 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import asyncio
 import logging
-import json
-import redis
-from telethon import TelegramClient, functions, types
+from telethon import functions, types
 # Importamos específicamente los componentes de botones
 from telethon.tl.types import ReplyInlineMarkup, KeyboardButtonUrl, KeyboardButtonRow
 from dotenv import load_dotenv 
 
+# Permite importar el paquete compartido `common` desde workers/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.work_queue import WorkQueue
+from common.invite_pool import InvitePool
+from common.entity_cache import EntityCache
+from common.rpc_stats import CountingTelegramClient
+from common.session_router import configured_accounts
+from common.redis_pool import get_redis
+from common import lifecycle
+
 load_dotenv() 
 
 # Configuración
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SESSION_PATH = os.path.join(BASE_DIR, os.getenv("TG_SESSION", "tracker_session"))
+
+# Sesión propia junto a este archivo (no el SQLite que comparten los demás workers en la
+# raíz de la app). Se autoriza desde este directorio:
+#   cd telegram-workers/workers/channel_manager && python ../authenticate.py
+# Con réplicas, TG_SESSION_SUFFIX (p. ej. "_invite{replica}") da un archivo a cada una.
+SESSION_NAME = f"{os.getenv('TG_SESSION', 'tracker_session')}{os.getenv('TG_SESSION_SUFFIX', '')}"
+SESSION_PATH = SESSION_NAME if os.path.isabs(SESSION_NAME) else os.path.join(BASE_DIR, SESSION_NAME)
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 API_ID = int(os.getenv("TG_API_ID", "0"))
 API_HASH = os.getenv("TG_API_HASH", "")
 INVITATION_QUEUE = 'invitation_queue'
+CONSUMER_GROUP = 'invitation_creator'
+# Máximo de mensajes procesándose a la vez (envíos / links en vuelo)
+MAX_CONCURRENCY = int(os.getenv("INVITE_CONCURRENCY", "20"))
+# Links de un uso pre-generados por canal activo y su vigencia (segundos)
+INVITE_POOL_SIZE = int(os.getenv("INVITE_POOL_SIZE", "5"))
+INVITE_LINK_TTL = int(os.getenv("INVITE_LINK_TTL", "86400"))
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("InvitationCreator")
-redis_conn = redis.from_url(REDIS_URL, decode_responses=True)
+redis_conn = get_redis(REDIS_URL)
+entity_cache = EntityCache(redis_conn)
+invite_pool = InvitePool(redis_conn, entity_cache, target=INVITE_POOL_SIZE, link_ttl=INVITE_LINK_TTL)
+
+async def handle_message(client, data: dict):
+    """Procesa una acción de la cola: link de pago o invitación al canal."""
+    action = data.get("action")
+    user_id = data.get("user_id")
+
+    if action == "send_payment_link":
+        payment_url = data.get("payment_link")
+        
+        # Mensaje incluyendo el link en texto por si el botón falla
+        mensaje_pago = (
+            f"Hola! 👋 Estás a un paso de entrar al canal.\n\n"
+            f"Pulsa el botón de abajo o usa este enlace para pagar: \n{payment_url}\n\n"
+            f"Una vez confirmado, recibirás el acceso automáticamente. 🚀"
+        )
+
+        # Estructura correcta de botones para Telethon
+        await client.send_message(
+            user_id,
+            mensaje_pago,
+            buttons=[types.KeyboardButtonUrl(text="💳 PAGAR AHORA", url=payment_url)]
+        )
+        logger.info(f"✅ Mensaje y botón enviados a {user_id}")
+
+    elif action == "create_invite":
+        canal_id = data.get("channel_alias")
+        is_paid = data.get("is_paid", True) 
+        
+        try:
+            # Hot path: link pre-generado del pool; solo si está vacío se crea en el momento
+            link = await invite_pool.pop(canal_id)
+            if link is None:
+                entity = await entity_cache.input_channel(client, canal_id)
+                invite = await client(functions.messages.ExportChatInviteRequest(
+                    peer=entity, usage_limit=1, title='Acceso VIP'
+                ))
+                link = invite.link
+            
+            header = "🎁 **¡Invitación gratuita!**" if not is_paid else "✅ **¡Pago verificado!**"
+            await client.send_message(
+                user_id, 
+                f"{header}\n\nAcceso único:\n{link}",
+                buttons=[types.KeyboardButtonUrl(text="🚀 ENTRAR AL CANAL", url=link)]
+            )
+        except Exception as e:
+            logger.error(f"❌ Error en invitación: {e}")
+            # Se relanza para que la cola reintente (y termine en dead-letter si persiste)
+            raise
+
+def invitation_queue(conn=None) -> WorkQueue:
+    return WorkQueue(conn or redis_conn, INVITATION_QUEUE, CONSUMER_GROUP, batch_size=MAX_CONCURRENCY)
+
+def host_session() -> str:
+    """Sesión compartida en worker_host.py (la misma que resuelven los demás roles)."""
+    return f"{configured_accounts()[0]}{os.getenv('TG_SESSION_SUFFIX', '')}"
+
+async def handle_pooled(pool, data: dict):
+    """Modo host: el cliente se pide al pool en cada mensaje (si el monitor descartó una
+    conexión caída, se usa la nueva en lugar de fallar hasta el dead-letter)."""
+    async with pool.acquire(host_session()) as client:
+        await handle_message(client, data)
 
-async def main():
-    client = TelegramClient(SESSION_PATH, API_ID, API_HASH)
-    await client.start()
-    logger.info("🚀 Worker encendido. Enviando botones y links de respaldo.")
+async def consume(client, conn=None, concurrency: int = MAX_CONCURRENCY, pool=None):
+    """Espera mensajes del stream (sin polling) y los procesa en paralelo hasta `concurrency`."""
+    queue = invitation_queue(conn)
+    if pool is not None:
+        handler = lambda data: handle_pooled(pool, data)
+    else:
+        handler = lambda data: handle_message(client, data)
+    await queue.run(handler, concurrency=concurrency)
 
-    pubsub = redis_conn.pubsub()
-    pubsub.subscribe(INVITATION_QUEUE)
+async def main(pool=None):
+    """Con `pool` (worker_host.py) usa el cliente compartido de la sesión del host."""
+    if pool is not None:
+        # Falla rápido si la sesión no está autorizada; después se pide en cada uso
+        await pool.get_client(host_session())
+        client = None
+        refill = asyncio.create_task(invite_pool.run(get_client=lambda: pool.get_client(host_session())))
+    else:
+        client = CountingTelegramClient(SESSION_PATH, API_ID, API_HASH)
+        await client.start()
+        refill = asyncio.create_task(invite_pool.run(client))
+    logger.info(f"🚀 Worker encendido. Enviando botones y links de respaldo (concurrencia={MAX_CONCURRENCY}).")
+    lifecycle.mark_ready()
 
-    while True:
+    while not lifecycle.stopping().is_set():
         try:
-            message = pubsub.get_message(ignore_subscribe_messages=True)
-            if message:
-                data = json.loads(message['data'])
-                action = data.get("action")
-                user_id = data.get("user_id")
-
-                if action == "send_payment_link":
-                    payment_url = data.get("payment_link")
-                    
-                    # Mensaje incluyendo el link en texto por si el botón falla
-                    mensaje_pago = (
-                        f"Hola! 👋 Estás a un paso de entrar al canal.\n\n"
-                        f"Pulsa el botón de abajo o usa este enlace para pagar: \n{payment_url}\n\n"
-                        f"Una vez confirmado, recibirás el acceso automáticamente. 🚀"
-                    )
-
-                    # Estructura correcta de botones para Telethon
-                    await client.send_message(
-                        user_id,
-                        mensaje_pago,
-                        buttons=[types.KeyboardButtonUrl(text="💳 PAGAR AHORA", url=payment_url)]
-                    )
-                    logger.info(f"✅ Mensaje y botón enviados a {user_id}")
-
-                elif action == "create_invite":
-                    canal_id = data.get("channel_alias")
-                    is_paid = data.get("is_paid", True) 
-                    
-                    try:
-                        full_id = int(f"-100{canal_id}")
-                        entity = await client.get_entity(full_id)
-                        invite = await client(functions.messages.ExportChatInviteRequest(
-                            peer=entity, usage_limit=1, title='Acceso VIP'
-                        ))
-                        
-                        header = "🎁 **¡Invitación gratuita!**" if not is_paid else "✅ **¡Pago verificado!**"
-                        await client.send_message(
-                            user_id, 
-                            f"{header}\n\nAcceso único:\n{invite.link}",
-                            buttons=[types.KeyboardButtonUrl(text="🚀 ENTRAR AL CANAL", url=invite.link)]
-                        )
-                    except Exception as e:
-                        logger.error(f"❌ Error en invitación: {e}")
-
-            await asyncio.sleep(0.1)
+            await consume(client, pool=pool)
         except Exception as e:
             logger.error(f"❌ Error crítico: {e}")
-            await asyncio.sleep(5)
+            await lifecycle.wait_stop(5)
+    refill.cancel()
+    await asyncio.gather(refill, return_exceptions=True)
+    if pool is None:
+        await client.disconnect()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
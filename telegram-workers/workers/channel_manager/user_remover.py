@@ -1,23 +1,31 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import asyncio
 import logging
-import json
-import redis
-import requests # Necesario para avisar al Backend
 from datetime import timedelta, datetime
 from dotenv import load_dotenv
-from telethon import TelegramClient, functions
+from telethon import functions
 from telethon.tl import types
 from telethon.errors import ChatAdminRequiredError
-from telethon.network import ConnectionTcpAbridged
+
+# Permite importar el paquete compartido `common` desde workers/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.client_pool import get_pool
+from common.work_queue import WorkQueue
+from common.backend_client import get_backend
+from common.entity_cache import bare_channel_id
+from common.flood_scheduler import FloodScheduler
+from common.session_router import SessionRouter, NoSessionAvailable
+from common.rollups import Rollups
+from common.redis_pool import get_redis
+from common import lifecycle
 
 load_dotenv()
 
 # --- Configuración ---
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 SESSION_ADMIN = os.getenv("TG_SESSION", "plataforma_session")
-API_BACKEND_URL = os.getenv("API_BACKEND_URL", "http://localhost:8000")
 
 try:
     API_ID = int(os.getenv("TG_API_ID", "0"))
@@ -27,85 +35,123 @@ except (ValueError, TypeError):
     API_HASH = ""
 
 REMOVAL_QUEUE = 'user_removal_queue'
+CONSUMER_GROUP = 'user_remover'
+MAX_CONCURRENCY = int(os.getenv("REMOVAL_CONCURRENCY", "5"))
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("UserRemover")
 
-redis_client = redis.StrictRedis.from_url(REDIS_URL, decode_responses=True)
+redis_client = get_redis(REDIS_URL)
+# Cuentas admin (TG_SESSIONS o solo TG_SESSION) y su caché de entidades
+router = SessionRouter(redis_client)
+# Expulsiones frenadas por FloodWait: vuelven a la cola cuando se abre la ventana
+scheduler = FloodScheduler(redis_client, REMOVAL_QUEUE)
+# Bajas del día/hora para los gráficos (el tracker no la vuelve a contar)
+rollups = Rollups(redis_client)
 
 async def remove_user_from_channel(channel_id: int, user_id: int):
     """Expulsa de Telegram y luego borra de la DB."""
+
+    async def kick(account, client):
+        cid_str = str(channel_id)
+        if not cid_str.startswith('-100') and not cid_str.startswith('-'):
+            entity_id = int(f"-100{cid_str}")
+        else:
+            entity_id = int(cid_str)
+
+        logger.info(f"Procesando remoción en Telegram: {entity_id} (cuenta '{account}')")
+
+        # Caché compartida de access_hash (por cuenta): sin get_entity/get_dialogs en el hot path
+        cache = router.entity_cache(account)
+        channel = await cache.input_channel(client, entity_id)
+        user_to_remove = await cache.input_user(client, user_id)
+
+        kicked_rights = types.ChatBannedRights(
+            until_date=timedelta(minutes=1),
+            view_messages=True
+        )
+
+        # 1. EXPULSIÓN EN TELEGRAM
+        await client(functions.channels.EditBannedRequest(
+            channel=channel,
+            participant=user_to_remove,
+            banned_rights=kicked_rights
+        ))
+
     try:
-        async with TelegramClient(SESSION_ADMIN, API_ID, API_HASH, timeout=15, connection=ConnectionTcpAbridged) as client:
-            cid_str = str(channel_id)
-            if not cid_str.startswith('-100') and not cid_str.startswith('-'):
-                entity_id = int(f"-100{cid_str}")
+        # Cuenta dueña del canal por hashing; failover si está en FloodWait o baneada
+        await router.call(get_pool(), bare_channel_id(channel_id), 'EditBannedRequest', kick,
+                          channel_id=channel_id)
+        logger.info(f"✅ Telegram: Usuario {user_id} expulsado.")
+        try:
+            await rollups.record_leaves(channel_id, [user_id])
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar los rollups: {e}")
+
+        # 2. BORRADO EN BASE DE DATOS
+        # Llamamos al endpoint delete_suscripcion definido en routes.py
+        try:
+            backend = get_backend()
+            res_db = await backend.delete("/suscripcion/delete", params={
+                "usuario_id": user_id,
+                "canal_id": channel_id
+            })
+            if res_db.status_code == 200:
+                logger.info(f"✅ Base de Datos: Suscripción eliminada.")
+                
+                # 3. REGISTRAR EVENTO DE SALIDA PARA EL GRÁFICO
+                await backend.post("/evento/", json={
+                    "tipo_evento": "LEAVE_CHANNEL",
+                    "timestamp": datetime.now().isoformat(),
+                    "usuario": user_id,
+                    "canal": channel_id
+                })
             else:
-                entity_id = int(cid_str)
-            
-            logger.info(f"Procesando remoción en Telegram: {entity_id}")
-
-            try:
-                channel = await client.get_entity(entity_id)
-            except Exception:
-                await client.get_dialogs()
-                channel = await client.get_entity(entity_id)
-
-            user_to_remove = await client.get_input_entity(int(user_id))
-            
-            kicked_rights = types.ChatBannedRights(
-                until_date=timedelta(minutes=1),
-                view_messages=True
-            )
-
-            # 1. EXPULSIÓN EN TELEGRAM
-            await client(functions.channels.EditBannedRequest(
-                channel=channel,
-                participant=user_to_remove,
-                banned_rights=kicked_rights
-            ))
-            logger.info(f"✅ Telegram: Usuario {user_id} expulsado.")
-
-            # 2. BORRADO EN BASE DE DATOS
-            # Llamamos al endpoint delete_suscripcion definido en routes.py
-            try:
-                res_db = requests.delete(f"{API_BACKEND_URL}/suscripcion/delete?usuario_id={user_id}&canal_id={channel_id}")
-                if res_db.status_code == 200:
-                    logger.info(f"✅ Base de Datos: Suscripción eliminada.")
-                    
-                    # 3. REGISTRAR EVENTO DE SALIDA PARA EL GRÁFICO
-                    requests.post(f"{API_BACKEND_URL}/evento/", json={
-                        "tipo_evento": "LEAVE_CHANNEL",
-                        "timestamp": datetime.now().isoformat(),
-                        "usuario": user_id,
-                        "canal": channel_id
-                    })
-                else:
-                    logger.error(f"❌ Error DB: {res_db.text}")
-            except Exception as e:
-                logger.error(f"❌ Error de conexión al Backend: {e}")
+                logger.error(f"❌ Error DB: {res_db.text}")
+        except Exception as e:
+            logger.error(f"❌ Error de conexión al Backend: {e}")
 
+    except NoSessionAvailable as e:
+        if not e.deferrable:
+            # Ninguna cuenta utilizable: falla (la cola reintenta y termina en dead-letter)
+            logger.error(f"❌ Sin cuentas disponibles para expulsar en {channel_id}.")
+            raise
+        # Todas las cuentas en FloodWait: se difiere (persistente) hasta que se libere la primera
+        await scheduler.defer(
+            {'action': 'remove_user', 'channel_id': channel_id, 'user_id': user_id},
+            e.until + 5
+        )
     except ChatAdminRequiredError:
-        logger.error(f"❌ PERMISOS: La sesión no es admin en {channel_id}.")
+        # Error permanente: reintentar no sirve, se descarta el mensaje
+        logger.error(f"❌ PERMISOS: Ninguna cuenta es admin en {channel_id}.")
     except Exception as e:
         logger.error(f"❌ ERROR: {e}")
+        # Se relanza para que la cola reintente (y termine en dead-letter si persiste)
+        raise
 
-def listen_for_removals(loop):
-    pubsub = redis_client.pubsub()
-    pubsub.subscribe(REMOVAL_QUEUE)
-    logger.info(f"Worker iniciado. Escuchando cola '{REMOVAL_QUEUE}'...")
-    for message in pubsub.listen():
-        if message['type'] == 'message':
-            try:
-                data = json.loads(message['data'])
-                if data.get('action') == 'remove_user':
-                    asyncio.run_coroutine_threadsafe(remove_user_from_channel(data['channel_id'], data['user_id']), loop)
-            except Exception as e:
-                logger.error(f"❌ Error Redis: {e}")
+async def handle_task(data: dict):
+    if data.get('action') == 'remove_user':
+        await remove_user_from_channel(data['channel_id'], data['user_id'])
 
 async def main():
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, listen_for_removals, loop)
+    # Conecta las cuentas una sola vez y vigila su salud en segundo plano
+    await router.start(get_pool(), monitor=not get_pool().shared)
+    background = []
+    if not get_pool().shared:
+        background.append(asyncio.create_task(get_backend().monitor()))
+    try:
+        # El backend guarda el access_hash de la cuenta que creó cada canal: solo sirve con una cuenta
+        if not router.multi:
+            await router.entity_cache(router.accounts[0]).warm_from_backend(get_backend())
+        background.append(asyncio.create_task(scheduler.run()))
+        queue = WorkQueue(redis_client, REMOVAL_QUEUE, CONSUMER_GROUP)
+        lifecycle.mark_ready()
+        await queue.run(handle_task, concurrency=MAX_CONCURRENCY)
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+    await get_pool().close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
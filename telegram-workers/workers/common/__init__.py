@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Utilidades compartidas por los workers de Telegram (no es un worker)."""
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente HTTP asíncrono compartido para las llamadas worker -> backend FastAPI.
+
+- Un único httpx.AsyncClient por proceso (keep-alive + pool de conexiones)
+- Timeouts en todas las llamadas
+- Reintentos con backoff exponencial y jitter: errores de conexión siempre;
+  timeouts de lectura y 5xx solo en métodos idempotentes (o idempotent=True)
+- Envío por lotes para endpoints que aceptan listas (`post_batched`)
+- Histograma de latencia por endpoint (`histograms()` y `backend_request_seconds`)
+"""
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+from bisect import bisect_left
+
+import httpx
+
+from . import metrics
+
+logger = logging.getLogger("BackendClient")
+
+# Límites superiores (ms) de los buckets del histograma de latencia
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+RETRY_STATUS = {502, 503, 504}
+_ID_SEGMENT = re.compile(r"/-?\d+(?=/|$)")
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.errors = 0
+
+    def observe(self, ms: float, error: bool = False):
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total_ms += ms
+        if error:
+            self.errors += 1
+
+    def as_dict(self) -> dict:
+        labels = [f"le_{b}" for b in LATENCY_BUCKETS_MS] + ["le_inf"]
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / count, 2) if count else 0.0,
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+class BackendClient:
+
+    def __init__(
+            self,
+            base_url: str = None,
+            timeout: float = 10.0,
+            retries: int = 3,
+            backoff: float = 0.5,
+            max_connections: int = 20
+        ):
+        self.base_url = base_url or os.getenv("API_BACKEND_URL", "http://localhost:8000")
+        self.retries = retries
+        self.backoff = backoff
+        self._timeout = httpx.Timeout(timeout, connect=5.0)
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client = None
+        self._histograms = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self._timeout, limits=self._limits)
+        return self._client
+
+    @staticmethod
+    def endpoint_label(method: str, path: str) -> str:
+        """'GET /canal/miembros/123' -> 'GET /canal/miembros/{id}' (evita cardinalidad infinita)."""
+        return f"{method} {_ID_SEGMENT.sub('/{id}', path)}"
+
+    def _observe(self, label: str, started: float, error: bool):
+        elapsed = time.perf_counter() - started
+        histogram = self._histograms.setdefault(label, LatencyHistogram())
+        histogram.observe(elapsed * 1000, error)
+        metrics.labeled(metrics.BACKEND_SECONDS, label, "error" if error else "ok").observe(elapsed)
+
+    def _delay(self, attempt: int) -> float:
+        # Full jitter: uniforme entre 0 y backoff * 2^intento
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    async def request(self, method: str, path: str, idempotent: bool = None, **kwargs) -> httpx.Response:
+        method = method.upper()
+        label = self.endpoint_label(method, path)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # La petición no llegó al backend: siempre es seguro reintentar
+                self._observe(label, started, error=True)
+                error = e
+            except httpx.TransportError as e:
+                self._observe(label, started, error=True)
+                if not idempotent:
+                    raise
+                error = e
+            else:
+                failed = response.status_code >= 500
+                self._observe(label, started, error=failed)
+                if not (failed and idempotent and response.status_code in RETRY_STATUS):
+                    return response
+                error = httpx.HTTPStatusError(
+                    f"{response.status_code} en {label}", request=response.request, response=response
+                )
+
+            if attempt == self.retries:
+                if isinstance(error, httpx.HTTPStatusError):
+                    return error.response
+                raise error
+            delay = self._delay(attempt)
+            logger.warning(f"⚠️ {label} falló ({error}); reintento {attempt + 1}/{self.retries} en {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def delete(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", path, **kwargs)
+
+    async def post_batched(self, path: str, items, batch_size: int = 500, **kwargs) -> list:
+        """POST de una lista partida en lotes de `batch_size`. Devuelve las respuestas de cada lote."""
+        items = list(items)
+        responses = []
+        for i in range(0, len(items), batch_size):
+            responses.append(await self.post(path, json=items[i:i + batch_size], **kwargs))
+        return responses
+
+    def histograms(self) -> dict:
+        return {label: h.as_dict() for label, h in sorted(self._histograms.items())}
+
+    async def monitor(self, interval: int = 300):
+        """Registra periódicamente los histogramas de latencia por endpoint."""
+        while True:
+            await asyncio.sleep(interval)
+            for label, data in self.histograms().items():
+                logger.info(f"📈 {label}: n={data['count']} err={data['errors']} avg={data['avg_ms']}ms {data['buckets']}")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+_backend = None
+
+
+def get_backend() -> BackendClient:
+    """Cliente global del proceso (una sola pool de conexiones al backend)."""
+    global _backend
+    if _backend is None:
+        _backend = BackendClient()
+    return _backend
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de clientes Telethon de larga vida.
+
+Mantiene UN cliente conectado por archivo de sesión y lo presta con un
+context manager asíncrono, evitando el connect + auth MTProto por mensaje
+(y los 'database is locked' de SQLite al abrir la misma sesión en paralelo).
+
+Uso:
+    from common.client_pool import get_pool
+
+    async with get_pool().acquire() as client:
+        await client(...)
+"""
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from telethon import TelegramClient, functions
+from telethon.network import ConnectionTcpAbridged
+
+from .rpc_stats import CountingTelegramClient
+
+logger = logging.getLogger("ClientPool")
+
+DEFAULT_SESSION = os.getenv("TG_SESSION", "plataforma_session")
+
+
+class ClientPool:
+    """Un TelegramClient conectado por sesión, compartido por todas las tareas."""
+
+    def __init__(self, api_id: int, api_hash: str, timeout: int = 15):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.timeout = timeout
+        self._clients = {}
+        self._locks = {}
+        self._governor_factory = None
+        self._shared = False
+
+    def share(self, governor_factory=None):
+        """Modo host (worker_host.py): varios roles usan el pool a la vez.
+
+        `close()` de un rol no desconecta a los demás (solo `close(force=True)`
+        del host) y, con `governor_factory`, cada cliente nuevo lleva un
+        governor: el presupuesto de RPC de la cuenta es uno para todos los roles.
+        """
+        self._shared = True
+        self._governor_factory = governor_factory
+
+    @property
+    def shared(self) -> bool:
+        """En modo host los monitores de salud los arranca el host, una vez, no cada rol."""
+        return self._shared
+
+    def _lock_for(self, session: str) -> asyncio.Lock:
+        if session not in self._locks:
+            self._locks[session] = asyncio.Lock()
+        return self._locks[session]
+
+    async def get_client(self, session: str = DEFAULT_SESSION) -> TelegramClient:
+        """Devuelve el cliente de la sesión, (re)conectándolo si hace falta."""
+        client = self._clients.get(session)
+        if client is not None and client.is_connected():
+            return client
+
+        async with self._lock_for(session):
+            client = self._clients.get(session)
+            if client is None:
+                # Instrumentado: latencia y FloodWaits por método en las métricas
+                client = CountingTelegramClient(
+                    session,
+                    self.api_id,
+                    self.api_hash,
+                    timeout=self.timeout,
+                    connection=ConnectionTcpAbridged,
+                    governor=self._governor_factory() if self._governor_factory else None
+                )
+                self._clients[session] = client
+
+            if not client.is_connected():
+                logger.info(f"🔌 Conectando sesión '{session}'...")
+                await client.connect()
+                if not await client.is_user_authorized():
+                    raise RuntimeError(f"La sesión '{session}' no está autorizada. Ejecuta authenticate.py")
+                logger.info(f"✅ Sesión '{session}' conectada.")
+            return client
+
+    @asynccontextmanager
+    async def acquire(self, session: str = DEFAULT_SESSION):
+        """Presta el cliente de la sesión. No se desconecta al salir."""
+        client = await self.get_client(session)
+        try:
+            yield client
+        except ConnectionError:
+            # La conexión se cayó en medio de la operación: se reconecta en el próximo acquire.
+            logger.warning(f"⚠️ Conexión perdida en '{session}'. Se reconectará.")
+            await self._drop(session)
+            raise
+
+    async def _drop(self, session: str):
+        client = self._clients.pop(session, None)
+        if client is not None:
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+
+    async def health(self, session: str = DEFAULT_SESSION) -> dict:
+        """Sonda de salud: hace un RPC liviano y mide la latencia en ms."""
+        started = time.perf_counter()
+        try:
+            async with self.acquire(session) as client:
+                await client(functions.help.GetNearestDcRequest())
+            return {
+                "session": session,
+                "ok": True,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 2)
+            }
+        except Exception as e:
+            return {"session": session, "ok": False, "error": str(e)}
+
+    async def monitor(self, session: str = DEFAULT_SESSION, interval: int = 60):
+        """Registra la salud de la sesión periódicamente y fuerza reconexión si falla."""
+        while True:
+            status = await self.health(session)
+            if status["ok"]:
+                logger.info(f"💓 Sesión '{session}' OK ({status['latency_ms']} ms)")
+            else:
+                logger.warning(f"⚠️ Sesión '{session}' sin respuesta: {status['error']}")
+                await self._drop(session)
+            await asyncio.sleep(interval)
+
+    async def close(self, force: bool = False):
+        if self._shared and not force:
+            return
+        for session in list(self._clients):
+            await self._drop(session)
+
+
+_pool = None
+
+
+def get_pool() -> ClientPool:
+    """Pool global del proceso (se crea con TG_API_ID / TG_API_HASH)."""
+    global _pool
+    if _pool is None:
+        _pool = ClientPool(int(os.getenv("TG_API_ID", "0")), os.getenv("TG_API_HASH", ""))
+    return _pool
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de entidades de Telegram compartida por todos los workers (Redis).
+
+Guarda (channel_id -> access_hash) y (user_id -> access_hash) para armar
+InputPeerChannel / InputPeerUser sin `get_entity` ni, sobre todo, sin
+`get_dialogs()` (que baja la lista completa de diálogos en cada fallo).
+
+El access_hash es propio de cada cuenta de Telegram, por eso las claves
+llevan un `scope` (TG_ACCOUNT; por defecto "default" = la cuenta admin):
+
+  tg:entity:<scope>:channel   hash id -> access_hash
+  tg:entity:<scope>:user      hash id -> access_hash
+
+Se llena al crear canales (group_manager), con las entidades que ya
+recorren los workers y desde el backend, que guarda el access_hash que
+envía `notify_backend_success` (`warm_from_backend`).
+"""
+import os
+import logging
+
+from telethon import types
+
+logger = logging.getLogger("EntityCache")
+
+
+def bare_channel_id(channel_id) -> int:
+    """-1001234 / '1234' / 1234 -> 1234."""
+    cid = str(channel_id)
+    if cid.startswith('-100'):
+        cid = cid[4:]
+    return abs(int(cid))
+
+
+class EntityCache:
+
+    def __init__(self, redis_conn, scope: str = None):
+        self.redis = redis_conn
+        scope = scope or os.getenv("TG_ACCOUNT", "default")
+        self.channels_key = f"tg:entity:{scope}:channel"
+        self.users_key = f"tg:entity:{scope}:user"
+        self.stats = {"hits": 0, "misses": 0}
+
+    async def remember_channel(self, channel_id, access_hash):
+        if access_hash is not None:
+            await self.redis.hset(self.channels_key, str(bare_channel_id(channel_id)), str(access_hash))
+
+    async def remember_user(self, user_id, access_hash):
+        if access_hash is not None:
+            await self.redis.hset(self.users_key, str(int(user_id)), str(access_hash))
+
+    async def remember(self, *entities):
+        """Guarda el access_hash de objetos Channel/User ya obtenidos por otra vía."""
+        for entity in entities:
+            if isinstance(entity, types.Channel):
+                await self.remember_channel(entity.id, entity.access_hash)
+            elif isinstance(entity, types.User) and not entity.min:
+                await self.remember_user(entity.id, entity.access_hash)
+
+    async def input_channel(self, client, channel_id):
+        cid = bare_channel_id(channel_id)
+        access_hash = await self.redis.hget(self.channels_key, str(cid))
+        if access_hash is not None:
+            self.stats["hits"] += 1
+            return types.InputPeerChannel(cid, int(access_hash))
+
+        # Fallo de caché: Telethon lo resuelve desde su sesión o con UNA RPC, nunca con get_dialogs
+        self.stats["misses"] += 1
+        peer = await client.get_input_entity(int(f"-100{cid}"))
+        await self.remember_channel(cid, getattr(peer, 'access_hash', None))
+        return peer
+
+    async def input_user(self, client, user_id):
+        uid = int(user_id)
+        access_hash = await self.redis.hget(self.users_key, str(uid))
+        if access_hash is not None:
+            self.stats["hits"] += 1
+            return types.InputPeerUser(uid, int(access_hash))
+
+        self.stats["misses"] += 1
+        peer = await client.get_input_entity(uid)
+        await self.remember_user(uid, getattr(peer, 'access_hash', None))
+        return peer
+
+    async def warm_from_backend(self, backend, endpoint: str = None) -> int:
+        """Carga los access_hash de canales guardados en el backend. Devuelve cuántos cargó."""
+        endpoint = endpoint or os.getenv("ENTITY_WARM_ENDPOINT", "/canal/")
+        try:
+            res = await backend.get(endpoint)
+            res.raise_for_status()
+            channels = res.json()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo precargar la caché de entidades desde {endpoint}: {e}")
+            return 0
+
+        mapping = {
+            str(bare_channel_id(c["id"])): str(c["access_hash"])
+            for c in channels if c.get("id") is not None and c.get("access_hash")
+        }
+        if mapping:
+            await self.redis.hset(self.channels_key, mapping=mapping)
+        logger.info(f"🗂️ Caché de entidades precargada con {len(mapping)} canales.")
+        return len(mapping)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Descarga en streaming del CSV de miembros por owner, servida por el
+metrics_tracker desde sus parciales (ver report_export.py).
+
+  GET /cliente/<owner_id>/miembros.csv[?canal_id=<id>]
+
+- Transfer-Encoding: chunked, bloques de 64 KB: la respuesta nunca se arma
+  entera en memoria, sin importar cuántos canales tenga el owner.
+- gzip al vuelo si el cliente manda `Accept-Encoding: gzip`.
+- ETag / Last-Modified según la versión de los parciales. Con
+  If-None-Match o If-Modified-Since vigentes responde 304 sin cuerpo.
+
+Servidor HTTP de la librería estándar en un hilo aparte (igual que el de
+/metrics), en EXPORT_HOST:EXPORT_PORT. Sin EXPORT_PORT no se abre.
+"""
+import os
+import re
+import logging
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from . import report_export
+
+logger = logging.getLogger("ExportServer")
+
+OWNER_PATH = re.compile(r"/cliente/(\d+)/miembros\.csv")
+
+
+def not_modified(headers, etag: str, last_modified: float) -> bool:
+    """If-None-Match tiene prioridad sobre If-Modified-Since (RFC 9110)."""
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    directory = "reportes"
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def _empty(self, status: int, headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        match = OWNER_PATH.fullmatch(url.path)
+        if not match:
+            return self._empty(404)
+        owner_id = int(match.group(1))
+        channels = report_export.owner_channels(self.directory, owner_id)
+        if channels is None:
+            return self._empty(404)
+        canal = parse_qs(url.query).get("canal_id")
+        if canal:
+            channels = [c for c in channels if str(c) == canal[0]]
+            if not channels:
+                return self._empty(404)
+
+        files, etag, last_modified = report_export.open_parts(self.directory, channels)
+        validators = {
+            "ETag": etag,
+            "Last-Modified": formatdate(last_modified, usegmt=True),
+            "Cache-Control": "private, no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if not_modified(self.headers, etag, last_modified):
+            for f in files:
+                f.close()
+            return self._empty(304, validators)
+
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        chunks = report_export.iter_parts(files)
+        body = report_export.gzip_chunks(chunks) if use_gzip else chunks
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=utf-8")
+        self.send_header("Content-Disposition", f'attachment; filename="miembros_{owner_id}.csv"')
+        self.send_header("Transfer-Encoding", "chunked")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in validators.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for chunk in body:
+                if chunk:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cortó la descarga
+            self.close_connection = True
+        finally:
+            chunks.close()
+
+
+_server = None
+
+
+def start(directory: str, port: int = None, host: str = None):
+    """Sirve las descargas en un hilo daemon (una vez por proceso). Devuelve el puerto o None."""
+    global _server
+    if _server is not None:
+        return _server.server_address[1]
+    port = port or int(os.getenv("EXPORT_PORT", "0"))
+    if not port:
+        return None
+    host = host or os.getenv("EXPORT_HOST", "127.0.0.1")
+    handler = type("Handler", (ExportHandler,), {"directory": directory})
+    _server = ThreadingHTTPServer((host, port), handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="export-server", daemon=True).start()
+    logger.info(f"📦 Exportaciones en http://{host}:{port}/cliente/<owner>/miembros.csv")
+    return port
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Planificador de operaciones de Telegram diferidas por FloodWait.
+
+En vez de `asyncio.sleep(e.seconds)` dentro de la tarea (horas de tareas
+dormidas en memoria que se pierden al reiniciar):
+
+- `FloodState` guarda en Redis hasta cuándo está bloqueado cada par
+  (sesión, método): `flood:<sesión>:<método>` con expiración.
+- `FloodScheduler.defer()` guarda la tarea en un sorted set persistente
+  (`delayed:<cola>`, score = not-before). `run()` la devuelve a su stream
+  de trabajo (ver work_queue.py) cuando se abre la ventana. El paso zset ->
+  stream es un script Lua atómico, así varios procesos pueden despachar a la
+  vez sin duplicar ni perder tareas.
+- Métricas en `scheduler:stats:<cola>`: profundidad, espera acumulada y
+  máxima, y tareas despachadas.
+"""
+import json
+import time
+import uuid
+import asyncio
+import logging
+
+from .work_queue import DATA_FIELD, STREAM_MAXLEN
+from . import metrics
+
+logger = logging.getLogger("FloodScheduler")
+
+# KEYS: zset, stream. ARGV: miembro, payload JSON, maxlen, campo de datos
+DISPATCH_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+    return redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', ARGV[4], ARGV[2])
+end
+return false
+"""
+
+
+def flood_method(error) -> str:
+    """Nombre del request que provocó el FloodWaitError (Telethon lo adjunta en `.request`)."""
+    request = getattr(error, 'request', None)
+    return type(request).__name__ if request is not None else 'unknown'
+
+
+class FloodState:
+    """Ventanas de FloodWait por (sesión, método), compartidas entre procesos."""
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+
+    @staticmethod
+    def _key(session: str, method: str) -> str:
+        return f"flood:{session}:{method}"
+
+    async def record(self, session: str, method: str, seconds: int):
+        until = time.time() + seconds
+        await self.redis.set(self._key(session, method), until, ex=max(1, int(seconds) + 1))
+        logger.warning(f"⏳ FloodWait {session}/{method}: bloqueado {seconds}s")
+
+    async def blocked_until(self, session: str, method: str) -> float:
+        """Timestamp hasta el que el método está bloqueado (0 si está libre)."""
+        value = await self.redis.get(self._key(session, method))
+        until = float(value) if value else 0.0
+        return until if until > time.time() else 0.0
+
+    async def blocked_any(self, session: str, methods) -> float:
+        """El mayor bloqueo vigente entre varios métodos (0 si todos están libres)."""
+        return max([await self.blocked_until(session, m) for m in methods] or [0.0])
+
+
+class FloodScheduler:
+
+    def __init__(self, redis_conn, stream: str, maxlen: int = STREAM_MAXLEN):
+        self.redis = redis_conn
+        self.stream = stream
+        self.zset = f"delayed:{stream}"
+        self.stats_key = f"scheduler:stats:{stream}"
+        self.maxlen = maxlen
+        self.flood = FloodState(redis_conn)
+
+    async def defer(self, payload: dict, not_before: float, session: str = None, method: str = None):
+        """Guarda `payload` para re-encolarlo en el stream a partir de `not_before`."""
+        entry = {
+            "id": uuid.uuid4().hex,
+            "payload": payload,
+            "session": session,
+            "method": method,
+            "deferred_at": time.time()
+        }
+        await self.redis.zadd(self.zset, {json.dumps(entry): not_before})
+        logger.info(f"🗓️ Tarea diferida en '{self.stream}' hasta {time.strftime('%H:%M:%S', time.localtime(not_before))}")
+
+    async def defer_flood(self, payload: dict, session: str, method: str, seconds: int):
+        """Registra el FloodWait y difiere la tarea hasta que pase (+5 s de margen)."""
+        await self.flood.record(session, method, seconds)
+        await self.defer(payload, time.time() + seconds + 5, session, method)
+
+    async def dispatch_due(self, limit: int = 100) -> int:
+        now = time.time()
+        due = await self.redis.zrangebyscore(self.zset, '-inf', now, start=0, num=limit)
+        dispatched = 0
+        for member in due:
+            entry = json.loads(member)
+            if entry.get("session") and entry.get("method"):
+                until = await self.flood.blocked_until(entry["session"], entry["method"])
+                if until:
+                    # La ventana se extendió (otro FloodWait): se re-programa
+                    await self.redis.zadd(self.zset, {member: until + 1})
+                    continue
+            stored = await self.redis.eval(
+                DISPATCH_SCRIPT, 2, self.zset, self.stream,
+                member, json.dumps(entry["payload"]), self.maxlen, DATA_FIELD
+            )
+            if stored:
+                dispatched += 1
+                waited = now - entry["deferred_at"]
+                await self.redis.hincrby(self.stats_key, "dispatched", 1)
+                await self.redis.hincrbyfloat(self.stats_key, "wait_seconds_total", waited)
+                max_wait = float(await self.redis.hget(self.stats_key, "wait_seconds_max") or 0)
+                if waited > max_wait:
+                    await self.redis.hset(self.stats_key, "wait_seconds_max", round(waited, 1))
+        return dispatched
+
+    async def metrics(self) -> dict:
+        depth = await self.redis.zcard(self.zset)
+        oldest = await self.redis.zrange(self.zset, 0, 0, withscores=True)
+        stats = await self.redis.hgetall(self.stats_key)
+        return {
+            "depth": depth,
+            "next_due_in": round(oldest[0][1] - time.time(), 1) if oldest else None,
+            **stats
+        }
+
+    async def run(self, interval: float = 1.0, report_every: int = 300):
+        """Despacha las tareas vencidas cada `interval` s y reporta métricas periódicamente."""
+        last_report = 0.0
+        depth_gauge = metrics.labeled(metrics.DELAYED_DEPTH, self.stream)
+        while True:
+            try:
+                await self.dispatch_due()
+                depth_gauge.set(await self.redis.zcard(self.zset))
+                if time.time() - last_report >= report_every:
+                    last_report = time.time()
+                    logger.info(f"🗓️ Diferidas '{self.stream}': {await self.metrics()}")
+            except Exception as e:
+                logger.error(f"❌ Error en el planificador de '{self.stream}': {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de links de invitación pre-generados por canal (en Redis).
+
+El hot path de `create_invite` solo hace `pop()` de un link de un uso ya
+creado y lo envía, sin las dos RPCs (get_entity + ExportChatInviteRequest)
+después del pago. Un refill en segundo plano mantiene `target` links por
+canal activo. Los links se crean con `expire_date`, así Telegram invalida
+solos los que nunca se usan, y los que están por vencer se descartan al
+hacer pop.
+
+Con varias réplicas de invitation_creator cada una corre su refill: un lock
+por canal (`invite_pool:refill:<canal_id>`, SET NX con token propio) hace
+que solo una reponga el canal a la vez, y la profundidad se vuelve a leer
+con el lock tomado para no crear links de más.
+
+Claves Redis:
+  invite_pool:<canal_id>   lista de {"link", "expires"} (RPUSH / LPOP)
+  invite_pool:refill:<id>  lock de refill del canal (expira REFILL_LOCK_TTL)
+  invite_pool:channels     zset canal -> última demanda (canales activos)
+  invite_pool:stats        hash canal -> {"depth", "refill_ms", "at"}
+"""
+import json
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from telethon import functions
+
+logger = logging.getLogger("InvitePool")
+
+CHANNELS_KEY = "invite_pool:channels"
+STATS_KEY = "invite_pool:stats"
+REFILL_LOCK_TTL = 120
+
+# KEYS: lock. ARGV: token. Solo el dueño libera el lock.
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def pool_key(canal_id) -> str:
+    return f"invite_pool:{canal_id}"
+
+
+class InvitePool:
+
+    def __init__(self, redis_conn, entity_cache, target: int = 5, link_ttl: int = 86400,
+                 min_remaining: int = 300, idle_after: int = 7 * 86400):
+        self.redis = redis_conn
+        self.entity_cache = entity_cache
+        self.target = target
+        self.link_ttl = link_ttl
+        self.min_remaining = min_remaining
+        self.idle_after = idle_after
+        self._wakeup = asyncio.Event()
+        self._release = redis_conn.register_script(RELEASE_SCRIPT)
+
+    async def pop(self, canal_id):
+        """Link listo para enviar, o None si el pool del canal está vacío."""
+        await self.redis.zadd(CHANNELS_KEY, {str(canal_id): time.time()})
+        self._wakeup.set()
+        while True:
+            raw = await self.redis.lpop(pool_key(canal_id))
+            if raw is None:
+                return None
+            entry = json.loads(raw)
+            if entry["expires"] - time.time() >= self.min_remaining:
+                return entry["link"]
+            # Vencido o a punto de vencer: se descarta (Telegram ya lo invalida solo)
+
+    async def _create_link(self, client, entity):
+        expires = datetime.now(timezone.utc) + timedelta(seconds=self.link_ttl)
+        invite = await client(functions.messages.ExportChatInviteRequest(
+            peer=entity, usage_limit=1, expire_date=expires, title='Acceso VIP'
+        ))
+        return {"link": invite.link, "expires": expires.timestamp()}
+
+    async def refill_channel(self, client, canal_id) -> int:
+        """Completa el stock de un canal. Devuelve cuántos links se crearon."""
+        key = pool_key(canal_id)
+        if await self.redis.llen(key) >= self.target:
+            return 0
+        lock, token = f"invite_pool:refill:{canal_id}", uuid.uuid4().hex
+        if not await self.redis.set(lock, token, nx=True, ex=REFILL_LOCK_TTL):
+            # Otra réplica ya lo está reponiendo
+            return 0
+        try:
+            return await self._refill_locked(client, canal_id, key)
+        finally:
+            await self._release(keys=[lock], args=[token])
+
+    async def _refill_locked(self, client, canal_id, key) -> int:
+        # Con el lock tomado: la otra réplica pudo haberlo repuesto recién
+        missing = self.target - await self.redis.llen(key)
+        if missing <= 0:
+            return 0
+
+        started = time.perf_counter()
+        entity = await self.entity_cache.input_channel(client, canal_id)
+        for _ in range(missing):
+            await self.redis.rpush(key, json.dumps(await self._create_link(client, entity)))
+        refill_ms = round((time.perf_counter() - started) * 1000, 1)
+        # Stock real: mientras se reponía pudieron consumirse links
+        depth = await self.redis.llen(key)
+
+        await self.redis.hset(STATS_KEY, str(canal_id), json.dumps({
+            "depth": depth, "refill_ms": refill_ms, "at": time.time()
+        }))
+        logger.info(f"🎟️ Pool {canal_id}: +{missing} links en {refill_ms} ms (stock {depth})")
+        return missing
+
+    async def active_channels(self) -> list:
+        # Canales sin demanda hace más de `idle_after` dejan de reponerse
+        await self.redis.zremrangebyscore(CHANNELS_KEY, 0, time.time() - self.idle_after)
+        return await self.redis.zrange(CHANNELS_KEY, 0, -1)
+
+    async def depths(self) -> dict:
+        return {c: await self.redis.llen(pool_key(c)) for c in await self.active_channels()}
+
+    async def run(self, client=None, interval: int = 60, get_client=None):
+        """Bucle de refill: corre cada `interval` s o en cuanto un pop consume un link.
+
+        Con `get_client` (corrutina) el cliente se pide en cada vuelta: en modo host
+        el monitor del pool puede haber reemplazado una conexión caída.
+        """
+        while True:
+            self._wakeup.clear()
+            try:
+                if get_client is not None:
+                    client = await get_client()
+                channels = await self.active_channels()
+            except Exception as e:
+                # Redis caído: se reintenta en la próxima vuelta sin terminar el bucle
+                logger.error(f"❌ Error preparando el refill: {e}")
+                channels = []
+            for canal_id in channels:
+                try:
+                    await self.refill_channel(client, canal_id)
+                except Exception as e:
+                    logger.error(f"❌ Error reponiendo links de {canal_id}: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                try:
+                    logger.info(f"🎟️ Profundidad de pools: {await self.depths()}")
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo leer la profundidad de los pools: {e}")
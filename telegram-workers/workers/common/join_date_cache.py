@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Caché persistente de fechas de ingreso por (channel_id, user_id).
+
+Solo se usa para los participantes cuya página de `iter_participants` no trae
+fecha (p. ej. el creador del canal): se consulta una vez con
+GetParticipantRequest y el resultado (incluso "sin fecha") queda guardado en
+SQLite para no volver a pedirlo.
+"""
+import os
+import sqlite3
+
+MISSING = object()
+
+
+class JoinDateCache:
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS join_dates ("
+            " channel_id INTEGER NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " join_date TEXT,"
+            " PRIMARY KEY (channel_id, user_id))"
+        )
+        self.conn.commit()
+
+    def get(self, channel_id: int, user_id: int):
+        """Fecha ISO guardada, None si se consultó y no tiene, o MISSING si nunca se consultó."""
+        row = self.conn.execute(
+            "SELECT join_date FROM join_dates WHERE channel_id = ? AND user_id = ?", (channel_id, user_id)
+        ).fetchone()
+        return MISSING if row is None else row[0]
+
+    def set(self, channel_id: int, user_id: int, join_date):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO join_dates (channel_id, user_id, join_date) VALUES (?, ?, ?)",
+            (channel_id, user_id, join_date)
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
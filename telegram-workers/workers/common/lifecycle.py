@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Ciclo de vida de un worker bajo deploy/run_workers_manager.py.
+
+- Readiness / liveness: `mark_ready()` escribe un latido en
+  WORKER_HEARTBEAT_FILE (lo asigna el manager por réplica) y lo renueva cada
+  WORKER_HEARTBEAT_INTERVAL s desde el event loop. El primer latido indica
+  que el worker terminó de arrancar; si deja de renovarse, el loop está
+  trabado y el manager reinicia la réplica.
+- Métricas: `mark_ready()` también abre el puerto de /metrics (METRICS_PORT,
+  ver metrics.py).
+- Drain: SIGTERM/SIGINT no matan el proceso, marcan `stopping()`. WorkQueue
+  deja de leer mensajes nuevos y espera los que están en vuelo; los bucles
+  periódicos esperan con `wait_stop()` en lugar de `asyncio.sleep()`.
+
+Sin WORKER_HEARTBEAT_FILE (docker-compose, ejecución manual) no se escribe
+ningún latido; el drain por señal funciona igual.
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+
+from . import metrics
+
+logger = logging.getLogger("Lifecycle")
+
+HEARTBEAT_FILE = os.getenv("WORKER_HEARTBEAT_FILE")
+HEARTBEAT_INTERVAL = int(os.getenv("WORKER_HEARTBEAT_INTERVAL", "10"))
+
+_stopping = None
+_heartbeat_task = None
+
+
+def stopping() -> asyncio.Event:
+    global _stopping
+    if _stopping is None:
+        _stopping = asyncio.Event()
+    return _stopping
+
+
+def request_stop():
+    if not stopping().is_set():
+        logger.info("🛑 Parada solicitada: terminando el trabajo en curso...")
+        stopping().set()
+
+
+def install_signal_handlers():
+    """SIGTERM/SIGINT -> drain. Se puede llamar varias veces."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, request_stop)
+        except (NotImplementedError, RuntimeError):
+            # Windows o fuera del hilo principal: queda el comportamiento por defecto
+            pass
+
+
+def beat():
+    if not HEARTBEAT_FILE:
+        return
+    tmp = f"{HEARTBEAT_FILE}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(time.time()))
+    os.replace(tmp, HEARTBEAT_FILE)
+
+
+async def _heartbeat():
+    while not stopping().is_set():
+        try:
+            beat()
+        except OSError as e:
+            logger.warning(f"⚠️ No se pudo escribir el latido: {e}")
+        await wait_stop(HEARTBEAT_INTERVAL)
+
+
+def mark_ready():
+    """El worker terminó de arrancar: instala el drain por señal, expone /metrics y empieza a latir."""
+    global _heartbeat_task
+    install_signal_handlers()
+    try:
+        metrics.start_server()
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudo abrir el puerto de métricas: {e}")
+    if _heartbeat_task is None:
+        _heartbeat_task = asyncio.create_task(_heartbeat())
+
+
+async def wait_stop(timeout: float) -> bool:
+    """Duerme hasta `timeout` s o hasta que se pida parar. True si hay que parar."""
+    try:
+        await asyncio.wait_for(stopping().wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    return stopping().is_set()
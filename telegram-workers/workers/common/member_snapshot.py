@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot local de miembros por canal para el metrics_tracker.
+
+Cada canal guarda un array ordenado de user IDs (int64) en
+`<dir>/<channel_id>.bin` y sus metadatos en `<dir>/<channel_id>.json`
+(último evento del admin log aplicado y fecha de la última reconciliación
+completa). Las altas/bajas de cada ciclo se calculan por diferencia contra
+este snapshot, así solo se envían deltas al backend.
+"""
+import os
+import json
+import time
+from array import array
+from bisect import bisect_left
+
+
+def departures(db_ids, current_ids) -> list:
+    """IDs registrados en la DB que ya no son miembros (O(N + M) con un set)."""
+    current = current_ids if isinstance(current_ids, (set, frozenset, MemberSnapshot)) else set(current_ids)
+    return sorted({uid for uid in db_ids if uid not in current})
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class MemberSnapshot:
+    """Conjunto ordenado de IDs de miembros de un canal."""
+
+    def __init__(self, channel_id: int, ids=(), last_event_id: int = 0, last_full_sync: float = 0.0):
+        self.channel_id = channel_id
+        self.ids = array('q', sorted(set(ids)))
+        self.last_event_id = last_event_id
+        self.last_full_sync = last_full_sync
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        i = bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def diff(self, current_ids) -> tuple:
+        """Compara contra los IDs actuales: devuelve (altas, bajas) ordenadas."""
+        current = set(current_ids)
+        previous = set(self.ids)
+        return sorted(current - previous), sorted(previous - current)
+
+    def apply(self, joined=(), left=()):
+        members = set(self.ids)
+        members.update(joined)
+        members.difference_update(left)
+        self.ids = array('q', sorted(members))
+
+    def replace(self, current_ids):
+        """Reconciliación completa: el snapshot pasa a ser exactamente `current_ids`."""
+        self.ids = array('q', sorted(set(current_ids)))
+        self.last_full_sync = time.time()
+
+    def needs_full_sync(self, interval: float) -> bool:
+        return not self.last_full_sync or time.time() - self.last_full_sync >= interval
+
+    # --- Persistencia ---
+
+    @staticmethod
+    def _paths(directory: str, channel_id: int) -> tuple:
+        base = os.path.join(directory, str(channel_id))
+        return f"{base}.bin", f"{base}.json"
+
+    @classmethod
+    def load(cls, directory: str, channel_id: int) -> "MemberSnapshot":
+        bin_path, meta_path = cls._paths(directory, channel_id)
+        snapshot = cls(channel_id)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            ids = array('q')
+            with open(bin_path, 'rb') as f:
+                ids.frombytes(f.read())
+        except (OSError, ValueError):
+            # Sin snapshot (o corrupto): se fuerza una reconciliación completa
+            return snapshot
+        snapshot.ids = ids
+        snapshot.last_event_id = meta.get('last_event_id', 0)
+        snapshot.last_full_sync = meta.get('last_full_sync', 0.0)
+        return snapshot
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        bin_path, meta_path = self._paths(directory, self.channel_id)
+        _atomic_write(bin_path, self.ids.tobytes())
+        _atomic_write(meta_path, json.dumps({
+            'last_event_id': self.last_event_id,
+            'last_full_sync': self.last_full_sync,
+            'members': len(self.ids)
+        }).encode('utf-8'))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas Prometheus de los workers (prometheus_client).
+
+Se definen una sola vez por proceso y se instrumentan en los puntos comunes:
+  - RPCs de Telegram y FloodWaits por método   -> rpc_stats.CountingTelegramClient
+  - lag de las colas (stream) y resultado        -> work_queue.WorkQueue
+  - latencia de llamadas al backend              -> backend_client.BackendClient
+  - tareas diferidas por FloodWait               -> flood_scheduler.FloodScheduler
+  - ciclo del metrics_tracker y miembros/s       -> metrics_tracker
+
+Cada worker las expone en http://0.0.0.0:<METRICS_PORT + WORKER_REPLICA>/metrics
+al llamar `lifecycle.mark_ready()`. Sin METRICS_PORT no se abre ningún puerto.
+
+En los hot paths se usa `labeled()`: cachea el hijo de cada combinación de
+labels y evita el lookup con lock de `.labels()` en cada observación
+(ver bench/metrics_overhead.py).
+"""
+import os
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger("Metrics")
+
+# Latencias de red: de 5 ms a 30 s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Lag de colas: de 10 ms a 1 h (una tarea diferida por FloodWait puede esperar mucho)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+
+TG_RPC_SECONDS = Histogram(
+    "tg_rpc_seconds", "Latencia de RPCs de Telegram", ["method"], buckets=LATENCY_BUCKETS
+)
+TG_RPC_ERRORS = Counter("tg_rpc_errors_total", "RPCs de Telegram con error", ["method", "error"])
+TG_FLOOD_WAITS = Counter("tg_flood_waits_total", "FloodWaitError recibidos", ["method"])
+TG_FLOOD_WAIT_SECONDS = Counter("tg_flood_wait_seconds_total", "Segundos de FloodWait impuestos", ["method"])
+
+QUEUE_LAG_SECONDS = Histogram(
+    "queue_lag_seconds", "Tiempo entre el XADD y el inicio del procesamiento", ["stream"], buckets=LAG_BUCKETS
+)
+QUEUE_HANDLE_SECONDS = Histogram(
+    "queue_handle_seconds", "Duración del handler por mensaje", ["stream"], buckets=LATENCY_BUCKETS
+)
+QUEUE_MESSAGES = Counter("queue_messages_total", "Mensajes procesados por resultado", ["stream", "outcome"])
+DELAYED_DEPTH = Gauge("scheduler_delayed_tasks", "Tareas diferidas por FloodWait pendientes", ["stream"])
+
+BACKEND_SECONDS = Histogram(
+    "backend_request_seconds", "Latencia de llamadas al backend", ["endpoint", "outcome"], buckets=LATENCY_BUCKETS
+)
+
+TRACKER_CYCLE_SECONDS = Histogram(
+    "tracker_cycle_seconds", "Duración de un ciclo del metrics_tracker",
+    buckets=(5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+)
+TRACKER_MEMBERS = Counter("tracker_members_scanned_total", "Miembros sincronizados por el metrics_tracker")
+TRACKER_MEMBERS_PER_SECOND = Gauge("tracker_members_per_second", "Miembros sincronizados por segundo (último ciclo)")
+
+_children = {}
+
+
+def labeled(metric, *values):
+    """`metric.labels(*values)` cacheado (el hijo no cambia durante la vida del proceso)."""
+    key = (metric, values)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*values)
+    return child
+
+
+_server_port = None
+
+
+def start_server(port: int = None):
+    """Expone /metrics en METRICS_PORT + WORKER_REPLICA (una vez por proceso)."""
+    global _server_port
+    if _server_port is not None:
+        return _server_port
+    base = port or int(os.getenv("METRICS_PORT", "0"))
+    if not base:
+        return None
+    port = base + int(os.getenv("WORKER_REPLICA", "0"))
+    start_http_server(port)
+    _server_port = port
+    logger.info(f"📊 Métricas en http://0.0.0.0:{port}/metrics")
+    return port
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Token bucket asíncrono para limitar el ritmo de RPCs de una sesión.
+
+Se comparte entre todas las tareas que usan el mismo cliente: cada RPC
+consume un token y los tokens se reponen a `rate` por segundo hasta `burst`.
+"""
+import os
+import time
+import asyncio
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: int = 1):
+        """Espera hasta que haya `tokens` disponibles y los consume."""
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+def session_governor() -> TokenBucket:
+    """Governor con la configuración del entorno (TG_RPC_RATE req/s, ráfaga TG_RPC_BURST)."""
+    return TokenBucket(float(os.getenv("TG_RPC_RATE", "10")), int(os.getenv("TG_RPC_BURST", "20")))
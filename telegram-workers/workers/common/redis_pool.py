@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente Redis compartido por proceso.
+
+Cada worker creaba su propio `aioredis.from_url(...)` a nivel de módulo (un
+ConnectionPool por módulo). Con `get_redis()` todos los módulos del proceso
+usan el mismo cliente y el mismo pool de conexiones: en un worker suelto no
+cambia nada; en worker_host.py los roles comparten las conexiones en lugar
+de abrir un pool cada uno.
+
+Uso:
+    from common.redis_pool import get_redis
+
+    redis_client = get_redis(REDIS_URL)
+"""
+import os
+
+import redis.asyncio as aioredis
+
+DEFAULT_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+_clients = {}
+
+
+def get_redis(url: str = None) -> aioredis.Redis:
+    """Cliente (decode_responses=True) de la URL, uno solo por proceso."""
+    url = url or DEFAULT_URL
+    client = _clients.get(url)
+    if client is None:
+        client = _clients[url] = aioredis.from_url(url, decode_responses=True)
+    return client
+
+
+async def close():
+    for url in list(_clients):
+        await _clients.pop(url).aclose()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación en streaming de los reportes del metrics_tracker.
+
+Cada canal tiene su archivo parcial `<dir>/parts/<channel_id>.csv`, escrito
+fila a fila mientras se recorren los participantes. El reporte global
+`metrics_data.csv` se arma concatenando los parciales. Todo se escribe en
+un `.tmp` y se reemplaza con os.replace (swap atómico), y nunca se cargan
+todas las filas en memoria.
+
+Particiones por owner: `<dir>/owners/<owner_id>.json` lista los canales del
+owner; su export es la concatenación de los parciales de esos canales (ver
+export_server.py). La versión (ETag / Last-Modified) sale del tamaño y mtime
+de los parciales abiertos, así coincide con lo que se envía.
+
+Opcional: Parquet (requiere pyarrow) y XLSX bajo demanda (openpyxl, modo
+write_only).
+"""
+import os
+import csv
+import json
+import zlib
+import shutil
+import hashlib
+
+COLUMNS = ['channel_id', 'telegram_id', 'first_name', 'username', 'join_date']
+HEADER = (",".join(COLUMNS) + "\r\n").encode()
+CHUNK_SIZE = 64 * 1024
+CSV_NAME = "metrics_data.csv"
+PARQUET_NAME = "metrics_data.parquet"
+XLSX_NAME = "metrics_data.xlsx"
+
+
+def _parts_dir(directory: str) -> str:
+    return os.path.join(directory, "parts")
+
+
+def part_path(directory: str, channel_id: int) -> str:
+    return os.path.join(_parts_dir(directory), f"{channel_id}.csv")
+
+
+class ChannelReportWriter:
+    """Escribe el CSV parcial de un canal fila a fila; se publica al cerrar sin errores."""
+
+    def __init__(self, directory: str, channel_id: int):
+        self.path = part_path(directory, channel_id)
+        self.tmp = f"{self.path}.tmp"
+        self.rows = 0
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.tmp, 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS, extrasaction='ignore')
+        self._writer.writeheader()
+        return self
+
+    def write(self, row: dict):
+        self._writer.writerow(row)
+        self.rows += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.tmp, self.path)
+        else:
+            # Escaneo interrumpido: se conserva el parcial anterior
+            os.remove(self.tmp)
+        return False
+
+
+def has_part(directory: str, channel_id: int) -> bool:
+    return os.path.exists(part_path(directory, channel_id))
+
+
+def patch_part(directory: str, channel_id: int, new_rows, left_ids):
+    """Aplica un delta (altas/bajas) al parcial de un canal, en streaming."""
+    source = part_path(directory, channel_id)
+    left = {str(uid) for uid in left_ids}
+    new_rows = list(new_rows)
+    added = {str(row["telegram_id"]) for row in new_rows}
+
+    with ChannelReportWriter(directory, channel_id) as report:
+        with open(source, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row["telegram_id"] not in left and row["telegram_id"] not in added:
+                    report.write(row)
+        for row in new_rows:
+            report.write(row)
+
+
+def assemble(directory: str, channel_ids, parquet: bool = False) -> str:
+    """Concatena los parciales de `channel_ids` en el CSV global (swap atómico)."""
+    path = os.path.join(directory, CSV_NAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', newline='', encoding='utf-8') as out:
+        csv.writer(out).writerow(COLUMNS)
+        for channel_id in channel_ids:
+            source = part_path(directory, channel_id)
+            if not os.path.exists(source):
+                continue
+            with open(source, newline='', encoding='utf-8') as f:
+                f.readline()  # cabecera del parcial
+                shutil.copyfileobj(f, out)
+    os.replace(tmp, path)
+
+    if parquet:
+        export_parquet(directory)
+    return path
+
+
+def _owners_dir(directory: str) -> str:
+    return os.path.join(directory, "owners")
+
+
+def write_owner_index(directory: str, channels_by_owner: dict):
+    """Una partición por owner: `owners/<owner>.json` con sus canales. Borra las de owners sin canales."""
+    folder = _owners_dir(directory)
+    os.makedirs(folder, exist_ok=True)
+    current = set()
+    for owner_id, channel_ids in channels_by_owner.items():
+        path = os.path.join(folder, f"{owner_id}.json")
+        current.add(os.path.basename(path))
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({"owner_id": owner_id, "channels": sorted(channel_ids)}, f)
+        os.replace(f"{path}.tmp", path)
+    for name in os.listdir(folder):
+        if name.endswith(".json") and name not in current:
+            os.remove(os.path.join(folder, name))
+
+
+def owner_channels(directory: str, owner_id) -> list:
+    """Canales de la partición del owner (None si no tiene)."""
+    try:
+        with open(os.path.join(_owners_dir(directory), f"{int(owner_id)}.json"), encoding='utf-8') as f:
+            return json.load(f)["channels"]
+    except FileNotFoundError:
+        return None
+
+
+def open_parts(directory: str, channel_ids) -> tuple:
+    """Abre los parciales existentes: ([archivos], etag, last_modified).
+
+    La versión sale de fstat de los archivos ya abiertos: si el tracker
+    reemplaza un parcial durante la descarga, se sigue enviando la versión
+    que describe el ETag.
+    """
+    files, digest, last_modified = [], hashlib.sha1(), 0.0
+    for channel_id in channel_ids:
+        try:
+            f = open(part_path(directory, channel_id), 'rb')
+        except FileNotFoundError:
+            continue
+        st = os.fstat(f.fileno())
+        digest.update(f"{channel_id}:{st.st_size}:{st.st_mtime_ns};".encode())
+        last_modified = max(last_modified, st.st_mtime)
+        files.append(f)
+    return files, f'"{digest.hexdigest()[:20]}"', last_modified
+
+
+def iter_parts(files, chunk_size: int = CHUNK_SIZE):
+    """Cabecera + cuerpo de cada parcial, en bloques (memoria constante). Cierra los archivos."""
+    try:
+        yield HEADER
+        for f in files:
+            f.readline()  # cabecera del parcial
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        for f in files:
+            f.close()
+
+
+def gzip_chunks(chunks, level: int = 6):
+    """Comprime un iterador de bytes como un único stream gzip, bloque a bloque."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def export_parquet(directory: str) -> str:
+    """Convierte el CSV global a Parquet por bloques (requiere pyarrow)."""
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    source = os.path.join(directory, CSV_NAME)
+    path = os.path.join(directory, PARQUET_NAME)
+    tmp = f"{path}.tmp"
+    column_types = {
+        'channel_id': pa.int64(),
+        'telegram_id': pa.int64(),
+        'first_name': pa.string(),
+        'username': pa.string(),
+        'join_date': pa.string()
+    }
+    reader = pv.open_csv(source, convert_options=pv.ConvertOptions(column_types=column_types))
+    with pq.ParquetWriter(tmp, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+    os.replace(tmp, path)
+    return path
+
+
+def export_xlsx(directory: str) -> str:
+    """Genera el XLSX desde el CSV global en modo write_only (bajo demanda)."""
+    from openpyxl import Workbook
+
+    source = os.path.join(directory, CSV_NAME)
+    path = os.path.join(directory, XLSX_NAME)
+    tmp = f"{path}.tmp"
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    with open(source, newline='', encoding='utf-8') as f:
+        rows = csv.reader(f)
+        sheet.append(next(rows, COLUMNS))
+        for row in rows:
+            # channel_id y telegram_id como números, igual que el export anterior
+            sheet.append([int(row[0]), int(row[1])] + row[2:])
+    workbook.save(tmp)
+    os.replace(tmp, path)
+    return path
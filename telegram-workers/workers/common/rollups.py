@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Rollups pre-agregados para los gráficos del dashboard (Redis).
+
+`/canales/metricas-historicas/{canal}` y `/metricas/balance-neto` recorrían
+todas las filas de miembros y eventos en cada request. Los rollups se
+actualizan a medida que llegan los eventos y el gráfico lee O(días) campos:
+
+  rollup:day:<canal>              hash '<YYYY-MM-DD>|altas|bajas|ingresos' -> total
+  rollup:hour:<canal>:<día>       hash '<HH>|altas|bajas' -> total (expira ROLLUP_HOURLY_TTL)
+  rollup:owner:<owner>:day        hash igual que el diario, sumando todos sus canales
+  rollup:channel:owner            hash canal -> owner (group_manager y el tracker)
+  rollup:left:<canal>:<usuario>   marca de baja ya contada (deduplica fuentes)
+
+Fuentes:
+  - altas: metrics_tracker, al aplicar el delta del admin log o la
+    reconciliación completa contra el snapshot (cada alta se cuenta una vez,
+    en el día de su fecha de ingreso)
+  - bajas: metrics_tracker, user_remover y expiry_sweeper. Una expulsión la
+    ven el worker que expulsa y luego el tracker en el admin log: la marca
+    `rollup:left:*` evita contarla dos veces
+  - ingresos: medios_pago al aplicar un pago de suscripción (ver
+    medios_pago/rollups.py, mismas claves)
+
+Todo en UTC. El neto se calcula al leer (altas - bajas).
+"""
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+
+from .entity_cache import bare_channel_id
+
+logger = logging.getLogger("Rollups")
+
+HOURLY_TTL = int(os.getenv("ROLLUP_HOURLY_TTL", str(35 * 86400)))
+LEAVE_DEDUP_TTL = int(os.getenv("ROLLUP_LEAVE_DEDUP_TTL", "86400"))
+OWNERS_KEY = "rollup:channel:owner"
+
+# KEYS: diario del canal, horario del canal, diario del owner (o "").
+# ARGV: día, hora, ttl horario, ttl de la marca, canal, usuarios...
+# Cuenta solo las bajas sin marca previa y devuelve cuántas fueron.
+LEAVES_SCRIPT = """
+local counted = 0
+for i = 6, #ARGV do
+    if redis.call('SET', 'rollup:left:' .. ARGV[5] .. ':' .. ARGV[i], 1, 'NX', 'EX', ARGV[4]) then
+        counted = counted + 1
+    end
+end
+if counted > 0 then
+    redis.call('HINCRBY', KEYS[1], ARGV[1] .. '|bajas', counted)
+    redis.call('HINCRBY', KEYS[2], ARGV[2] .. '|bajas', counted)
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    if KEYS[3] ~= '' then
+        redis.call('HINCRBY', KEYS[3], ARGV[1] .. '|bajas', counted)
+    end
+end
+return counted
+"""
+
+
+def _utc(when) -> datetime:
+    """datetime / ISO / timestamp / None (ahora) -> datetime UTC."""
+    if when is None:
+        return datetime.now(timezone.utc)
+    if isinstance(when, (int, float)):
+        return datetime.fromtimestamp(when, timezone.utc)
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when)
+    if when.tzinfo is None:
+        # Fechas sin zona (datetime.now() de los workers): hora local
+        when = when.astimezone()
+    return when.astimezone(timezone.utc)
+
+
+def buckets(when=None) -> tuple:
+    """(día 'YYYY-MM-DD', hora 'HH') UTC de un instante."""
+    moment = _utc(when)
+    return moment.strftime("%Y-%m-%d"), moment.strftime("%H")
+
+
+def day_key(channel_id) -> str:
+    return f"rollup:day:{bare_channel_id(channel_id)}"
+
+
+def hour_key(channel_id, day: str) -> str:
+    return f"rollup:hour:{bare_channel_id(channel_id)}:{day}"
+
+
+def owner_key(owner_id) -> str:
+    return f"rollup:owner:{int(owner_id)}:day"
+
+
+class Rollups:
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self._leaves = redis_conn.register_script(LEAVES_SCRIPT)
+        self._owners = {}
+
+    # --- Dueños de canal ---
+
+    async def set_owner(self, channel_id, owner_id):
+        cid = str(bare_channel_id(channel_id))
+        self._owners[cid] = str(int(owner_id))
+        await self.redis.hset(OWNERS_KEY, cid, self._owners[cid])
+
+    async def set_owners(self, mapping: dict):
+        """{canal: owner} de una vez (el tracker lo refresca desde /canales/ en cada ciclo)."""
+        mapping = {str(bare_channel_id(c)): str(int(o)) for c, o in mapping.items() if o is not None}
+        if mapping:
+            self._owners.update(mapping)
+            await self.redis.hset(OWNERS_KEY, mapping=mapping)
+
+    async def owner_of(self, channel_id):
+        cid = str(bare_channel_id(channel_id))
+        if cid not in self._owners:
+            owner = await self.redis.hget(OWNERS_KEY, cid)
+            if owner is None:
+                return None
+            self._owners[cid] = owner
+        return self._owners[cid]
+
+    # --- Escritura ---
+
+    async def record_joins(self, channel_id, join_dates):
+        """Altas del canal, cada una en el día/hora de su fecha de ingreso (None = ahora)."""
+        per_hour = {}
+        for when in join_dates:
+            bucket = buckets(when)
+            per_hour[bucket] = per_hour.get(bucket, 0) + 1
+        if not per_hour:
+            return
+        owner = await self.owner_of(channel_id)
+        per_day = {}
+        pipe = self.redis.pipeline(transaction=True)
+        for (day, hour), count in per_hour.items():
+            per_day[day] = per_day.get(day, 0) + count
+            pipe.hincrby(hour_key(channel_id, day), f"{hour}|altas", count)
+            pipe.expire(hour_key(channel_id, day), HOURLY_TTL)
+        for day, count in per_day.items():
+            pipe.hincrby(day_key(channel_id), f"{day}|altas", count)
+            if owner is not None:
+                pipe.hincrby(owner_key(owner), f"{day}|altas", count)
+        await pipe.execute()
+
+    async def record_leaves(self, channel_id, user_ids, when=None) -> int:
+        """Bajas del canal; las ya contadas por otra fuente en LEAVE_DEDUP_TTL se ignoran."""
+        user_ids = [str(int(u)) for u in user_ids]
+        if not user_ids:
+            return 0
+        day, hour = buckets(when)
+        owner = await self.owner_of(channel_id)
+        return await self._leaves(
+            keys=[day_key(channel_id), hour_key(channel_id, day), owner_key(owner) if owner else ""],
+            args=[day, hour, HOURLY_TTL, LEAVE_DEDUP_TTL, bare_channel_id(channel_id), *user_ids]
+        )
+
+    # --- Lectura (para los endpoints de gráficos) ---
+
+    @staticmethod
+    def _days(start, end) -> list:
+        first, last = _utc(start).date(), _utc(end).date()
+        return [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+
+    async def _daily(self, key, start, end, revenue: bool) -> list:
+        days = self._days(start, end)
+        kinds = ("altas", "bajas", "ingresos") if revenue else ("altas", "bajas")
+        values = await self.redis.hmget(key, [f"{d}|{k}" for d in days for k in kinds])
+        rows = []
+        for i, day in enumerate(days):
+            row = dict(zip(kinds, values[i * len(kinds):(i + 1) * len(kinds)]))
+            altas, bajas = int(row["altas"] or 0), int(row["bajas"] or 0)
+            out = {"fecha": day, "altas": altas, "bajas": bajas, "neto": altas - bajas}
+            if revenue:
+                out["ingresos"] = round(float(row["ingresos"] or 0), 2)
+            rows.append(out)
+        return rows
+
+    async def channel_daily(self, channel_id, start, end) -> list:
+        """[{fecha, altas, bajas, neto, ingresos}] por día en [start, end]."""
+        return await self._daily(day_key(channel_id), start, end, revenue=True)
+
+    async def owner_daily(self, owner_id, start, end) -> list:
+        """Lo mismo sumando todos los canales del owner (balance neto por cliente)."""
+        return await self._daily(owner_key(owner_id), start, end, revenue=True)
+
+    async def channel_hourly(self, channel_id, day) -> list:
+        """[{fecha, altas, bajas, neto}] por hora de un día (UTC)."""
+        day = _utc(day).strftime("%Y-%m-%d") if not isinstance(day, str) else day
+        raw = await self.redis.hgetall(hour_key(channel_id, day))
+        rows = []
+        for hour in range(24):
+            hh = f"{hour:02d}"
+            altas, bajas = int(raw.get(f"{hh}|altas", 0)), int(raw.get(f"{hh}|bajas", 0))
+            rows.append({"fecha": f"{day}T{hh}:00:00+00:00", "altas": altas, "bajas": bajas, "neto": altas - bajas})
+        return rows
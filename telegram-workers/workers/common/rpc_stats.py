@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Contador de RPCs de Telethon.
+
+`CountingTelegramClient` es un TelegramClient que cuenta cada request enviada
+(por nombre de método) para poder loguear cuántos RPCs usa cada ciclo, y
+registra su latencia, errores y FloodWaits en las métricas Prometheus (ver
+metrics.py). Si recibe un `governor` (ver rate_governor.TokenBucket) cada
+RPC espera su token.
+"""
+import time
+from collections import Counter
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError, RPCError
+
+from . import metrics
+
+
+class CountingTelegramClient(TelegramClient):
+    """TelegramClient que registra en `rpc_counts` cada request enviada."""
+
+    def __init__(self, *args, governor=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rpc_counts = Counter()
+        self.governor = governor
+
+    def __call__(self, request, *args, **kwargs):
+        requests = request if isinstance(request, (list, tuple)) else (request,)
+        for r in requests:
+            self.rpc_counts[type(r).__name__] += 1
+        return self._instrumented_call(requests, request, *args, **kwargs)
+
+    async def _instrumented_call(self, requests, request, *args, **kwargs):
+        if self.governor is not None:
+            await self.governor.acquire(len(requests))
+        method = type(requests[0]).__name__ if len(requests) == 1 else "batch"
+        started = time.perf_counter()
+        try:
+            return await TelegramClient.__call__(self, request, *args, **kwargs)
+        except FloodWaitError as e:
+            metrics.labeled(metrics.TG_FLOOD_WAITS, method).inc()
+            metrics.labeled(metrics.TG_FLOOD_WAIT_SECONDS, method).inc(e.seconds)
+            raise
+        except RPCError as e:
+            metrics.labeled(metrics.TG_RPC_ERRORS, method, type(e).__name__).inc()
+            raise
+        finally:
+            metrics.labeled(metrics.TG_RPC_SECONDS, method).observe(time.perf_counter() - started)
+
+    def take_rpc_counts(self) -> Counter:
+        """Devuelve los contadores acumulados y los reinicia."""
+        counts, self.rpc_counts = self.rpc_counts, Counter()
+        return counts
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Reparto del trabajo de Telegram entre varias cuentas admin.
+
+Con una sola TG_SESSION todas las creaciones, expulsiones y escaneos
+comparten el presupuesto de flood de una cuenta. Con TG_SESSIONS
+(`cuenta_a,cuenta_b,...`) cada canal se asigna a una cuenta por hashing
+consistente: todos los workers calculan el mismo dueño sin coordinarse y,
+al sumar una cuenta, solo ~1/N de los canales cambia de dueño.
+
+- Archivo de sesión de cada cuenta: `<cuenta><TG_SESSION_SUFFIX>` (cada
+  contenedor usa su sufijo, como hoy con plataforma_session_group, etc.).
+- Caché de entidades por cuenta (el access_hash es propio de cada cuenta).
+- Failover: si el dueño está en FloodWait (ver flood_scheduler.py) o
+  baneado, se usa la siguiente cuenta del anillo que sea admin del canal.
+- Rebalanceo: al agregar cuentas, `rebalance()` promueve como admin a la
+  nueva dueña de cada canal que le toca, usando una cuenta que ya lo es.
+
+Redis:
+  tg:sessions:banned     hash cuenta -> motivo
+  tg:sessions:ring       set de cuentas del último rebalanceo
+  tg:channel:sessions    hash channel_id -> cuentas admin ("a,b")
+
+Sin TG_SESSIONS todo sigue como antes: una cuenta, TG_SESSION.
+"""
+import os
+import uuid
+import asyncio
+import bisect
+import hashlib
+import logging
+
+from telethon import functions, types
+from telethon.errors import (
+    FloodWaitError, UserDeactivatedError, UserDeactivatedBanError,
+    AuthKeyUnregisteredError, SessionRevokedError, ChatAdminRequiredError
+)
+
+from .entity_cache import EntityCache, bare_channel_id
+from .flood_scheduler import FloodState, flood_method
+from .invite_pool import RELEASE_SCRIPT
+
+logger = logging.getLogger("SessionRouter")
+
+BANNED_KEY = "tg:sessions:banned"
+RING_KEY = "tg:sessions:ring"
+REBALANCE_LOCK = "tg:sessions:rebalance"
+ADMINS_KEY = "tg:channel:sessions"
+
+# Errores que dejan la cuenta inutilizable (no solo para este canal)
+BAN_ERRORS = (UserDeactivatedError, UserDeactivatedBanError, AuthKeyUnregisteredError, SessionRevokedError)
+# Errores ante los que se prueba con la siguiente cuenta (ValueError: Telethon no pudo
+# resolver la entidad desde esa cuenta, que quizá nunca vio el canal o el usuario)
+FAILOVER_ERRORS = (FloodWaitError, ChatAdminRequiredError, ValueError) + BAN_ERRORS
+
+# Derechos con los que una cuenta del pool promueve a otra
+POOL_ADMIN_RIGHTS = types.ChatAdminRights(
+    change_info=True, delete_messages=True, ban_users=True,
+    invite_users=True, pin_messages=True, add_admins=True
+)
+
+
+def configured_accounts(default: str = None) -> list:
+    """Cuentas del pool: TG_SESSIONS (separadas por coma) o, si no está, solo TG_SESSION."""
+    raw = os.getenv("TG_SESSIONS", "")
+    accounts = [a.strip() for a in raw.split(",") if a.strip()]
+    return accounts or [default or os.getenv("TG_SESSION", "plataforma_session")]
+
+
+class HashRing:
+    """Anillo de hashing consistente con `replicas` nodos virtuales por cuenta."""
+
+    def __init__(self, nodes=(), replicas: int = 64):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+    def add(self, node: str):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            bisect.insort(self._keys, h)
+            self._nodes[h] = node
+
+    def remove(self, node: str):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            self._keys.remove(h)
+            del self._nodes[h]
+
+    def walk(self, key) -> list:
+        """Cuentas en orden de preferencia para `key` (dueña primero, sin repetir)."""
+        if not self._keys:
+            return []
+        start = bisect.bisect(self._keys, self._hash(str(key)))
+        total = len(set(self._nodes.values()))
+        order = []
+        for i in range(len(self._keys)):
+            node = self._nodes[self._keys[(start + i) % len(self._keys)]]
+            if node not in order:
+                order.append(node)
+                if len(order) == total:
+                    break
+        return order
+
+    def owner(self, key) -> str:
+        order = self.walk(key)
+        return order[0] if order else None
+
+
+class NoSessionAvailable(RuntimeError):
+    """Todas las cuentas candidatas están baneadas o en FloodWait (`until` = primera que se libera).
+
+    Sin `until` no queda ninguna cuenta utilizable (todas baneadas o fuera del
+    anillo): diferir no sirve y la tarea debe tratarse como fallida.
+    """
+
+    def __init__(self, key, until: float = 0.0):
+        super().__init__(f"Sin cuenta disponible para {key}")
+        self.until = until
+
+    @property
+    def deferrable(self) -> bool:
+        return self.until > 0
+
+
+class SessionRouter:
+
+    def __init__(self, redis_conn, accounts=None, suffix: str = None, replicas: int = 64):
+        self.redis = redis_conn
+        self.accounts = list(accounts or configured_accounts())
+        self.multi = len(self.accounts) > 1 or bool(os.getenv("TG_SESSIONS"))
+        self.suffix = suffix if suffix is not None else os.getenv("TG_SESSION_SUFFIX", "")
+        self.ring = HashRing(self.accounts, replicas)
+        self.flood = FloodState(redis_conn)
+        self._caches = {}
+        self._release = redis_conn.register_script(RELEASE_SCRIPT)
+
+    def session_file(self, account: str) -> str:
+        return f"{account}{self.suffix}"
+
+    def entity_cache(self, account: str) -> EntityCache:
+        """Caché de entidades de la cuenta (con una sola cuenta, la de siempre: TG_ACCOUNT)."""
+        if account not in self._caches:
+            self._caches[account] = EntityCache(self.redis, scope=account if self.multi else None)
+        return self._caches[account]
+
+    # --- Estado de las cuentas ---
+
+    async def banned(self) -> dict:
+        return await self.redis.hgetall(BANNED_KEY)
+
+    async def mark_banned(self, account: str, reason: str):
+        await self.redis.hset(BANNED_KEY, account, reason)
+        logger.error(f"🚫 Cuenta '{account}' fuera del pool: {reason}")
+
+    async def unban(self, account: str):
+        await self.redis.hdel(BANNED_KEY, account)
+
+    async def report(self, account: str, error) -> bool:
+        """Registra el error de una cuenta. True si conviene reintentar con otra."""
+        if isinstance(error, FloodWaitError):
+            await self.flood.record(account, flood_method(error), error.seconds)
+            return True
+        if isinstance(error, BAN_ERRORS):
+            await self.mark_banned(account, type(error).__name__)
+            return True
+        # Sin permisos en el canal o entidad desconocida para esta cuenta: probar otra
+        return isinstance(error, (ChatAdminRequiredError, ValueError))
+
+    # --- Canales ---
+
+    async def admins_of(self, channel_id) -> list:
+        raw = await self.redis.hget(ADMINS_KEY, str(bare_channel_id(channel_id)))
+        return [a for a in raw.split(",") if a] if raw else []
+
+    async def set_admins(self, channel_id, accounts):
+        await self.redis.hset(ADMINS_KEY, str(bare_channel_id(channel_id)), ",".join(accounts))
+
+    async def candidates(self, key, method: str = None, channel_id=None) -> list:
+        """Cuentas para `key` en orden de anillo: sin baneadas, solo admins del canal si se
+        conocen, y las que están en FloodWait para `method` al final (por cuándo se liberan)."""
+        banned = await self.banned()
+        admins = await self.admins_of(channel_id) if channel_id is not None else []
+        ready, waiting = [], []
+        for account in self.ring.walk(key):
+            if account in banned or (admins and account not in admins):
+                continue
+            until = await self.flood.blocked_until(account, method) if method else 0.0
+            if until:
+                waiting.append((until, account))
+            else:
+                ready.append(account)
+        return ready + [a for _, a in sorted(waiting)]
+
+    async def route(self, key, method: str = None, channel_id=None) -> str:
+        """Cuenta disponible para `key`. Lanza NoSessionAvailable si todas están bloqueadas."""
+        order = await self.candidates(key, method, channel_id)
+        if not order:
+            raise NoSessionAvailable(key)
+        until = await self.flood.blocked_until(order[0], method) if method else 0.0
+        if until:
+            raise NoSessionAvailable(key, until)
+        return order[0]
+
+    async def call(self, pool, key, method: str, fn, channel_id=None):
+        """Ejecuta `fn(account, client)` con la cuenta dueña y hace failover a la siguiente
+        si la cuenta está en FloodWait, baneada o sin permisos en el canal."""
+        order = await self.candidates(key, method, channel_id)
+        if not order:
+            raise NoSessionAvailable(key)
+        last_error, flooded = None, False
+        for account in order:
+            if await self.flood.blocked_until(account, method):
+                break
+            try:
+                async with pool.acquire(self.session_file(account)) as client:
+                    return await fn(account, client)
+            except FAILOVER_ERRORS as e:
+                if not await self.report(account, e):
+                    raise
+                if isinstance(e, ChatAdminRequiredError) and channel_id is not None:
+                    admins = await self.admins_of(channel_id)
+                    if account in admins:
+                        await self.set_admins(channel_id, [a for a in admins if a != account])
+                last_error, flooded = e, flooded or isinstance(e, FloodWaitError)
+                logger.warning(f"↪️ {key}: '{account}' no disponible ({type(e).__name__}), probando la siguiente.")
+        # Si alguna cuenta solo está en FloodWait, la tarea se puede diferir; si no, el error es real
+        if last_error is not None and not flooded:
+            raise last_error
+        untils = [u for u in [await self.flood.blocked_until(a, method) for a in order] if u]
+        raise NoSessionAvailable(key, min(untils) if untils else 0.0)
+
+    async def start(self, pool, monitor: bool = True):
+        """Conecta las cuentas del pool (vigilando su salud) y rebalancea si cambió la lista."""
+        banned = await self.banned()
+        for account in self.accounts:
+            if account in banned:
+                logger.warning(f"🚫 Cuenta '{account}' marcada como baneada ({banned[account]}); se omite.")
+                continue
+            try:
+                await pool.get_client(self.session_file(account))
+                if monitor:
+                    asyncio.create_task(pool.monitor(self.session_file(account)))
+            except Exception as e:
+                logger.error(f"❌ No se pudo conectar la cuenta '{account}': {e}")
+        if self.multi:
+            # Un solo worker rebalancea aunque arranquen todos a la vez
+            token = uuid.uuid4().hex
+            if await self.redis.set(REBALANCE_LOCK, token, nx=True, ex=600):
+                try:
+                    await self.rebalance(pool)
+                finally:
+                    # Solo se libera si sigue siendo nuestro (si venció, ya puede tenerlo otro worker)
+                    await self._release(keys=[REBALANCE_LOCK], args=[token])
+
+    # --- Rebalanceo ---
+
+    async def grant_admin(self, pool, granter: str, account: str, channel_id) -> bool:
+        """`granter` (ya admin) promueve a `account` como admin del canal."""
+        async with pool.acquire(self.session_file(account)) as client:
+            me = await client.get_me()
+        async with pool.acquire(self.session_file(granter)) as client:
+            channel = await self.entity_cache(granter).input_channel(client, channel_id)
+            # El access_hash de `me` solo vale para su propia cuenta: se resuelve desde la del granter
+            user = await client.get_input_entity(me.username or me.id)
+            await client(functions.channels.EditAdminRequest(
+                channel=channel, user_id=user, admin_rights=POOL_ADMIN_RIGHTS, rank='pool'
+            ))
+        return True
+
+    async def register_channel(self, pool, creator: str, channel_id) -> list:
+        """Canal nuevo: la cuenta creadora promueve al resto del pool (para poder hacer
+        failover) y se guarda quién es admin."""
+        admins = [creator]
+        banned = await self.banned()
+        for account in self.accounts:
+            if account == creator or account in banned:
+                continue
+            try:
+                await self.grant_admin(pool, creator, account, channel_id)
+                admins.append(account)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo promover a '{account}' en {channel_id}: {e}")
+        await self.set_admins(channel_id, admins)
+        return admins
+
+    async def rebalance(self, pool) -> int:
+        """Si cambió la lista de cuentas, promueve a la nueva dueña de cada canal conocido
+        que todavía no es admin. Devuelve cuántos canales cambiaron de dueña."""
+        previous = await self.redis.smembers(RING_KEY)
+        if previous == set(self.accounts):
+            return 0
+
+        old_ring = HashRing(previous, self.ring.replicas)
+        moved = 0
+        for channel_id, raw in (await self.redis.hgetall(ADMINS_KEY)).items():
+            owner = self.ring.owner(channel_id)
+            if previous and old_ring.owner(channel_id) == owner:
+                continue
+            moved += 1
+            admins = [a for a in raw.split(",") if a]
+            if owner in admins:
+                continue
+            granters = [a for a in admins if a in self.accounts]
+            if not granters:
+                logger.warning(f"⚠️ Canal {channel_id}: ninguna cuenta del pool es admin.")
+                continue
+            try:
+                await self.grant_admin(pool, granters[0], owner, channel_id)
+                await self.set_admins(channel_id, admins + [owner])
+            except Exception as e:
+                logger.warning(f"⚠️ Rebalanceo de {channel_id} hacia '{owner}' falló: {e}")
+
+        await self.redis.delete(RING_KEY)
+        await self.redis.sadd(RING_KEY, *self.accounts)
+        logger.info(f"⚖️ Rebalanceo: {len(self.accounts)} cuentas, {moved} canales con nueva dueña.")
+        return moved
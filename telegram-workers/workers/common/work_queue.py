@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Colas de trabajo durables sobre Redis Streams + consumer groups.
+
+Reemplaza los canales PUBLISH (fire-and-forget) por streams:
+  - entrega at-least-once: un mensaje solo se borra del PEL al hacer XACK
+  - reclaim: entradas pendientes de un consumidor caído se reasignan tras `reclaim_idle_ms`
+  - N procesos del mismo grupo se reparten los mensajes (escalado horizontal)
+  - dead-letter: tras `max_deliveries` intentos el mensaje pasa a `<stream>:dead`
+
+Contrato con los publicadores (medios_pago): cada entrada del stream tiene un
+único campo `data` con el JSON de la tarea.
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+
+from redis.exceptions import ResponseError
+
+from .lifecycle import stopping
+from . import metrics
+
+logger = logging.getLogger("WorkQueue")
+
+DATA_FIELD = 'data'
+# Longitud aproximada máxima de cada stream (XADD MAXLEN ~)
+STREAM_MAXLEN = int(os.getenv("QUEUE_MAXLEN", "100000"))
+
+
+def default_consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """Productor/consumidor de un stream con consumer group (redis.asyncio)."""
+
+    def __init__(
+            self,
+            conn,
+            stream: str,
+            group: str,
+            consumer: str = None,
+            reclaim_idle_ms: int = 60000,
+            max_deliveries: int = 5,
+            batch_size: int = 10,
+            block_ms: int = 5000
+        ):
+        self.conn = conn
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or default_consumer_name()
+        self.reclaim_idle_ms = reclaim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.dead_stream = f"{stream}:dead"
+        # IDs que este proceso está procesando ahora (no deben auto-reclamarse)
+        self._active = set()
+        self._lag = metrics.labeled(metrics.QUEUE_LAG_SECONDS, stream)
+        self._duration = metrics.labeled(metrics.QUEUE_HANDLE_SECONDS, stream)
+        self._outcomes = {o: metrics.labeled(metrics.QUEUE_MESSAGES, stream, o) for o in ("ack", "error", "dead")}
+
+    async def publish(self, payload: dict) -> str:
+        return await self.conn.xadd(
+            self.stream, {DATA_FIELD: json.dumps(payload)}, maxlen=STREAM_MAXLEN, approximate=True
+        )
+
+    async def ensure_group(self):
+        try:
+            await self.conn.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+            logger.info(f"Grupo '{self.group}' creado sobre '{self.stream}'.")
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def read(self) -> list:
+        """Lee mensajes nuevos para este consumidor (bloquea hasta `block_ms`)."""
+        response = await self.conn.xreadgroup(
+            self.group, self.consumer, {self.stream: '>'}, count=self.batch_size, block=self.block_ms
+        )
+        entries = []
+        for _stream, messages in response or []:
+            entries.extend(messages)
+        return entries
+
+    async def ack(self, message_id: str):
+        await self.conn.xack(self.stream, self.group, message_id)
+
+    async def dead_letter(self, message_id: str, fields: dict, reason: str):
+        await self.conn.xadd(self.dead_stream, {
+            DATA_FIELD: (fields or {}).get(DATA_FIELD, ''),
+            'source_id': message_id,
+            'group': self.group,
+            'reason': reason[:500]
+        }, maxlen=STREAM_MAXLEN, approximate=True)
+        await self.ack(message_id)
+        self._outcomes["dead"].inc()
+        logger.error(f"☠️ Mensaje {message_id} movido a '{self.dead_stream}': {reason}")
+
+    async def reclaim(self) -> list:
+        """Reasigna a este consumidor las entradas pendientes inactivas; las agotadas van a dead-letter."""
+        pending = await self.conn.xpending_range(
+            self.stream, self.group, min='-', max='+', count=self.batch_size * 10, idle=self.reclaim_idle_ms
+        )
+        pending = [p for p in pending if p['message_id'] not in self._active]
+        if not pending:
+            return []
+
+        ids = [p['message_id'] for p in pending]
+        claimed = await self.conn.xclaim(
+            self.stream, self.group, self.consumer, min_idle_time=self.reclaim_idle_ms, message_ids=ids
+        )
+        deliveries = {p['message_id']: p['times_delivered'] for p in pending}
+
+        entries = []
+        for message_id, fields in claimed:
+            if fields is None:
+                # La entrada fue recortada del stream: solo queda limpiar el PEL
+                await self.ack(message_id)
+            elif deliveries.get(message_id, 0) >= self.max_deliveries:
+                await self.dead_letter(message_id, fields, f"{deliveries[message_id]} entregas fallidas")
+            else:
+                entries.append((message_id, fields))
+        if entries:
+            logger.warning(f"♻️ Reclamados {len(entries)} mensajes pendientes de '{self.stream}'.")
+        return entries
+
+    async def _handle(self, handler, message_id: str, fields: dict, slots: asyncio.Semaphore):
+        started = time.time()
+        # El ID del stream es el timestamp (ms) del XADD
+        self._lag.observe(max(0.0, started - int(message_id.split('-', 1)[0]) / 1000))
+        try:
+            try:
+                payload = json.loads(fields[DATA_FIELD])
+            except (KeyError, TypeError, ValueError) as e:
+                await self.dead_letter(message_id, fields, f"mensaje ilegible: {e}")
+                return
+            await handler(payload)
+            await self.ack(message_id)
+            self._outcomes["ack"].inc()
+        except Exception as e:
+            # Sin ACK: queda pendiente y se reintenta tras reclaim_idle_ms
+            self._outcomes["error"].inc()
+            logger.error(f"❌ Error procesando {message_id} de '{self.stream}': {e}")
+        finally:
+            self._duration.observe(time.time() - started)
+            self._active.discard(message_id)
+            slots.release()
+
+    async def run(self, handler, concurrency: int = 1):
+        """Bucle de consumo: `handler(payload)` async; si lanza excepción el mensaje se reintenta.
+        Termina al pedirse la parada (ver lifecycle.py), después de esperar los mensajes en vuelo."""
+        await self.ensure_group()
+        slots = asyncio.Semaphore(concurrency)
+        in_flight = set()
+        loop = asyncio.get_running_loop()
+        next_reclaim = 0.0
+
+        logger.info(f"Consumidor '{self.consumer}' escuchando '{self.stream}' (grupo '{self.group}').")
+        while not stopping().is_set():
+            entries = []
+            if loop.time() >= next_reclaim:
+                entries = await self.reclaim()
+                next_reclaim = loop.time() + self.reclaim_idle_ms / 1000 / 2
+            if not entries:
+                entries = await self.read()
+
+            for message_id, fields in entries:
+                # Backpressure: no se despacha más de `concurrency` a la vez
+                await slots.acquire()
+                self._active.add(message_id)
+                task = asyncio.create_task(self._handle(handler, message_id, fields, slots))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+
+        # Drain: lo ya leído se termina y se confirma; lo no leído queda para otras réplicas
+        if in_flight:
+            logger.info(f"⏳ Esperando {len(in_flight)} mensajes en vuelo de '{self.stream}'...")
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        logger.info(f"Consumidor '{self.consumer}' detenido.")
@@ -1,19 +1,26 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import asyncio
 import logging
-import json
-import redis
-import requests
-from telethon import TelegramClient, functions
-# Importamos FloodWaitError para capturar los límites de Telegram
-from telethon.errors import UsernameOccupiedError, FloodWaitError
-from telethon.network import ConnectionTcpAbridged
+from telethon import functions
+from telethon.errors import UsernameOccupiedError
+
+# Permite importar el paquete compartido `common` desde workers/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.client_pool import get_pool
+from common.work_queue import WorkQueue
+from common.backend_client import get_backend
+from common.flood_scheduler import FloodScheduler
+from common.session_router import SessionRouter, NoSessionAvailable
+from common.rollups import Rollups
+from common.redis_pool import get_redis
+from common import lifecycle
 
 # --- Configuración ---
-API_BACKEND_URL = os.getenv("API_BACKEND_URL", "http://localhost:8000")
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
 GROUP_QUEUE = 'group_creation_queue'
+CONSUMER_GROUP = 'group_manager'
 SESSION_ADMIN = os.getenv("TG_SESSION", "plataforma_session") # Usamos TG_SESSION
 API_ID = int(os.getenv("TG_API_ID", "0")) # Usamos TG_API_ID y valor por defecto
 API_HASH = os.getenv("TG_API_HASH") # Usamos TG_API_HASH
@@ -22,11 +29,17 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger("GroupManager")
 
 # --- Cliente Telethon y Redis ---
-redis_client = redis.StrictRedis.from_url(REDIS_URL, decode_responses=True)
+redis_client = get_redis(REDIS_URL)
+# Cuentas admin (TG_SESSIONS o solo TG_SESSION) y su caché de entidades
+router = SessionRouter(redis_client)
+# Tareas diferidas por FloodWait: vuelven a `group_creation_queue` al abrirse la ventana
+scheduler = FloodScheduler(redis_client, GROUP_QUEUE)
+# Dueño de cada canal para los rollups por owner (ingresos y balance neto)
+rollups = Rollups(redis_client)
 
 
 # Función corregida para el error 422: access_hash es str y se envía como lista.
-def notify_backend_success(
+async def notify_backend_success(
         channel_id: int, 
         owner_id: int, 
         title: str, 
@@ -34,7 +47,7 @@ def notify_backend_success(
     ):
     """Notifica a FastAPI sobre el nuevo canal creado (para guardarlo en la DB)."""
     # RUTA REQUERIDA: /canal/ (POST)
-    url = f"{API_BACKEND_URL}/canal/" 
+    url = "/canal/" 
     
     payload = {
         "id": channel_id,
@@ -45,7 +58,7 @@ def notify_backend_success(
     }
     try:
         # CORRECCIÓN: Enviar la lista directamente [payload]
-        requests.post(url, json=[payload]).raise_for_status() 
+        (await get_backend().post(url, json=[payload])).raise_for_status() 
         logger.info(f"✅ Notificación de creación de canal enviada a FastAPI.")
     except Exception as e:
         logger.error(f"❌ ERROR al notificar a la API sobre el nuevo canal: {e} for url: {url}")
@@ -53,101 +66,123 @@ def notify_backend_success(
 
 async def create_channel_task(name: str, username: str, owner_id: int, is_private: bool):
     """Crea un nuevo canal y lo asocia al owner."""
+    task = {'action': 'create_group', 'name': name, 'username': username,
+            'owner_id': owner_id, 'is_private': is_private}
+
+    async def create(account, client):
+        logger.info(f"DIAGNÓSTICO: Creando canal/supergrupo: {name} (Owner: {owner_id}, cuenta '{account}')...")
+
+        # 1. Crear el canal/supergrupo
+        result = await client(functions.channels.CreateChannelRequest(
+            title=name,
+            about=f"Canal VIP administrado por el cliente {owner_id}.",
+            megagroup=True
+        ))
+        return account, result.chats[0]
+
     try:
-        logger.info(f"DIAGNÓSTICO: Intentando conectar el cliente para Owner: {owner_id} con timeout 15s.")
-        
-        # Usa la sesión del ADMIN (única fuente de control)
-        async with TelegramClient(
-            SESSION_ADMIN, 
-            API_ID, 
-            API_HASH, 
-            timeout=15, # Aumentado el timeout
-            connection=ConnectionTcpAbridged
-        ) as client:
-            
-            logger.info("DIAGNÓSTICO: Cliente de Telethon conectado exitosamente.")
-            logger.info(f"DIAGNÓSTICO: Creando canal/supergrupo: {name} (Owner: {owner_id})...")
-            
-            # 1. Crear el canal/supergrupo
-            result = await client(functions.channels.CreateChannelRequest(
-                title=name,
-                about=f"Canal VIP administrado por el cliente {owner_id}.",
-                megagroup=True
-            ))
-            
-            new_channel = result.chats[0]
-            
-            # 2. Asignar Alias Público (si es público)
-            if not is_private:
-                await client(functions.channels.UpdateUsernameRequest(
-                    channel=new_channel,
-                    username=username
-                ))
-
-            logger.info(f"✅ CANAL CREADO: ID {new_channel.id}. Notificando a FastAPI...")
-            
-            # 3. Notificar al backend para registrar el canal en la DB
-            # CORRECCIÓN: Convertir el access_hash a STRING para FastAPI
-            notify_backend_success(
-                new_channel.id, 
-                owner_id, 
-                new_channel.title, 
-                str(new_channel.access_hash)
-            )
-            
-    # Manejo del FloodWaitError (para el error de alias)
-    except FloodWaitError as e:
-        logger.warning(f"⚠️ FloodWaitError: Espera requerida de {e.seconds} segundos. Reintentando la tarea en breve.")
-        # Programar la tarea para que se ejecute después del tiempo de espera
-        await asyncio.sleep(e.seconds + 5) 
-        # Volver a ejecutar la tarea para reintentar la asignación de alias y la notificación
-        asyncio.create_task(create_channel_task(name, username, owner_id, is_private))
-        
+        # Cuenta admin elegida por hashing del owner (con failover si está en FloodWait o baneada)
+        account, new_channel = await router.call(get_pool(), f"owner:{owner_id}", 'CreateChannelRequest', create)
+
+        logger.info(f"✅ CANAL CREADO: ID {new_channel.id}. Notificando a FastAPI...")
+
+        # El resto de workers resuelve el canal desde la caché compartida
+        await router.entity_cache(account).remember_channel(new_channel.id, new_channel.access_hash)
+        await rollups.set_owner(new_channel.id, owner_id)
+        # Promueve al resto de cuentas del pool para poder repartir y hacer failover
+        if router.multi:
+            await router.register_channel(get_pool(), account, new_channel.id)
+
+        # 2. Notificar al backend para registrar el canal en la DB
+        # CORRECCIÓN: Convertir el access_hash a STRING para FastAPI
+        await notify_backend_success(
+            new_channel.id, 
+            owner_id, 
+            new_channel.title, 
+            str(new_channel.access_hash)
+        )
+
+    # Todas las cuentas en FloodWait: se difiere la tarea completa (aún no hay canal)
+    except NoSessionAvailable as e:
+        if not e.deferrable:
+            logger.error(f"❌ ERROR FATAL al crear el canal: {e} (ninguna cuenta utilizable)")
+            return
+        await scheduler.defer(task, e.until + 5)
+        return
+    except Exception as e:
+        logger.error(f"❌ ERROR FATAL al crear el canal: {e}")
+        return
+
+    # 3. Asignar Alias Público (si es público). Paso aparte: un FloodWait aquí
+    # solo difiere el alias, sin volver a crear el canal.
+    if not is_private:
+        await assign_username_task(new_channel.id, username)
+
+
+async def assign_username_task(channel_id: int, username: str):
+    """Asigna el alias público de un canal ya creado."""
+
+    async def update(account, client):
+        channel = await router.entity_cache(account).input_channel(client, channel_id)
+        await client(functions.channels.UpdateUsernameRequest(
+            channel=channel,
+            username=username
+        ))
+
+    try:
+        await router.call(get_pool(), channel_id, 'UpdateUsernameRequest', update, channel_id=channel_id)
+        logger.info(f"✅ Alias @{username} asignado al canal {channel_id}.")
+    except NoSessionAvailable as e:
+        if not e.deferrable:
+            logger.error(f"❌ ERROR al asignar el alias @{username}: {e} (ninguna cuenta utilizable)")
+            return
+        await scheduler.defer(
+            {'action': 'assign_username', 'channel_id': channel_id, 'username': username},
+            e.until + 5
+        )
     except UsernameOccupiedError:
         logger.error(f"❌ ERROR: El alias @{username} ya está ocupado. Intenta otro.")
     except Exception as e:
-        logger.error(f"❌ ERROR FATAL al crear el canal: {e}")
+        logger.error(f"❌ ERROR al asignar el alias @{username}: {e}")
 
 
-# --- ESTRUCTURA PARA MANEJAR REDIS ASÍNCRONAMENTE ---
+# --- CONSUMO DE LA COLA (Redis Stream) ---
 
-def listen_for_tasks(loop):
-    """Función síncrona que escucha mensajes de Redis en un hilo separado."""
-    pubsub = redis_client.pubsub()
-    pubsub.subscribe(GROUP_QUEUE)
-    
-    logger.info(f"Worker de Gestión de Grupos iniciado. Escuchando: {GROUP_QUEUE}...")
-    
-    for message in pubsub.listen():
-        if message['type'] == 'message':
-            try:
-                data = json.loads(message['data'])
-                if data['action'] == 'create_group':
-                    name = data['name']
-                    username = data['username']
-                    owner_id = data['owner_id']
-                    is_private = data.get('is_private', False)
-                    
-                    logger.info(f"➡️ Tarea recibida: Crear canal '{name}' para Owner ID {owner_id}.")
-                    
-                    # Usamos call_soon_threadsafe para programar la tarea en el event loop principal
-                    loop.call_soon_threadsafe(
-                        asyncio.create_task, 
-                        create_channel_task(name, username, owner_id, is_private)
-                    )
-            except Exception as e:
-                logger.error(f"❌ ERROR al procesar mensaje de Redis: {e}")
+async def handle_task(data: dict):
+    """Procesa una tarea del stream. No se relanzan errores: crear un canal no es idempotente."""
+    if data.get('action') == 'assign_username':
+        await assign_username_task(data['channel_id'], data['username'])
+
+    elif data.get('action') == 'create_group':
+        name = data['name']
+        username = data['username']
+        owner_id = data['owner_id']
+        is_private = data.get('is_private', False)
+        
+        logger.info(f"➡️ Tarea recibida: Crear canal '{name}' para Owner ID {owner_id}.")
+        await create_channel_task(name, username, owner_id, is_private)
                 
 async def main_loop():
-    """Bucle principal que ejecuta la escucha en un thread separado."""
+    """Bucle principal: consume `group_creation_queue` con ACK tras procesar."""
     try:
-        loop = asyncio.get_running_loop()
-        # Ejecutar la función de escucha bloqueante en un thread pool (executor)
-        await loop.run_in_executor(None, listen_for_tasks, loop)
+        # Conecta las cuentas una sola vez y vigila su salud en segundo plano
+        await router.start(get_pool(), monitor=not get_pool().shared)
+        background = [asyncio.create_task(scheduler.run())]
+        if not get_pool().shared:
+            background.append(asyncio.create_task(get_backend().monitor()))
+        queue = WorkQueue(redis_client, GROUP_QUEUE, CONSUMER_GROUP)
+        lifecycle.mark_ready()
+        try:
+            await queue.run(handle_task)
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+        await get_pool().close()
         
     except Exception as e:
         logger.error(f"❌ ERROR fatal en el bucle principal: {e}")
 
 
 if __name__ == "__main__":
-    asyncio.run(main_loop())
\ No newline at end of file
+    asyncio.run(main_loop())
@@ -1,167 +1,489 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import asyncio
 import logging
 import json
-import requests
 import time
-import pandas as pd
+from collections import Counter
 from datetime import datetime
 from telethon.tl.types import Channel, User, ChannelParticipant, ChannelParticipantsSearch
 from telethon.errors import FloodWaitError
-from telethon import TelegramClient, functions
+from telethon import functions, types
 from telethon.network import ConnectionTcpAbridged
 from dotenv import load_dotenv 
 
+# Permite importar el paquete compartido `common` desde workers/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.member_snapshot import MemberSnapshot, departures
+from common.join_date_cache import JoinDateCache, MISSING
+from common.rpc_stats import CountingTelegramClient
+from common.rate_governor import session_governor
+from common import report_export, export_server
+from common.backend_client import get_backend
+from common.flood_scheduler import flood_method
+from common.session_router import SessionRouter, configured_accounts
+from common.rollups import Rollups
+from common.entity_cache import bare_channel_id
+from common.redis_pool import get_redis
+from common import lifecycle, metrics
+
 # Carga las variables de entorno
 load_dotenv()
 
 # --- Configuración y Logging ---
-API_BACKEND_URL = os.getenv("API_BACKEND_URL", "http://localhost:8000")
 SESSION_NAME = os.getenv("TG_SESSION", "mi_session")
 API_ID = int(os.getenv("TG_API_ID", "0"))
 API_HASH = os.getenv("TG_API_HASH", "")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# Snapshots de miembros por canal y cada cuánto se hace una reconciliación completa
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+FULL_SYNC_INTERVAL = int(os.getenv("FULL_SYNC_INTERVAL", str(6 * 3600)))
+# Canales escaneados en paralelo
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "4"))
+# Reportes: carpeta, Parquet opcional y tamaño de lote al sincronizar con la API
+REPORT_DIR = os.getenv("REPORT_DIR", "reportes")
+EXPORT_PARQUET = os.getenv("EXPORT_PARQUET", "0") == "1"
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "1000"))
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("MetricsTracker")
 
-# --- Funciones de Utilidad (Exportación) ---
+# Caché de entidades compartida: el tracker la alimenta con los canales y miembros que recorre
+redis_client = get_redis(REDIS_URL)
+# Cuentas admin (TG_SESSIONS o solo TG_SESSION): cada canal se escanea con su cuenta dueña.
+# Las ventanas de FloodWait quedan en Redis (sobreviven a reinicios del tracker)
+router = SessionRouter(redis_client, configured_accounts(SESSION_NAME))
+flood_state = router.flood
+# Altas/bajas por día y hora para los gráficos del dashboard (ver common/rollups.py)
+rollups = Rollups(redis_client)
+# Métodos que usa el escaneo de un canal y el listado de diálogos
+SCAN_METHODS = ('GetParticipantsRequest', 'GetAdminLogRequest')
+DIALOG_METHODS = ('GetDialogsRequest',)
 
-def update_files_export(all_users_data):
-    """Genera y actualiza los archivos CSV y Excel con los datos consolidados."""
-    CSV_FILE_PATH = "reportes/metrics_data.csv"
-    EXCEL_FILE_PATH = "reportes/metrics_data.xlsx"
-    
-    if not all_users_data:
-        return
+# --- Funciones de Utilidad (Exportación) ---
 
+def update_files_export(channel_ids, owners):
+    """Arma el CSV consolidado (y Parquet opcional) y las particiones por owner a partir de los parciales por canal."""
     try:
-        if not os.path.exists('reportes'):
-            os.makedirs('reportes')
-            
-        df = pd.DataFrame(all_users_data)
-        df = df[['channel_id', 'telegram_id', 'first_name', 'username', 'join_date']]
-        df.to_csv(CSV_FILE_PATH, index=False, encoding='utf-8')
-        df.to_excel(EXCEL_FILE_PATH, index=False, engine='openpyxl')
-        logger.info(f"✅ Reportes actualizados en carpeta 'reportes/'.")
+        report_export.assemble(REPORT_DIR, channel_ids, parquet=EXPORT_PARQUET)
+        by_owner = {}
+        for channel_id in channel_ids:
+            owner = owners.get(str(channel_id))
+            if owner is not None:
+                by_owner.setdefault(owner, []).append(channel_id)
+        report_export.write_owner_index(REPORT_DIR, by_owner)
+        logger.info(f"✅ Reportes actualizados en carpeta '{REPORT_DIR}/'.")
     except Exception as e:
         logger.error(f"❌ Error al actualizar archivos de reporte: {e}")
 
-def send_to_api_sync(endpoint, payload):
-    """Envía datos a la API de FastAPI."""
-    url = f"{API_BACKEND_URL}{endpoint}"
-    with requests.Session() as session:
-        try:
-            response = session.post(url, json=payload, timeout=10)
+async def send_to_api(endpoint, payload):
+    """Envía la lista a la API de FastAPI en lotes (upsert: se puede reintentar)."""
+    try:
+        responses = await get_backend().post_batched(endpoint, payload, batch_size=SYNC_BATCH_SIZE, idempotent=True)
+        for response in responses:
             response.raise_for_status()
-            return response.status_code
+        return 200
+    except Exception as e:
+        logger.error(f"❌ ERROR API ({endpoint}): {e}")
+        return 500
+
+# --- Escaneo de Canales ---
+
+def _user_row(user, join_date, channel):
+    return {
+        "telegram_id": user.id,
+        "first_name": user.first_name or "N/A",
+        "username": user.username or None,
+        "join_date": join_date,  
+        "channel_id": channel.id,
+        "channel_name": channel.title 
+    }
+
+async def resolve_join_date(client, channel, user_id, join_dates):
+    """Fecha de ingreso fuera de página: se consulta UNA vez y queda en la caché persistente."""
+    cached = join_dates.get(channel.id, user_id)
+    if cached is not MISSING:
+        return cached, None
+    user = None
+    try:
+        full = await client(functions.channels.GetParticipantRequest(channel=channel, participant=user_id))
+        date = getattr(full.participant, 'date', None)
+        cached = date.isoformat() if date else None
+        if full.users: user = full.users[0]
+    except FloodWaitError:
+        raise
+    except Exception:
+        return None, None
+    join_dates.set(channel.id, user_id, cached)
+    return cached, user
+
+async def iter_member_rows(client, channel, join_dates, cache):
+    """Enumeración completa de miembros (reconciliación). Produce las filas a medida que llegan."""
+    user_hashes = {}
+    async for participant in client.iter_participants(channel, limit=None, filter=ChannelParticipantsSearch('')):
+        user = None
+        join_date = None
+        user_id = None
+        membership = participant
+        
+        if isinstance(participant, User):
+            user, user_id = participant, participant.id
+            # Telethon adjunta el ChannelParticipant de la misma página (trae la fecha de ingreso)
+            membership = getattr(participant, 'participant', None)
+        elif isinstance(participant, ChannelParticipant):
+            user, user_id = getattr(participant, 'user', None), getattr(participant, 'user_id', None)
+        
+        if getattr(membership, 'date', None):
+            join_date = membership.date.isoformat()
+        
+        if user_id and join_date is None:
+            join_date, fetched_user = await resolve_join_date(client, channel, user_id, join_dates)
+            if user is None: user = fetched_user
+        
+        if isinstance(user, User) and not user.bot:
+            user_hashes[str(user.id)] = str(user.access_hash)
+            if len(user_hashes) >= SYNC_BATCH_SIZE:
+                await _remember_users(user_hashes, cache)
+            yield _user_row(user, join_date, channel)
+    await _remember_users(user_hashes, cache)
+    join_dates.commit()
+
+async def _remember_users(user_hashes, cache):
+    """Vuelca a la caché compartida los access_hash de miembros (user_remover los usa para expulsar)."""
+    if user_hashes:
+        try:
+            await cache.redis.hset(cache.users_key, mapping=user_hashes)
         except Exception as e:
-            logger.error(f"❌ ERROR API ({endpoint}): {e}")
-            return 500
+            logger.warning(f"No se pudo actualizar la caché de entidades: {e}")
+        user_hashes.clear()
+
+async def latest_admin_log_id(client, channel):
+    async for event in client.iter_admin_log(channel, limit=1):
+        return event.id
+    return 0
+
+async def scan_incremental(client, channel, snapshot):
+    """Lee el admin log desde el último evento aplicado. Devuelve (filas de altas, ids de bajas, último evento)."""
+    events = [e async for e in client.iter_admin_log(
+        channel, limit=None, min_id=snapshot.last_event_id, join=True, leave=True, invite=True, ban=True
+    )]
+    joined, left = {}, set()
+    last_event_id = snapshot.last_event_id
+
+    # El admin log viene del más nuevo al más viejo: se aplica en orden cronológico
+    for event in reversed(events):
+        last_event_id = max(last_event_id, event.id)
+        action = event.action
+        user_id, user, is_leave = event.user_id, event.user, bool(event.left)
+
+        if isinstance(action, types.ChannelAdminLogEventActionParticipantInvite):
+            # Alta hecha por un admin: el miembro es el invitado, no el autor del evento
+            user_id = getattr(action.participant, 'user_id', None)
+            user = event._entities.get(user_id)
+        elif isinstance(action, types.ChannelAdminLogEventActionParticipantToggleBan):
+            # Expulsión (p. ej. user_remover): cuenta como baja del invitado
+            if not isinstance(action.new_participant, (types.ChannelParticipantBanned, types.ChannelParticipantLeft)):
+                continue
+            user_id = getattr(action.new_participant.peer, 'user_id', None)
+            is_leave = True
+
+        if user_id is None:
+            continue
+        if is_leave:
+            left.add(user_id)
+            joined.pop(user_id, None)
+        elif isinstance(user, User) and not user.bot:
+            left.discard(user_id)
+            joined[user_id] = _user_row(user, event.date.isoformat(), channel)
+
+    new_rows = [row for uid, row in joined.items() if uid not in snapshot]
+    left_ids = sorted(uid for uid in left if uid in snapshot)
+    return new_rows, left_ids, last_event_id
+
+async def detect_db_leaves(channel_id, telegram_user_ids):
+    """Reconciliación contra la DB: miembros registrados que ya no están en Telegram."""
+    res_db = await get_backend().get(f"/canal/miembros/{channel_id}")
+    if res_db.status_code != 200:
+        return []
+    return departures((u['telegram_id'] for u in res_db.json()), telegram_user_ids)
+
+async def register_leaves(channel_id, left_ids):
+    """Registra todas las bajas del canal en una sola llamada a `/registrar-bajas`."""
+    logger.info(f"🚨 Detectadas {len(left_ids)} salidas en canal {channel_id}")
+    backend = get_backend()
+    res = await backend.post("/registrar-bajas", json={
+        "canal_id": channel_id,
+        "usuarios": list(left_ids)
+    }, timeout=30)
+    if res.status_code not in (404, 405):
+        res.raise_for_status()
+        return
+
+    # Backend sin endpoint masivo: se registra una por una
+    for db_id in left_ids:
+        await backend.post("/registrar-baja", params={
+            "usuario_id": db_id,
+            "canal_id": channel_id
+        })
+
+async def refresh_owners(owners: dict) -> dict:
+    """Dueño de cada canal desde el backend (una consulta por ciclo) para los rollups y las
+    exportaciones por owner. Si el backend falla se conserva el mapa anterior."""
+    try:
+        res = await get_backend().get("/canales/")
+        if res.status_code == 200:
+            fresh = {str(bare_channel_id(c["canal_id"])): str(c["owner_id"])
+                     for c in res.json() if c.get("canal_id") and c.get("owner_id") is not None}
+            await rollups.set_owners(fresh)
+            return fresh
+    except Exception as e:
+        logger.warning(f"No se pudieron actualizar los dueños de canal: {e}")
+    return owners
+
+async def update_rollups(channel_id, joined_at, left_ids):
+    try:
+        await rollups.record_joins(channel_id, joined_at)
+        await rollups.record_leaves(channel_id, left_ids)
+    except Exception as e:
+        logger.warning(f"No se pudo actualizar los rollups de {channel_id}: {e}")
 
 # --- Lógica Principal Integrada ---
 
-async def track_metrics_loop():
-    logger.info("Iniciando bucle de rastreo de métricas...")
-    
-    client = TelegramClient(
-        SESSION_NAME, 
-        API_ID, 
-        API_HASH, 
-        timeout=15, 
-        connection=ConnectionTcpAbridged
-    )
-
-    while True:
+async def process_channel(client, channel, join_dates, cache):
+    """Sincroniza un canal (delta o reconciliación completa). Devuelve (usuarios enviados, bajas)."""
+    loop = asyncio.get_running_loop()
+    snapshot = MemberSnapshot.load(SNAPSHOT_DIR, channel.id)
+    full_sync = snapshot.needs_full_sync(FULL_SYNC_INTERVAL) or not report_export.has_part(REPORT_DIR, channel.id)
+
+    if not full_sync:
+        try:
+            new_rows, left_ids, last_event_id = await scan_incremental(client, channel, snapshot)
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            # Sin acceso al admin log: se cae a la enumeración completa
+            logger.warning(f"Admin log no disponible en {channel.id} ({e}). Reconciliación completa.")
+            full_sync = True
+
+    if full_sync:
+        logger.info(f"Procesando (completo): {channel.title} (ID: {channel.id})")
+        # Se toma el último evento ANTES de enumerar para no perder cambios intermedios
+        try:
+            last_event_id = await latest_admin_log_id(client, channel)
+        except FloodWaitError:
+            raise
+        except Exception:
+            last_event_id = 0
+
+        # 1. Recorrer miembros: cada fila va al reporte y a la API por lotes (memoria constante)
+        telegram_user_ids = set()
+        # Altas = miembros que no estaban en el snapshot (la primera vez, todos: backfill)
+        joined_at = []
+        batch = []
+        sent = 0
+        with report_export.ChannelReportWriter(REPORT_DIR, channel.id) as report:
+            async for row in iter_member_rows(client, channel, join_dates, cache):
+                telegram_user_ids.add(row["telegram_id"])
+                if row["telegram_id"] not in snapshot:
+                    joined_at.append(row["join_date"])
+                report.write(row)
+                batch.append(row)
+                if len(batch) >= SYNC_BATCH_SIZE:
+                    await send_to_api("/sincronizar-metricas", batch)
+                    sent += len(batch)
+                    batch = []
+        if batch:
+            await send_to_api("/sincronizar-metricas", batch)
+            sent += len(batch)
+
+        # 2. DETECTAR BAJAS (Comparar DB vs Telegram)
+        try:
+            left_ids = await detect_db_leaves(channel.id, telegram_user_ids)
+        except Exception as e:
+            logger.error(f"Error detectando bajas: {e}")
+            left_ids = []
+        snapshot.replace(telegram_user_ids)
+    else:
+        logger.info(f"Procesando (delta): {channel.title} (ID: {channel.id}) "
+                    f"+{len(new_rows)} / -{len(left_ids)}")
+        snapshot.apply((u["telegram_id"] for u in new_rows), left_ids)
+        if new_rows or left_ids:
+            await loop.run_in_executor(None, report_export.patch_part, REPORT_DIR, channel.id, new_rows, left_ids)
+        if new_rows:
+            await send_to_api("/sincronizar-metricas", new_rows)
+        sent = len(new_rows)
+        joined_at = [row["join_date"] for row in new_rows]
+
+    if left_ids:
+        try:
+            await register_leaves(channel.id, left_ids)
+        except Exception as e:
+            logger.error(f"Error registrando bajas: {e}")
+
+    await update_rollups(channel.id, joined_at, left_ids)
+    snapshot.last_event_id = last_event_id
+    snapshot.save(SNAPSHOT_DIR)
+    return sent, len(left_ids)
+
+async def scan_channel_guarded(client, account, channel, join_dates, slots, timings):
+    """Ejecuta un canal bajo el semáforo. Un FloodWait no duerme el slot: se registra y el
+    canal (y los que sigan en la misma ventana) pasan al próximo ciclo."""
+    async with slots:
+        started = time.perf_counter()
+        flood_wait = 0
+        sent, leaves = 0, 0
+        try:
+            if await flood_state.blocked_any(account, SCAN_METHODS):
+                logger.info(f"⏭️ {channel.id}: cuenta '{account}' en FloodWait, se escanea en el próximo ciclo.")
+            else:
+                sent, leaves = await process_channel(client, channel, join_dates, router.entity_cache(account))
+        except FloodWaitError as e:
+            logger.warning(f"⏳ FloodWait de {e.seconds}s en {channel.id}; el resto de canales sigue.")
+            flood_wait = e.seconds
+            await flood_state.record(account, flood_method(e), e.seconds)
+        except Exception as e:
+            logger.error(f"Error procesando canal {channel.id}: {e}")
+        timings[str(channel.id)] = {
+            "title": channel.title,
+            "account": account,
+            "seconds": round(time.perf_counter() - started, 3),
+            "flood_wait_seconds": flood_wait,
+            "users_sent": sent,
+            "leaves": leaves,
+            "finished_at": datetime.now().isoformat()
+        }
+        return sent, leaves
+
+def write_channel_timings(timings):
+    """Publica los tiempos por canal del último ciclo (para ajustar SCAN_CONCURRENCY)."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(SNAPSHOT_DIR, "channel_timings.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(timings, f, ensure_ascii=False, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+async def discover_channels(clients) -> list:
+    """Canales administrados por cada cuenta -> [(cuenta, canal)], un canal por su cuenta dueña
+    (hashing consistente) o, si está en FloodWait, por la siguiente que también lo administra."""
+    views = {}
+    banned = await router.banned()
+    for account, client in clients.items():
+        # Cuenta baneada o con get_dialogs en FloodWait: sus canales los cubren las demás
+        if account in banned or await flood_state.blocked_any(account, DIALOG_METHODS):
+            continue
         try:
             if not client.is_connected():
                 await client.start()
-                
-            logger.info("Sincronizando canales administrados...")
             dialogs = await client.get_dialogs()
-            target_channels = [d.entity for d in dialogs if isinstance(d.entity, Channel) and d.entity.admin_rights]
+        except FloodWaitError as e:
+            await flood_state.record(account, flood_method(e), e.seconds)
+            continue
+        except Exception as e:
+            if await router.report(account, e):
+                continue
+            raise
+        owned = [d.entity for d in dialogs if isinstance(d.entity, Channel) and d.entity.admin_rights]
+        try:
+            await router.entity_cache(account).remember(*owned)
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar la caché de entidades: {e}")
+        for channel in owned:
+            views.setdefault(channel.id, {})[account] = channel
+
+    assignments = []
+    for channel_id, view in views.items():
+        order = [a for a in await router.candidates(channel_id, SCAN_METHODS[0]) if a in view]
+        account = order[0] if order else next(iter(view))
+        assignments.append((account, view[account]))
+    return assignments
+
+async def pooled_clients(pool) -> dict:
+    """Clientes del pool compartido (worker_host.py). Se piden en cada ciclo: si el
+    monitor del pool descartó una conexión caída, el ciclo usa la nueva."""
+    return {account: await pool.get_client(router.session_file(account)) for account in router.accounts}
+
+async def track_metrics_loop(pool=None):
+    """Con `pool` (worker_host.py) usa los clientes compartidos en lugar de abrir los suyos."""
+    logger.info("Iniciando bucle de rastreo de métricas...")
+    
+    if pool is not None:
+        clients = await pooled_clients(pool)
+    else:
+        clients = {
+            account: CountingTelegramClient(
+                router.session_file(account), 
+                API_ID, 
+                API_HASH, 
+                timeout=15, 
+                connection=ConnectionTcpAbridged,
+                governor=session_governor()
+            )
+            for account in router.accounts
+        }
+    join_dates = JoinDateCache(os.path.join(SNAPSHOT_DIR, "join_dates.sqlite3"))
+    # SCAN_CONCURRENCY por cuenta: cada una tiene su propio presupuesto de flood
+    slots = {account: asyncio.Semaphore(SCAN_CONCURRENCY) for account in clients}
+    owners = {}
+    lifecycle.mark_ready()
+    # Descargas CSV por owner desde los parciales (EXPORT_PORT; ver common/export_server.py)
+    try:
+        export_server.start(REPORT_DIR)
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudo abrir el puerto de exportaciones: {e}")
+
+    while not lifecycle.stopping().is_set():
+        try:
+            logger.info("Sincronizando canales administrados...")
+            if pool is not None:
+                clients = await pooled_clients(pool)
+            assignments = await discover_channels(clients)
+            owners = await refresh_owners(owners)
                         
-            if not target_channels:
-                logger.warning("No se encontraron canales como administrador. Reintentando en 5m.")
-                await asyncio.sleep(300)
+            if not assignments:
+                logger.warning("No se encontraron canales como administrador (o todas las cuentas están en FloodWait). Reintentando en 5m.")
+                await lifecycle.wait_stop(300)
                 continue
             
-            total_users_sent = 0
-            all_users_for_export = [] 
             loop = asyncio.get_event_loop()
+            cycle_started = time.perf_counter()
+            timings = {}
+            results = await asyncio.gather(*(
+                scan_channel_guarded(clients[account], account, channel, join_dates, slots[account], timings)
+                for account, channel in assignments
+            ))
+            total_users_sent = sum(sent for sent, _ in results)
+            total_leaves = sum(leaves for _, leaves in results)
+            cycle_seconds = time.perf_counter() - cycle_started
+            metrics.TRACKER_CYCLE_SECONDS.observe(cycle_seconds)
+            metrics.TRACKER_MEMBERS.inc(total_users_sent)
+            metrics.TRACKER_MEMBERS_PER_SECOND.set(total_users_sent / cycle_seconds if cycle_seconds else 0)
             
-            for channel in target_channels:
-                user_list = []
-                telegram_user_ids = [] # Para comparar con la DB
-                channel_name = channel.title
-                
-                logger.info(f"Procesando: {channel_name} (ID: {channel.id})")
-                
-                # 1. Obtener miembros actuales de Telegram
-                async for participant in client.iter_participants(channel, limit=None, filter=ChannelParticipantsSearch('')):
-                    user = None
-                    join_date = None
-                    user_id = None
-                    
-                    if isinstance(participant, User):
-                        user, user_id = participant, participant.id
-                    elif isinstance(participant, ChannelParticipant):
-                        user, user_id = getattr(participant, 'user', None), getattr(participant, 'user_id', None)
-                    
-                    if hasattr(participant, 'date') and participant.date:
-                        join_date = participant.date.isoformat()
-                    
-                    if user_id and join_date is None:
-                        try:
-                            full = await client(functions.channels.GetParticipantRequest(channel=channel, participant=user_id))
-                            if full.participant.date: join_date = full.participant.date.isoformat()
-                            if user is None and full.users: user = full.users[0]
-                        except: pass
-                    
-                    if isinstance(user, User) and not user.bot:
-                        telegram_user_ids.append(user.id)
-                        user_list.append({
-                            "telegram_id": user.id,
-                            "first_name": user.first_name or "N/A",
-                            "username": user.username or None,
-                            "join_date": join_date,  
-                            "channel_id": channel.id,
-                            "channel_name": channel_name 
-                        })
-
-                # 2. DETECTAR BAJAS (Comparar DB vs Telegram)
-                try:
-                    res_db = requests.get(f"{API_BACKEND_URL}/canal/miembros/{channel.id}")
-                    if res_db.status_code == 200:
-                        db_users = res_db.json()
-                        db_user_ids = [u['telegram_id'] for u in db_users]
-                        
-                        for db_id in db_user_ids:
-                            # Si está en la DB pero ya no aparece en Telegram
-                            if db_id not in telegram_user_ids:
-                                logger.info(f"🚨 Detectada salida de {db_id} en canal {channel.id}")
-                                requests.post(f"{API_BACKEND_URL}/registrar-baja", params={
-                                    "usuario_id": db_id,
-                                    "canal_id": channel.id
-                                })
-                except Exception as e:
-                    logger.error(f"Error detectando bajas: {e}")
-
-                # 3. Sincronizar Altas y reporte
-                if user_list:
-                    all_users_for_export.extend(user_list)
-                    await loop.run_in_executor(None, lambda: send_to_api_sync("/sincronizar-metricas", user_list))
-                    total_users_sent += len(user_list)
-            
-            await loop.run_in_executor(None, lambda: update_files_export(all_users_for_export))
-            logger.info(f"Ciclo completado. Usuarios sincronizados: {total_users_sent}.")
-            await asyncio.sleep(300) 
+            await loop.run_in_executor(None, update_files_export, [c.id for _, c in assignments], owners)
+            await loop.run_in_executor(None, write_channel_timings, timings)
+            rpc_counts = sum((c.take_rpc_counts() for c in clients.values()), Counter())
+            for label, data in get_backend().histograms().items():
+                logger.info(f"📈 {label}: n={data['count']} err={data['errors']} avg={data['avg_ms']}ms")
+            slowest = max(timings.items(), key=lambda kv: kv[1]["seconds"])
+            logger.info(f"Ciclo completado en {cycle_seconds:.1f}s "
+                        f"({len(assignments)} canales, {len(clients)} cuentas, concurrencia {SCAN_CONCURRENCY}, "
+                        f"más lento: {slowest[0]} {slowest[1]['seconds']}s). "
+                        f"Usuarios sincronizados: {total_users_sent}. Bajas: {total_leaves}. "
+                        f"RPCs: {sum(rpc_counts.values())} {dict(rpc_counts)}")
+            await lifecycle.wait_stop(300)
             
-        except FloodWaitError as e:
-            await asyncio.sleep(e.seconds)
         except Exception as e:
             logger.error(f"Error en bucle: {e}")
-            await asyncio.sleep(60)
+            await lifecycle.wait_stop(60)
+
+    if pool is None:
+        for client in clients.values():
+            await client.disconnect()
+    join_dates.close()
 
 if __name__ == "__main__":
-    asyncio.run(track_metrics_loop())
\ No newline at end of file
+    if "--xlsx" in sys.argv:
+        # XLSX bajo demanda: python metrics_tracker.py --xlsx
+        print(report_export.export_xlsx(REPORT_DIR))
+    else:
+        asyncio.run(track_metrics_loop())
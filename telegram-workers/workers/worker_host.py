@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Host multi-rol: varios workers como tareas de un solo proceso asyncio.
+
+Cada worker (group_manager, invitation_creator, user_remover,
+expiry_sweeper, metrics_tracker) es un proceso con su propio intérprete,
+Telethon y cliente Redis. En un VPS chico eso es buena parte del límite de
+memoria del contenedor. El host importa los roles elegidos y los corre en
+el mismo event loop:
+
+  - Un solo Telegram client por sesión: todos usan el ClientPool del proceso
+    (ver ClientPool.share) con la sesión `<TG_SESSION><TG_SESSION_SUFFIX>`,
+    con un governor común (TG_RPC_RATE / TG_RPC_BURST para toda la cuenta).
+  - Un solo pool de conexiones Redis (common/redis_pool.py).
+  - Dominios de falla separados: si el main de un rol termina con una
+    excepción (o sin que se haya pedido parar) se cancelan solo las tareas
+    que ese rol creó y se reinicia solo ese rol, con backoff exponencial
+    (ROLE_BACKOFF_INITIAL / ROLE_BACKOFF_MAX; vuelve al inicial si el rol
+    vivió ROLE_STABLE_AFTER s). Los demás roles no se enteran.
+  - Monitores de salud (uno por sesión y uno del backend) los arranca el
+    host una sola vez; los roles ven `pool.shared` y no arrancan los suyos.
+  - Ciclo de vida: un latido y un /metrics para el proceso (lifecycle.py);
+    SIGTERM drena todos los roles a la vez. Si un rol bloquea el loop, deja
+    de latir el host entero y el manager lo reinicia.
+
+Roles: argumentos o WORKER_ROLES (separados por coma); sin ninguno, todos.
+
+    python worker_host.py user_remover group_manager
+
+Con run_workers_manager.py: WORKERS_MANIFEST=deploy/workers.host.json.
+Comparación de memoria contra un proceso por rol: bench/worker_host_memory.py.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import weakref
+import importlib
+import contextvars
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.client_pool import get_pool
+from common.backend_client import get_backend
+from common.rate_governor import session_governor
+from common.session_router import SessionRouter
+from common import lifecycle, redis_pool
+
+# rol -> (módulo, función main, ¿recibe el pool compartido?)
+ROLES = {
+    "group_manager": ("group_manager.group_manager", "main_loop", False),
+    "invitation_creator": ("channel_manager.invitation_creator", "main", True),
+    "user_remover": ("channel_manager.user_remover", "main", False),
+    "expiry_sweeper": ("channel_manager.expiry_sweeper", "main", False),
+    "metrics_tracker": ("metrics_tracker.metrics_tracker", "track_metrics_loop", True),
+}
+
+BACKOFF_INITIAL = float(os.getenv("ROLE_BACKOFF_INITIAL", "1"))
+BACKOFF_MAX = float(os.getenv("ROLE_BACKOFF_MAX", "300"))
+STABLE_AFTER = float(os.getenv("ROLE_STABLE_AFTER", "60"))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("WorkerHost")
+
+# Rol dueño del contexto actual: lo heredan las tareas que el rol crea
+_role = contextvars.ContextVar("worker_role", default=None)
+_role_tasks = {}
+
+
+def _task_factory(loop, coro, **kwargs):
+    """Anota cada tarea con el rol que la creó, para cancelarlas si ese rol se cae."""
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    role = _role.get()
+    if role is not None:
+        _role_tasks.setdefault(role, weakref.WeakSet()).add(task)
+    return task
+
+
+async def _cancel_role_tasks(role: str):
+    tasks = [t for t in _role_tasks.pop(role, ()) if not t.done()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def selected_roles(argv: list) -> list:
+    names = argv or [r.strip() for r in os.getenv("WORKER_ROLES", "").split(",") if r.strip()]
+    names = names or list(ROLES)
+    unknown = [n for n in names if n not in ROLES]
+    if unknown:
+        raise SystemExit(f"Roles desconocidos: {', '.join(unknown)} (disponibles: {', '.join(ROLES)})")
+    return list(dict.fromkeys(names))
+
+
+async def supervise(role: str, entry, pool):
+    """Corre el main del rol y lo reinicia (solo a él) si falla, hasta que se pida parar."""
+    _role.set(role)
+    backoff = BACKOFF_INITIAL
+    while not lifecycle.stopping().is_set():
+        started = time.monotonic()
+        try:
+            await (entry(pool=pool) if pool is not None else entry())
+            if lifecycle.stopping().is_set():
+                break
+            logger.warning(f"⚠️ El rol '{role}' terminó sin que se pidiera parar.")
+        except Exception:
+            logger.exception(f"❌ El rol '{role}' falló")
+        finally:
+            await _cancel_role_tasks(role)
+        if time.monotonic() - started >= STABLE_AFTER:
+            backoff = BACKOFF_INITIAL
+        logger.info(f"🔁 Reiniciando '{role}' en {backoff:.0f}s...")
+        if await lifecycle.wait_stop(backoff):
+            break
+        backoff = min(backoff * 2, BACKOFF_MAX)
+    logger.info(f"✅ Rol '{role}' detenido.")
+
+
+async def start_monitors(pool) -> list:
+    """Salud de cada sesión no baneada y del backend, una sola vez para todos los roles."""
+    router = SessionRouter(redis_pool.get_redis())
+    banned = await router.banned()
+    monitors = [asyncio.create_task(get_backend().monitor())]
+    for account in router.accounts:
+        if account not in banned:
+            monitors.append(asyncio.create_task(pool.monitor(router.session_file(account))))
+    return monitors
+
+
+async def main(roles: list):
+    entries = {}
+    for role in roles:
+        module, func, takes_pool = ROLES[role]
+        entries[role] = (getattr(importlib.import_module(module), func), takes_pool)
+
+    pool = get_pool()
+    pool.share(governor_factory=session_governor)
+    asyncio.get_running_loop().set_task_factory(_task_factory)
+    # Latido y /metrics del host (fuera de cualquier rol: no se cancelan con sus reinicios)
+    lifecycle.mark_ready()
+    monitors = await start_monitors(pool)
+    logger.info(f"🚀 Host con {len(roles)} roles: {', '.join(roles)}")
+
+    await asyncio.gather(*(
+        supervise(role, entry, pool if takes_pool else None) for role, (entry, takes_pool) in entries.items()
+    ))
+    for task in monitors:
+        task.cancel()
+    await asyncio.gather(*monitors, return_exceptions=True)
+    await pool.close(force=True)
+    await redis_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(selected_roles(sys.argv[1:])))